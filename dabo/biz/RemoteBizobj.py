@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import pickle
 import os
 import time
 
@@ -7,6 +6,7 @@ import dabo
 from dabo.dLocalize import _
 import dabo.dConstants as kons
 from dabo.lib.connParser import importConnections
+from dabo.lib import dataCodec
 import dabo.dException as dException
 from dBizobj import dBizobj
 
@@ -14,6 +14,8 @@ from dBizobj import dBizobj
 
 class RemoteBizobj(dBizobj):
 	cacheDir = None
+	# Number of data set versions per client bizobj that deltas can be made from.
+	maxDataVersions = 3
 
 	def _beforeInit(self):
 		return super(RemoteBizobj, self)._beforeInit()
@@ -58,13 +60,18 @@ class RemoteBizobj(dBizobj):
 		cls._createCacheDir(pth)
 		pth = os.path.join(cls.cacheDir, hashval)
 		if os.path.exists(pth):
-			f = file(pth)
-			kf, crsData = pickle.load(f)
+			f = file(pth, "rb")
+			enc = f.read()
 			f.close()
+			if not dataCodec.isEncoded(enc):
+				# Written by an older version; it will be replaced.
+				return biz
+			kf, crsData = dataCodec.decodeValue(enc)
 			biz.KeyField = kf
 			# This is a dict with cursor keys as the keys, and
-			# values as a (dataset, typedef) tuple.
-			for kk, (ds, typinfo) in crsData.items():
+			# encoded data sets as the values.
+			for kk, encData in crsData.items():
+				ds, typinfo, stru = dataCodec.decodeDataSet(encData)
 				tmpCursor = biz.createCursor(key=kk)
 				tmpCursor._storeData(ds, typinfo)
 		return biz
@@ -96,16 +103,110 @@ class RemoteBizobj(dBizobj):
 		"""
 		self._createCacheDir()
 		pth = os.path.join(self.cacheDir, hashval)
-		f = file(pth, "w")
 		pd = {}
 		cursorDict = self._cursorDictReference()
 		for kk, cursor in cursorDict.items():
-			pd[kk] = (cursor.getDataSet(returnInternals=True), cursor.getDataTypes())
+			# The whole cache entry is compressed at once.
+			pd[kk] = dataCodec.encodeDataSet(cursor.getDataSet(returnInternals=True),
+					cursor.getDataTypes(), compressLevel=0)
 		dataToStore = (self.KeyField, pd)
-		pickle.dump(dataToStore, f)
+		f = file(pth, "wb")
+		f.write(dataCodec.encodeValue(dataToStore))
 		f.close()
 
 
+	def getEncodedDataSet(self):
+		"""Return the data, types and structure of the current cursor, encoded
+		for sending to a RemoteConnector.
+		"""
+		crs = self._CurrentCursor
+		return dataCodec.encodeDataSet(crs.getDataSet(),
+				crs.getDataTypes(), self.DataStructure)
+
+
+	def getRequeryResponse(self, clientVersion=None):
+		"""Return the response to a requery from a RemoteConnector, as a tuple of
+		the encoded data and the version of the data set, which is sent to the
+		client as the ETag header.
+
+		'clientVersion' is the version that the client already has, from its
+		If-None-Match header. If the data hasn't changed since, the data
+		returned is None, for a 304 Not Modified response. If the client's
+		version is one of the last 'maxDataVersions' sent to this client
+		bizobj, only the changed records are sent (see dataCodec.isDelta()).
+		Otherwise the full data set is sent.
+		"""
+		crs = self._CurrentCursor
+		data = crs.getDataSet()
+		typs = crs.getDataTypes()
+		stru = self.DataStructure
+		version, sigs = dataCodec.getDataSignatures(data, self.KeyField, typs, stru)
+		if clientVersion == version:
+			return None, version
+		versions = self._loadDataVersions()
+		ret = None
+		for baseVersion, baseSigs in versions:
+			if baseVersion == clientVersion:
+				ret = dataCodec.encodeDataDelta(data, self.KeyField, version, sigs,
+						baseVersion, baseSigs, typs, stru)
+				break
+		if ret is None:
+			ret = dataCodec.encodeDataSet(data, typs, stru)
+		versions = [(version, sigs)] + [itm for itm in versions if itm[0] != version]
+		self._storeDataVersions(versions[:self.maxDataVersions])
+		return ret, version
+
+
+	def _dataVersionsPath(self):
+		if not self.hashval:
+			return None
+		self._createCacheDir()
+		return os.path.join(self.cacheDir, "%s.versions" % self.hashval)
+
+
+	def _loadDataVersions(self):
+		"""Return the (version, signatures) of the data sets last sent to the client."""
+		pth = self._dataVersionsPath()
+		if not pth or not os.path.exists(pth):
+			return []
+		f = file(pth, "rb")
+		enc = f.read()
+		f.close()
+		try:
+			return [tuple(itm) for itm in dataCodec.decodeValue(enc)]
+		except (ValueError, TypeError):
+			return []
+
+
+	def _storeDataVersions(self, versions):
+		pth = self._dataVersionsPath()
+		if pth:
+			f = file(pth, "wb")
+			f.write(dataCodec.encodeValue(versions))
+			f.close()
+
+
+	@staticmethod
+	def decodeDataDiff(enc):
+		"""Decode a diff sent by a RemoteConnector, either in the binary format of
+		dabo.lib.dataCodec or as JSON, into the dict expected by applyDiffAndSave().
+		"""
+		if not dataCodec.isEncoded(enc):
+			return dabo.lib.jsonDecode(enc)
+
+		def strKeys(diff):
+			# The hash values are ints on the client, but strings on the server,
+			# as they were when diffs were always sent as JSON.
+			ret = {}
+			for hashval, (ds, kf, changes, kids) in diff.items():
+				ret[str(hashval)] = (ds, kf, changes, strKeys(kids or {}))
+			return ret
+		try:
+			return strKeys(dataCodec.decodeValue(enc))
+		except (AttributeError, TypeError):
+			raise ValueError(_("Invalid data diff."))
+
+
 	def storeRemoteSQL(self, sql):
 		"""The web backend uses '~~' as the name enclosure character. Convert that
 		to the correct character for the actual backend.
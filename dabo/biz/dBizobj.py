@@ -2,13 +2,17 @@
 import types
 import re
 import warnings
+import threading
 import time
 import dabo
 import dabo.dConstants as kons
 from dabo.db.dCursorMixin import dCursorMixin
+from dabo.db.dDataSet import dDataSet
+from dabo.db.dDataWindow import dDataWindow
 from dabo.dLocalize import _
 from dabo.lib.utils import ustr
 import dabo.dException as dException
+import dabo.dEvents as dEvents
 from dabo.dObject import dObject
 from dabo.lib.RemoteConnector import RemoteConnector
 
@@ -36,6 +40,13 @@ class dBizobj(dObject):
 		self.__cursors = {}
 		# PK of the currently-selected cursor
 		self.__currentCursorKey = None
+		# Keys of the cursors filled by the parent's prefetchChildren()
+		self.__prefetchedKeys = set()
+		# The asynchronous requery that is running, and the idle connection
+		# kept for the next one.
+		self._requeryJob = None
+		self._requeryConnection = None
+		self._requeryLock = threading.Lock()
 		# Description of the data represented by this bizobj
 		self._dataStructure = None
 		self._dataSource = self._dataSourceName = ""
@@ -81,6 +92,7 @@ class dBizobj(dObject):
 		# Various attributes used for Properties
 		self._caption = ""
 		self._nonUpdateFields = []
+		self._indexedFields = set()
 		self._scanRestorePosition = True
 		self._scanRequeryChildren = True
 		self._scanReverse = False
@@ -88,6 +100,11 @@ class dBizobj(dObject):
 		self._parent = None
 		self._autoPopulatePK = True
 		self._autoQuoteNames = True
+		self._autoPrefetchChildren = False
+		self._batchSave = False
+		# Keys of the rows saved in a batch, while saveAll() is running.
+		self._deferredSaves = None
+		self._compactRecords = False
 		self._keyField = ""
 		self._requeryChildOnSave = False
 		self._newRecordOnNewParent = False
@@ -167,6 +184,7 @@ class dBizobj(dObject):
 			raise ValueError("Must pass call clearRecords(True) to "
 					"confirm that you are aware that data will be lost.")
 		self._flushCursors(flush_changed=True, flush_current=True)
+		self._notifyDataChanged()
 
 
 	def _flushCursors(self, flush_changed=False, flush_current=False):
@@ -486,31 +504,49 @@ class dBizobj(dObject):
 			raise dException.BusinessRuleViolation(errMsg)
 
 		startTransaction = startTransaction and self.beginTransaction()
+		batchCursor = None
+		if self.BatchSave:
+			batchCursor = self._CurrentCursor
+			# save() leaves the keys of the saved rows here, so that their
+			# notices are only sent once their statements have been run.
+			self._deferredSaves = []
 
-		# First save the rows we know we've visited:
 		try:
-			self.scanKeys(self.save, self._visitedKeys, startTransaction=False,
-					saveTheChildren=saveTheChildren, scanRequeryChildren=False)
-		except (dException.DBQueryException, dException.dException):
-			if startTransaction:
-				self.rollbackTransaction()
-			raise
-
-		# Finally, scan all rows only if there are still potentially unsaved rows.
-		# The isAnyChanged() call will be expensive if there are changes buried
-		# in some out-of-context child cursor, but that should be rare. In the
-		# common case, all the changes would have already been made in the above
-		# block, and isAnyChanged() will return False very quickly in that case.
-		if self.isAnyChanged():
 			try:
-				self.scan(self.save, startTransaction=False,
+				# First save the rows we know we've visited:
+				if batchCursor:
+					batchCursor.beginBatchSave()
+				self.scanKeys(self.save, self._visitedKeys, startTransaction=False,
 						saveTheChildren=saveTheChildren, scanRequeryChildren=False)
+				if batchCursor:
+					batchCursor.endBatchSave()
+
+				# Finally, scan all rows only if there are still potentially unsaved rows.
+				# The isAnyChanged() call will be expensive if there are changes buried
+				# in some out-of-context child cursor, but that should be rare. In the
+				# common case, all the changes would have already been made in the above
+				# block, and isAnyChanged() will return False very quickly in that case.
+				if self.isAnyChanged():
+					if batchCursor:
+						batchCursor.beginBatchSave()
+					self.scan(self.save, startTransaction=False,
+							saveTheChildren=saveTheChildren, scanRequeryChildren=False)
+					if batchCursor:
+						batchCursor.endBatchSave()
 			except (dException.DBQueryException, dException.dException):
 				if startTransaction:
 					self.rollbackTransaction()
 				raise
+		finally:
+			savedKeys = self._deferredSaves
+			self._deferredSaves = None
+			if batchCursor:
+				# Discard any statements left over by a failed save.
+				batchCursor.endBatchSave(cancel=True)
 
 		self.commitTransaction()
+		if savedKeys:
+			self.scanKeys(self._afterRowSaved, savedKeys, scanRequeryChildren=False)
 		self._visitedKeys.clear()
 		self._addVisitedKey()
 		self.afterSaveAll()
@@ -562,7 +598,9 @@ class dBizobj(dObject):
 					# Call the hook method for saving new records.
 					self._onSaveNew()
 
-			if saveTheChildren:
+			if saveTheChildren and self._children:
+				# The children may refer to this row, so it can't wait in a batch.
+				cursor.flushBatchSave()
 				# Iterate through the child bizobjs, telling them to save themselves.
 				for child in self._children:
 					# No need to start another transaction. And since this is a child bizobj,
@@ -583,6 +621,18 @@ class dBizobj(dObject):
 			# Pass the exception to the UI
 			raise
 
+		if self._deferredSaves is not None:
+			# The row's statement may still be waiting in a batch; saveAll()
+			# sends the notices once it has been run.
+			self._deferredSaves.append(self.getPK())
+			return
+		self._afterRowSaved()
+
+
+	def _afterRowSaved(self):
+		"""Send the notices for the current row once its changes are saved."""
+		# New records have their permanent keys now.
+		self._notifyDataChanged(self.RowNumber)
 		# Two hook methods: one specific to Save(), and one which is called after any change
 		# to the data (either save() or delete()).
 		self.afterChange()
@@ -628,6 +678,7 @@ class dBizobj(dObject):
 			ignoreNoRecords = True
 		# Tell the cursor and all children to cancel themselves:
 		self._CurrentCursor.cancel(ignoreNoRecords=ignoreNoRecords)
+		self._notifyDataChanged()
 		if cancelTheChildren:
 			for child in self._children:
 				child.cancelAll(ignoreNoRecords=ignoreNoRecords)
@@ -691,6 +742,7 @@ class dBizobj(dObject):
 		startTransaction = startTransaction and self.beginTransaction()
 		try:
 			cursor.delete()
+			self._notifyDataChanged()
 			if self.RowCount == 0:
 				# Hook method for handling the deletion of the last record in the cursor.
 				self.onDeleteLastRecord()
@@ -875,7 +927,8 @@ class dBizobj(dObject):
 		the first record to the last, and returns a dict of the columns/values
 		of the record for the current iteration. If you pass 'reversed=True',
 		the iterator will go in reverse order, from the last record to the first.
-
+		To process records straight from the backend without loading them into
+		the bizobj, use requeryStream() instead.
 
 		Note that the bizobj will remain on the last (or first, if reverse()
 		is True) record after the iteration is complete unless you call this
@@ -965,7 +1018,7 @@ class dBizobj(dObject):
 
 		try:
 			for key in keys:
-				if self.locate(key, self.KeyField):
+				if self.locate(key, self.KeyField, caseSensitive=True):
 					ret = func(*args, **kwargs)
 				if self.exitScan:
 					break
@@ -1212,6 +1265,125 @@ class dBizobj(dObject):
 		rp = self._RemoteProxy
 		if rp:
 			return rp.requery()
+		params = self._beginRequery()
+		uiException = None
+		if params is not None:
+			uiException = self._loadRequeryData(lambda cursor:
+					cursor.requery(params, convertQMarks=convertQMarks))
+		self._endRequery(uiException)
+
+
+	def requeryAsync(self, callback=None, callAfter=None, batchSize=None,
+			convertQMarks=False):
+		"""
+		Requery the data set without making the calling thread wait for the
+		query to run.
+
+		The query runs on a worker thread over a separate connection, and its
+		rows are fetched in batches of 'batchSize' rows (default: the cursor's
+		FetchBatchSize). After each batch, a RequeryProgress event is raised
+		with the number of rows fetched so far in EventData["rowCount"]. Once
+		all the rows are fetched, they replace the bizobj's data the same way
+		that requery() would, and 'callback' is called with the exception that
+		ended the requery, or None if it succeeded. The bizobj's data is left
+		unchanged until then; cancelRequery() stops the requery. Changes that
+		are pending when the requery starts are discarded, as requery() would,
+		but if the data is changed while the requery runs, the fetched rows are
+		discarded instead, and the callback receives a DBQueryCancelledException.
+
+		The events, the loading of the data and the callback happen through
+		'callAfter', which should run the function it is passed on the main
+		thread: pass dabo.ui.callAfter in UI applications. Without it, they
+		happen on the worker thread.
+
+		Remote bizobjs, and databases that a second connection can't reach,
+		are requeried synchronously. Returns True if the requery runs in the
+		background.
+		"""
+		self.cancelRequery()
+		job = _RequeryJob(callback)
+		cursor = self._CurrentCursor
+		conn = self._connection
+		if self._RemoteProxy or conn is None or \
+				conn.getBackendObject().isPrivateDatabase(conn.ConnectInfo):
+			try:
+				self.requery(convertQMarks=convertQMarks)
+			except dException.dException, e:
+				job.error = e
+			self._finishRequery(job)
+			return False
+		try:
+			params = self._beginRequery()
+		except dException.dException, e:
+			job.error = e
+			self._finishRequery(job)
+			return False
+		if params is None:
+			# There's no parent record to fetch the children for.
+			try:
+				self._endRequery()
+			except dException.dException, e:
+				job.error = e
+			self._finishRequery(job)
+			return False
+		if callAfter is None:
+			def callAfter(fnc, *args):
+				fnc(*args)
+		job.changes = self._getPendingChanges()
+
+		def onProgress(rowCount):
+			callAfter(self._onRequeryProgress, job, rowCount)
+
+		def run():
+			try:
+				conn = self._getRequeryConnection()
+				job.setConnection(conn)
+				try:
+					job.data = cursor.fetchRequery(conn, params, batchSize=batchSize,
+							progress=onProgress, cancelEvent=job.cancelEvent,
+							convertQMarks=convertQMarks)
+				finally:
+					job.setConnection(None)
+					self._releaseRequeryConnection(conn, job)
+			except dException.dException, e:
+				job.error = e
+			except StandardError, e:
+				job.error = dException.DBQueryException(ustr(e))
+			callAfter(self._finishRequery, job, cursor)
+
+		self._requeryJob = job
+		app = self.Application
+		if app is not None:
+			# Let the app close the requery connection when it exits.
+			app.dbRequeryBizobjs.add(self)
+		thrd = threading.Thread(target=run)
+		thrd.setDaemon(True)
+		thrd.start()
+		return True
+
+
+	def cancelRequery(self):
+		"""
+		Cancel the running asynchronous requery, if any. The database is asked
+		to abort the statement if the backend supports it; otherwise the
+		results are discarded once it finishes. The bizobj's data is left
+		unchanged, and the requery's callback receives a
+		DBQueryCancelledException. Returns True if there was a requery to cancel.
+		"""
+		job = self._requeryJob
+		if job is None:
+			return False
+		self._requeryJob = None
+		job.cancel()
+		return True
+
+
+	def _beginRequery(self):
+		"""
+		Run the checks that come before a requery, and return the parameters for
+		the query, or None if a child bizobj doesn't need to run it because its
+		parent record has no key yet.
+		"""
 		errMsg = self.beforeRequery()
 		if errMsg:
 			raise dException.BusinessRuleViolation(errMsg)
@@ -1224,37 +1396,56 @@ class dBizobj(dObject):
 		# Hook method for creating the param tuple. Note that the child filter
 		# clause, if any, will always be the first clause in the WHERE expression.
 		params = _childParamTuple + self.getParams()
-		uiException = None
 
 		# Since the FK value can't be None, we don't need to run non matching
 		# parameters requery in such situation.
-		if not (self.Parent and self.LinkField and _childParamTuple and \
-				max(_childParamTuple) is None):
-			# Record this in case we need to restore the record position
-			try:
-				currPK = self.getPK()
-			except dException.NoRecordsException:
-				currPK = None
-			oldDataStructure = hash(self.DataStructure)
-			# run the requery
-			cursor = self._CurrentCursor
-			try:
-				cursor.requery(params, convertQMarks=convertQMarks)
-			except dException.ConnectionLostException:
-				raise
-			except dException.DBQueryException:
-				raise
-			except dException.NoRecordsException:
-				# Pass the exception to the UI
-				uiException = dException.NoRecordsException
-			except dException.dException:
-				raise
-			self._visitedKeys.clear()
-			if self.RestorePositionOnRequery:
-				self._positionUsingPK(currPK, updateChildren=False)
-			if hash(self.DataStructure) != oldDataStructure:
-				self._clearCursorRecord()
+		if self.Parent and self.LinkField and _childParamTuple and \
+				max(_childParamTuple) is None:
+			return None
+		return params
+
+
+	def _loadRequeryData(self, load):
+		"""
+		Call 'load' with the current cursor to fill it with the requeried data,
+		and restore the record position. Returns the exception class to pass on
+		to the UI, if any.
+		"""
+		# Record this in case we need to restore the record position
+		try:
+			currPK = self.getPK()
+		except dException.NoRecordsException:
+			currPK = None
+		oldDataStructure = hash(self.DataStructure)
+		uiException = None
+		try:
+			load(self._CurrentCursor)
+		except dException.ConnectionLostException:
+			raise
+		except dException.DBQueryException:
+			raise
+		except dException.NoRecordsException:
+			# Pass the exception to the UI
+			uiException = dException.NoRecordsException
+		except dException.dException:
+			raise
+		self._notifyDataChanged()
+		self._visitedKeys.clear()
+		self.__prefetchedKeys.discard(self.__currentCursorKey)
+		if self.RestorePositionOnRequery:
+			self._positionUsingPK(currPK, updateChildren=False)
+		if hash(self.DataStructure) != oldDataStructure:
+			self._clearCursorRecord()
+		return uiException
+
 
+	def _endRequery(self, uiException=None):
+		"""Requery the children after the data has been loaded."""
+		# Records prefetched for the old parent rows may be out of date.
+		for child in self._children:
+			child.__prefetchedKeys.clear()
+		if self.AutoPrefetchChildren:
+			self.prefetchChildren()
 		try:
 			self.requeryAllChildren()
 		except dException.NoRecordsException:
@@ -1265,6 +1456,191 @@ class dBizobj(dObject):
 			raise uiException
 
 
+	def _onRequeryProgress(self, job, rowCount):
+		if job is self._requeryJob:
+			self.raiseEvent(dEvents.RequeryProgress, rowCount=rowCount)
+
+
+	def _finishRequery(self, job, cursor=None):
+		"""Load the data fetched by an asynchronous requery, and call its callback."""
+		if job is self._requeryJob:
+			self._requeryJob = None
+		if job.error is None and job.data is not None:
+			if job.cancelEvent.isSet() or cursor is not self._CurrentCursor:
+				job.error = dException.DBQueryCancelledException(
+						_("The requery was cancelled"))
+			elif self._getPendingChanges() != job.changes:
+				# Loading the rows would throw away the edits made while they were fetched.
+				job.error = dException.DBQueryCancelledException(
+						_("The requery was cancelled because the data was changed"))
+			else:
+				try:
+					self._endRequery(self._loadRequeryData(lambda crs: crs.storeRequery(job.data)))
+				except dException.dException, e:
+					job.error = e
+		if job.callback is not None:
+			job.callback(job.error)
+
+
+	def _getPendingChanges(self):
+		"""Return the bizobj's unsaved changes, or None if there aren't any."""
+		if not self.isAnyChanged():
+			return None
+		return self.getDataDiff(allRows=True)
+
+
+	def _getRequeryConnection(self):
+		"""
+		Return a connection for an asynchronous requery: the one left idle by
+		the last requery, or a new one with the same settings as the bizobj's.
+		"""
+		self._requeryLock.acquire()
+		try:
+			conn = self._requeryConnection
+			self._requeryConnection = None
+		finally:
+			self._requeryLock.release()
+		if conn is None:
+			ci = self._connection.ConnectInfo.copy()
+			ci.KeepAliveInterval = None
+			# The connection may be used by a different thread next time.
+			kwargs = ci.getBackendObject().poolConnectionArgs
+			conn = dabo.db.dConnection(ci, **kwargs)
+		return conn
+
+
+	def _releaseRequeryConnection(self, conn, job):
+		"""
+		Keep the connection for the next requery, or close it if one is already
+		kept, or if the requery was cancelled.
+		"""
+		self._requeryLock.acquire()
+		try:
+			if self._requeryConnection is None and not job.cancelEvent.isSet():
+				self._requeryConnection = conn
+				return
+		finally:
+			self._requeryLock.release()
+		conn.close()
+
+
+	def closeRequeryConnection(self):
+		"""
+		Cancel the running asynchronous requery, if any, and close the
+		connection that requeryAsync() keeps open between requeries. The next
+		call to requeryAsync() opens a new one.
+		"""
+		self.cancelRequery()
+		self._requeryLock.acquire()
+		try:
+			conn = self._requeryConnection
+			self._requeryConnection = None
+		finally:
+			self._requeryLock.release()
+		if conn is not None:
+			conn.close()
+
+
+	def requeryStream(self, batchSize=None, convertQMarks=False):
+		"""
+		Run the bizobj's query, and return a generator that yields each of the
+		resulting records as a dict as it is fetched from the backend.
+
+		The records are not loaded into the bizobj, and its current data is left
+		unchanged, so this is suited to read-only processing of large result
+		sets, such as reports and exports. The rows are fetched 'batchSize' at a
+		time (default: the cursor's FetchBatchSize).
+		"""
+		_childParamTuple = self.setChildLinkFilter()
+		params = _childParamTuple + self.getParams()
+		return self._CurrentCursor.requeryStream(params, batchSize=batchSize,
+				convertQMarks=convertQMarks)
+
+
+	def prefetchChildren(self, children=None):
+		"""
+		Load the records of the child bizobjs for all the rows of this bizobj,
+		using one query per child instead of one query per parent row. Long
+		lists of parent keys are split into several queries, as allowed by the
+		backend. Moving to another parent record afterwards uses the prefetched
+		records instead of requerying the child, until this bizobj is requeried
+		or the child's cache is expired.
+
+		By default all the children that are requeried with this bizobj are
+		prefetched; pass a list of child bizobjs to only prefetch those.
+		"""
+		if children is None:
+			children = [child for child in self._children if child.RequeryWithParent]
+		crs = self._CurrentCursor
+		if not children or crs is None or not crs.RowCount:
+			return
+		for child in children:
+			fld = child.ParentLinkField or self.KeyField
+			if not isinstance(fld, basestring) or "," in fld:
+				# Compound links can't be fetched with an 'in' list.
+				continue
+			keys = [crs.getFieldVal(fld.strip(), row) for row in xrange(crs.RowCount)]
+			child.prefetch(keys)
+
+
+	def prefetch(self, parentKeys):
+		"""
+		Fetch the records of this child bizobj for each of the passed parent
+		link values, and store them in the cursor for that parent. Cursors with
+		unsaved changes are not replaced. This is normally called by the parent's
+		prefetchChildren() method. Returns the number of parent keys loaded.
+		"""
+		if not (self.DataSource and self.LinkField and self.Parent):
+			return 0
+		if self._RemoteProxy or self.UserSQL or ("," in self.LinkField):
+			return 0
+		cursors = self.__cursors
+		keys = []
+		for key in set(parentKeys):
+			if key is None or key == NO_RECORDS_PK:
+				continue
+			crs = cursors.get(key)
+			if crs is not None and crs.isChanged(allRows=True, includeNewUnchanged=True):
+				continue
+			keys.append(key)
+		if not keys:
+			return 0
+		linkField = self.LinkField.strip().split(".")[-1]
+		crs = self._CurrentCursor
+		userParams = self.getParams()
+		chunkSize = max(1, crs.BackendObject.maxParams - len(userParams))
+		typs = dict(crs._types)
+		loaded = 0
+		try:
+			for start in xrange(0, len(keys), chunkSize):
+				chunk = keys[start:start + chunkSize]
+				recsByKey = dict([(key, []) for key in chunk])
+				crs.setChildInFilter(linkField, len(chunk))
+				for rec in crs.executeStream(crs.CurrentSQL, tuple(chunk) + userParams):
+					try:
+						recsByKey[rec[linkField]].append(rec)
+					except KeyError:
+						# The link value doesn't match its parent key exactly, so
+						# these parents will be requeried the usual way.
+						recsByKey = None
+						break
+				if recsByKey is None:
+					continue
+				for key, recs in recsByKey.items():
+					keyCursor = cursors.get(key)
+					if keyCursor is None:
+						keyCursor = self.createCursor(key, addToCursorCollection=False)
+						keyCursor.sqlManager = self.SqlManager
+						cursors[key] = keyCursor
+					keyCursor._storeData(dDataSet(recs), dict(typs))
+					self.__prefetchedKeys.add(key)
+				loaded += len(chunk)
+		finally:
+			# Restore the filter for the current parent record.
+			self.setChildLinkFilter()
+		return loaded
+
+
 	def _clearCursorRecord(self):
 		## The Record object must be reinstantiated to reflect the new structure:
 		try:
@@ -1338,11 +1714,13 @@ class dBizobj(dObject):
 
 		Called when the data is to be sorted on a particular column
 		in a particular order. All the checking on the parameters is done
-		in the cursor.
+		in the cursor. Pass a sequence of columns to sort on several columns
+		at once.
 		"""
 		cc = self._CurrentCursor
 		if cc is not None:
 			cc.sort(col, ordr, caseSensitive)
+			self._notifyDataChanged()
 
 
 	def setParams(self, params):
@@ -1381,12 +1759,13 @@ class dBizobj(dObject):
 		currPK = self.getPK()
 		if fld in self.VirtualFields:
 			self.scan(self.scanVirtualFields, fld=fld, expr=expr, op=op, reverse=True)
-			self._CurrentCursor.filterByExpression("%s IN (%s)" % (
+			self._CurrentCursor.filterByExpression("%s in [%s]" % (
 					self.KeyField, ", ".join("%i" % key for key in self.__filterPKVirtual)))
 			# clear filter ids
 			self.__filterPKVirtual = []
 		else:
 			self._CurrentCursor.filter(fld=fld, expr=expr, op=op)
+		self._notifyDataChanged()
 
 		try:
 			newPK = self.getPK()
@@ -1406,15 +1785,18 @@ class dBizobj(dObject):
 
 
 	def filterByExpression(self, expr):
-		"""Allows you to filter by any valid Python expression.
+		"""Allows you to filter by a Python expression.
 
 		Use the field alias names, for example::
 
-			biz.filterByExpression('cust_name[0].lower() = 'a')
+			biz.filterByExpression("cust_name[0].lower() == 'a'")
 
-		where cust_name is a field alias name in this record.
+		where cust_name is a field alias name in this record. A sequence of
+		expressions may also be passed to apply them all in a single pass.
+		See dDataSet.filterByExpression() for what expressions can contain.
 		"""
 		self._CurrentCursor.filterByExpression(expr)
+		self._notifyDataChanged()
 
 
 	def scanVirtualFields(self, fld, expr, op):
@@ -1465,11 +1847,13 @@ class dBizobj(dObject):
 	def removeFilter(self):
 		"""Remove the most recently applied filter."""
 		self._CurrentCursor.removeFilter()
+		self._notifyDataChanged()
 
 
 	def removeFilters(self):
 		"""Remove all applied filters, going back to the original data set."""
 		self._CurrentCursor.removeFilters()
+		self._notifyDataChanged()
 
 
 	def _validate(self):
@@ -1575,6 +1959,9 @@ class dBizobj(dObject):
 			| True	- do both, update child cursor's parent and requery child cursor.
 		"""
 		if updateChildren is not None:
+			if updateChildren and self._RemoteProxy:
+				self._requeryRemoteChildren()
+				return
 			for child in self._children:
 				# Let the child update to the current record:
 				child.setCurrentParent()
@@ -1592,6 +1979,25 @@ class dBizobj(dObject):
 				child.afterSetCurrentParent()
 
 
+	def _requeryRemoteChildren(self):
+		"""
+		Same as _resetChildrenParent(True), but the remote children that need
+		a requery get their data from the server in parallel.
+		"""
+		toRequery = []
+		for child in self._children:
+			child.setCurrentParent()
+			if child.RequeryWithParent and child.cacheExpired() and not child.isAnyChanged():
+				toRequery.append(child)
+		RemoteConnector.requeryMany([child._RemoteProxy for child in toRequery
+				if child._RemoteProxy])
+		for child in toRequery:
+			if not child._RemoteProxy:
+				child.requery()
+		for child in self._children:
+			child.afterSetCurrentParent()
+
+
 	def moveToPK(self, pk):
 		"""Move to the row with the specified pk value, or raise RowNotFoundException."""
 		row = self.seek(pk, self.KeyField, caseSensitive=True, near=False,
@@ -1632,6 +2038,23 @@ class dBizobj(dObject):
 		return ret
 
 
+	def addIndex(self, fld):
+		"""
+		Keep a sorted index on the passed field in all of this bizobj's cursors,
+		so that seek() and locate() on that field don't need to sort every row.
+		"""
+		self._indexedFields.add(fld)
+		for crs in self.__cursors.values():
+			crs.addIndex(fld)
+
+
+	def removeIndex(self, fld):
+		"""Stop keeping a sorted index on the passed field."""
+		self._indexedFields.discard(fld)
+		for crs in self.__cursors.values():
+			crs.removeIndex(fld)
+
+
 	def seek(self, val, fld=None, caseSensitive=False, near=False, runRequery=True,
 			sort=True, incremental=False):
 		"""
@@ -1787,6 +2210,7 @@ class dBizobj(dObject):
 		if setDefaults:
 			cursor.setDefaults(self.DefaultValues)
 		cursor.setNewFlag()
+		self._notifyDataChanged()
 		# Fill in the link to the parent record
 		if self.Parent and self.FillLinkFromParent and self.LinkField:
 			self.setParentFK(allRows=False)
@@ -1957,6 +2381,9 @@ class dBizobj(dObject):
 
 	def cacheExpired(self):
 		"""This controls if a child requery is needed when a parent is requeried."""
+		if self.__currentCursorKey in self.__prefetchedKeys:
+			# The records were loaded by the parent's prefetchChildren().
+			return False
 		if self._childCacheInterval:
 			last = self._CurrentCursor.lastRequeryTime
 			if last:
@@ -1973,8 +2400,10 @@ class dBizobj(dObject):
 		"""
 		if _allCursors:
 			cursors = self.__cursors.values()
+			self.__prefetchedKeys.clear()
 		else:
 			cursors = [self._CurrentCursor]
+			self.__prefetchedKeys.discard(self.__currentCursorKey)
 
 		for cursor in cursors:
 			cursor.clearLastRequeryTime()
@@ -2044,6 +2473,12 @@ class dBizobj(dObject):
 		"""Set the value of the specified field in the current or specified row."""
 		changed = self._CurrentCursor.setFieldVal(fld, val, row, pk)
 		if changed:
+			if pk is not None:
+				self._notifyDataChanged()
+			elif row is None:
+				self._notifyDataChanged(self.RowNumber, fld)
+			else:
+				self._notifyDataChanged(row, fld)
 			self.afterSetFieldVal(fld, row)
 		return changed
 
@@ -2128,6 +2563,24 @@ class dBizobj(dObject):
 		callback(rowTemplate % ("%s%s" % (xml, kidXML)), level)
 
 
+	def getDataWindow(self, pageSize=200, maxPages=10):
+		"""
+		Return a dDataWindow for the bizobj's query. Instead of fetching all of
+		the rows like requery() does, the window counts them, and fetches them
+		'pageSize' rows at a time when they are asked for, so that very large
+		results can be browsed. The rows of the bizobj are not changed. Not
+		available for remote bizobjs.
+		"""
+		if self._RemoteProxy:
+			raise dException.FeatureNotSupportedException(
+					_("Data windows are not available for remote bizobjs."))
+		if self.KeyField is None:
+			errMsg = _("No Primary Key defined in the Bizobj for %s") % self.DataSource
+			raise dException.MissingPKException(errMsg)
+		params = self.setChildLinkFilter() + self.getParams()
+		return dDataWindow(self._CurrentCursor, params, pageSize=pageSize, maxPages=maxPages)
+
+
 	def getDataSet(self, flds=(), rowStart=0, rows=None, returnInternals=False):
 		"""
 		Get the entire data set encapsulated in a list.
@@ -2144,6 +2597,18 @@ class dBizobj(dObject):
 		return None
 
 
+	def iterFieldVals(self, fld):
+		"""
+		Return an iterator over the value of the field in each row, without
+		copying the records like getDataSet() does. Virtual fields aren't
+		available.
+		"""
+		cc = self._CurrentCursor
+		if cc is None:
+			return iter(())
+		return cc.iterFieldVals(fld)
+
+
 	def appendDataSet(self, ds, updateInternals=False):
 		"""
 		Appends the rows in the passed dataset to this bizobj's dataset. No checking
@@ -2152,6 +2617,7 @@ class dBizobj(dObject):
 		passed, a dException.FieldNotFoundException will be raised.
 		"""
 		self._CurrentCursor.appendDataSet(ds, updateInternals=updateInternals)
+		self._notifyDataChanged()
 
 
 	def cloneRecord(self):
@@ -2188,6 +2654,7 @@ class dBizobj(dObject):
 		if stru:
 			self.DataStructure = stru
 		self._CurrentCursor._storeData(data, typs)
+		self._notifyDataChanged()
 
 
 	def getDataStructure(self):
@@ -2569,6 +3036,16 @@ class dBizobj(dObject):
 		self.afterPointerMove()
 
 
+	def _notifyDataChanged(self, row=None, field=None):
+		"""
+		Raise a DataSetChanged event for objects that cache values read from the
+		bizobj, such as grids. 'row' and 'field' identify a single changed value;
+		without them, any of the records may have changed.
+		"""
+		if self._EventBindings:
+			self.raiseEvent(dEvents.DataSetChanged, row=row, field=field)
+
+
 	def _addVisitedKey(self):
 		"""
 		The _visitedKeys set is used for optimization of cancelAll()
@@ -2706,6 +3183,7 @@ afterDelete() which is only called after a delete().""")
 		crs.KeyField = self._keyField
 		crs.AutoPopulatePK = self._autoPopulatePK
 		crs.AutoQuoteNames = self._autoQuoteNames
+		crs.CompactRecords = self._compactRecords
 		if self._dataStructure is not None:
 			crs.DataStructure = self._dataStructure
 		if not self._RemoteProxy:
@@ -2716,6 +3194,8 @@ afterDelete() which is only called after a delete().""")
 		crs.VirtualFields = self._virtualFields
 		crs.Encoding = self.Encoding
 		crs.setNonUpdateFields(self._nonUpdateFields)
+		for fld in self._indexedFields:
+			crs.addIndex(fld)
 
 
 	def _cursorDictReference(self):
@@ -2751,6 +3231,13 @@ afterDelete() which is only called after a delete().""")
 		self._syncWithCursors()
 
 
+	def _getAutoPrefetchChildren(self):
+		return self._autoPrefetchChildren
+
+	def _setAutoPrefetchChildren(self, val):
+		self._autoPrefetchChildren = bool(val)
+
+
 	def _getAutoQuoteNames(self):
 		return self._autoQuoteNames
 
@@ -2766,6 +3253,13 @@ afterDelete() which is only called after a delete().""")
 			return None
 
 
+	def _getBatchSave(self):
+		return self._batchSave
+
+	def _setBatchSave(self, val):
+		self._batchSave = bool(val)
+
+
 	def _getCaption(self):
 		try:
 			return self._caption
@@ -2790,6 +3284,14 @@ afterDelete() which is only called after a delete().""")
 		self._childCacheInterval = val
 
 
+	def _getCompactRecords(self):
+		return self._compactRecords
+
+	def _setCompactRecords(self, val):
+		self._compactRecords = bool(val)
+		self._syncWithCursors()
+
+
 	def _getCurrentSQL(self):
 		return self._CurrentCursor.CurrentSQL
 
@@ -2812,6 +3314,7 @@ afterDelete() which is only called after a delete().""")
 		self.__currentCursorKey = val
 		if val not in self.__cursors:
 			self.createCursor()
+		self._notifyDataChanged()
 
 
 	def _getCurrentCursorKey(self):
@@ -2916,6 +3419,10 @@ afterDelete() which is only called after a delete().""")
 		return self._CurrentCursor.IsAdding
 
 
+	def _getIsRequerying(self):
+		return self._requeryJob is not None
+
+
 	def _getKeyField(self):
 		try:
 			return self._keyField
@@ -3154,6 +3661,11 @@ afterDelete() which is only called after a delete().""")
 	AutoPopulatePK = property(_getAutoPopulatePK, _setAutoPopulatePK, None,
 			_("Determines if we are using a table that auto-generates its PKs. (bool)"))
 
+	AutoPrefetchChildren = property(_getAutoPrefetchChildren, _setAutoPrefetchChildren, None,
+			_("""When True, each requery() also calls prefetchChildren(), so that the
+			child records for all the rows are loaded with a few queries instead of
+			one query per parent row as the record pointer moves. Default=False  (bool)"""))
+
 	AutoQuoteNames = property(_getAutoQuoteNames, _setAutoQuoteNames, None,
 			_("""When True (default), table and column names are enclosed with
 			quotes during SQL creation in the cursor.  (bool)
@@ -3162,6 +3674,15 @@ afterDelete() which is only called after a delete().""")
 	AutoSQL = property(_getAutoSQL, None, None,
 			_("Returns the SQL statement automatically generated by the sql manager."))
 
+	BatchSave = property(_getBatchSave, _setBatchSave, None,
+			_("""When True, saveAll() sends consecutive rows that produce the same
+			INSERT or UPDATE statement to the backend together, which is much
+			faster when saving many rows. The afterSave() and afterChange()
+			hooks of the rows, and their DataSetChanged events, are deferred
+			until all the rows have been saved and the transaction committed.
+			Rows with child bizobjs, and new rows whose PK is generated by the
+			backend, are still written right away. Default=False  (bool)"""))
+
 	Caption = property(_getCaption, _setCaption, None,
 			_("The friendly title of the cursor, used in messages to the end user. (str)"))
 
@@ -3174,6 +3695,11 @@ afterDelete() which is only called after a delete().""")
 			requery from parent.requeryAllChildren() will be ignored.  (int)
 			"""))
 
+	CompactRecords = property(_getCompactRecords, _setCompactRecords, None,
+			_("""When True, the cursors store fetched rows in compact records that
+			share a single field layout, instead of in a dict per row. Useful for
+			large, mostly read-only data sets. Default=False  (bool)"""))
+
 	Connection = property(_getConnection, None, None,
 			_("The dConnection object used to connect with the backend database."))
 
@@ -3245,6 +3771,9 @@ afterDelete() which is only called after a delete().""")
 	IsAdding = property(_isAdding, None, None,
 			_("Returns True if the current record is new and unsaved."))
 
+	IsRequerying = property(_getIsRequerying, None, None,
+			_("Returns True while an asynchronous requery is running.  (bool)"))
+
 	KeyField = property(_getKeyField, _setKeyField, None,
 			_("""Name of field that is the PK. If multiple fields make up the key,
 			separate the fields with commas. (str)
@@ -3454,3 +3983,35 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 	</cursor>
 </dabocursor>
 """
+
+
+
+class _RequeryJob(object):
+	"""The state of an asynchronous requery started by dBizobj.requeryAsync()."""
+	def __init__(self, callback):
+		self.callback = callback
+		self.cancelEvent = threading.Event()
+		self.data = None
+		self.error = None
+		# The bizobj's unsaved changes when the requery started.
+		self.changes = None
+		self._connection = None
+		self._lock = threading.Lock()
+
+
+	def setConnection(self, conn):
+		"""Set the connection that the query is running on, so it can be cancelled."""
+		self._lock.acquire()
+		self._connection = conn
+		self._lock.release()
+
+
+	def cancel(self):
+		self._lock.acquire()
+		try:
+			self.cancelEvent.set()
+			conn = self._connection
+		finally:
+			self._lock.release()
+		if conn is not None:
+			conn.getBackendObject().cancelQuery()
@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import os
+import Queue
+import tempfile
+import time
 import unittest
 import dabo
 import dabo.db
@@ -269,6 +273,241 @@ insert into %s (cField, iField, nField) values (NULL, NULL, NULL)
 		self.assertEqual(bizMain.RowCount, 2)
 
 
+	def testIterFieldVals(self):
+		biz = self.biz
+		biz.sort("cField")
+		self.assertEqual(list(biz.iterFieldVals("cField")),
+				["Carl Karsten", "Edward Leafe", "Paul Keith McNett"])
+		self.assertEqual(list(biz.iterFieldVals("iField")), [10223, 42, 23])
+
+
+	def testRequeryStream(self):
+		bizMain = self.biz
+		bizChild = dabo.biz.dBizobj(self.con)
+		bizChild.KeyField = "pk"
+		bizChild.DataSource = self.temp_child_table_name
+		bizChild.LinkField = "parent_fk"
+		bizMain.addChild(bizChild)
+		bizMain.requery()
+
+		self.assertEqual([rec["pk"] for rec in bizMain.requeryStream(batchSize=1)],
+				[1, 2, 3])
+		self.assertEqual([rec["cInvNum"] for rec in bizChild.requeryStream()],
+				["IN00023", "IN00455"])
+		self.assertEqual(bizChild.RowCount, 2)
+
+
+	def testRequeryAsync(self):
+		fd, pth = tempfile.mkstemp(suffix=".db")
+		os.close(fd)
+		try:
+			con = dabo.db.dConnection(DbType="SQLite", Database=pth)
+			crs = con.getDaboCursor()
+			crs.execute("create table items (pk INTEGER PRIMARY KEY, val INT)")
+			crs.executeMany("insert into items (val) values (?)",
+					[(num,) for num in range(250)])
+			biz = dabo.biz.dBizobj(con, KeyField="pk", DataSource="items")
+			biz.UserSQL = "select * from items where val < 100"
+			biz.requery()
+			biz.UserSQL = "select * from items"
+			progress = []
+			biz.bindEvent(dabo.dEvents.RequeryProgress,
+					lambda evt: progress.append(evt.EventData["rowCount"]))
+			# Simulates the event loop of the main thread.
+			pending = Queue.Queue()
+			results = []
+
+			def runPending():
+				while not results:
+					fnc, args = pending.get(timeout=10)
+					fnc(*args)
+				return results.pop()
+
+			callAfter = lambda fnc, *args: pending.put((fnc, args))
+			self.assertTrue(biz.requeryAsync(results.append, callAfter, batchSize=100))
+			self.assertTrue(biz.IsRequerying)
+			self.assertEqual(biz.RowCount, 100)
+			self.assertEqual(runPending(), None)
+			self.assertEqual((biz.RowCount, biz.IsRequerying), (250, False))
+			self.assertEqual(progress, [100, 200, 250])
+			self.assertEqual(biz.getFieldVal("val", 249), 249)
+
+			# A cancelled requery leaves the data unchanged.
+			biz.UserSQL = "select count(*) as pk from items a, items b, items c, items d"
+			biz.requeryAsync(results.append, callAfter)
+			time.sleep(0.2)
+			self.assertTrue(biz.cancelRequery())
+			self.assertTrue(isinstance(runPending(),
+					dabo.dException.DBQueryCancelledException))
+			self.assertEqual(biz.RowCount, 250)
+			self.assertFalse(biz.cancelRequery())
+
+			# Changes pending when the requery starts are discarded...
+			biz.UserSQL = "select * from items where val < 10"
+			biz.setFieldVal("val", -1)
+			self.assertTrue(biz.requeryAsync(results.append, callAfter))
+			self.assertEqual(runPending(), None)
+			self.assertEqual(biz.RowCount, 10)
+			self.assertFalse(biz.isAnyChanged())
+			# ...but the requery is cancelled if the data is changed while it runs.
+			biz.UserSQL = "select * from items"
+			self.assertTrue(biz.requeryAsync(results.append, callAfter))
+			biz.setFieldVal("val", -2)
+			self.assertTrue(isinstance(runPending(),
+					dabo.dException.DBQueryCancelledException))
+			self.assertEqual((biz.RowCount, biz.getFieldVal("val")), (10, -2))
+
+			self.assertTrue(biz._requeryConnection is not None)
+			biz.closeRequeryConnection()
+			self.assertTrue(biz._requeryConnection is None)
+			con.close()
+		finally:
+			os.remove(pth)
+
+
+	def testDataSetChanged(self):
+		biz = self.biz
+		changes = []
+		biz.bindEvent(dabo.dEvents.DataSetChanged,
+				lambda evt: changes.append((evt.EventData["row"], evt.EventData["field"])))
+		biz.RowNumber = 1
+		biz.Record.cField = "Ed Leafe"
+		biz.setFieldVal("iField", 5, row=2)
+		# Setting an unchanged value is not a change.
+		biz.setFieldVal("iField", 5, row=2)
+		self.assertEqual(changes, [(1, "cField"), (2, "iField")])
+		del changes[:]
+		biz.sort("cField")
+		biz.new()
+		biz.cancel()
+		biz.requery()
+		self.assertEqual(len(changes), 4)
+		self.assertEqual(set(changes), set([(None, None)]))
+
+
+	def testDataWindow(self):
+		biz = self.biz
+		biz._CurrentCursor.AuxCursor.execute("insert into %s (cField, iField) select 'Row', "
+				"a.pk * 100 + b.pk * 10 + c.pk from %s a, %s b, %s c order by 2"
+				% ((self.temp_table_name,) * 4))
+		biz.setWhereClause("iField < 300")
+		win = biz.getDataWindow(pageSize=4, maxPages=2)
+		# The bizobj isn't requeried.
+		self.assertEqual(biz.RowCount, 3)
+		self.assertEqual(win.RowCount, 20)
+		self.assertEqual([win.getFieldVal("pk", row) for row in range(6)], [1, 2, 4, 5, 6, 7])
+		self.assertEqual(win.getRecord(19)["iField"], 233)
+		self.assertRaises(dabo.dException.RowNotFoundException, win.getRecord, 20)
+		self.assertEqual(win.Stats["pages"], 2)
+		win.sort("iField", "DESC")
+		vals = [win.getFieldVal("iField", row) for row in range(win.RowCount)]
+		self.assertEqual(vals, sorted(vals, reverse=True))
+		self.assertEqual(win.getFieldVal("iField", win.seek(132)), 132)
+		self.assertEqual(win.getFieldVal("iField", win.seek(130)), 123)
+		self.assertEqual(win.seek(130, near=False), -1)
+		win.sort("cField", caseSensitive=False)
+		self.assertEqual(win.seek("edward leafe", near=False), 0)
+		self.assertEqual(win.getFieldVal("cField", win.seek("q")), "Row")
+		# The rows are read again after a refresh.
+		biz._CurrentCursor.AuxCursor.execute("delete from %s where cField = 'Row'"
+				% self.temp_table_name)
+		self.assertEqual(win.RowCount, 20)
+		win.refresh()
+		self.assertEqual(win.RowCount, 2)
+
+
+	def testDataWindowNulls(self):
+		biz = self.biz
+		aux = biz._CurrentCursor.AuxCursor
+		aux.execute("delete from %s" % self.temp_table_name)
+		for val in (None, "d", None, "b", "f", None):
+			aux.execute("insert into %s (cField) values (?)" % self.temp_table_name, (val,))
+		win = biz.getDataWindow(pageSize=2)
+		# SQLite sorts NULLs before all other values.
+		win.sort("cField")
+		self.assertEqual(win.seek("b"), 3)
+		self.assertEqual(win.seek("b", near=False), 3)
+		self.assertEqual(win.seek("c", near=False), -1)
+		self.assertEqual(win.getFieldVal("cField", win.seek("e")), "f")
+		win.sort("cField", "DESC")
+		self.assertEqual(win.seek("d", near=False), 1)
+		self.assertEqual(win.seek("a"), 3)
+
+
+	def testPrefetchChildren(self):
+		bizMain = self.biz
+		bizChild = dabo.biz.dBizobj(self.con)
+		bizChild.KeyField = "pk"
+		bizChild.DataSource = self.temp_child_table_name
+		bizChild.LinkField = "parent_fk"
+		bizMain.addChild(bizChild)
+		bizMain.AutoPrefetchChildren = True
+		bizMain.requery()
+
+		# Rows added behind the bizobj's back don't show up until the parent is
+		# requeried, since navigation uses the prefetched records.
+		bizMain._CurrentCursor.AuxCursor.execute("""
+insert into %s (parent_fk, cInvNum) values (3, "IN00025")
+""" % self.temp_child_table_name)
+		self.assertEqual(bizChild.RowCount, 2)
+		bizMain.next()
+		self.assertEqual(bizChild.RowCount, 0)
+		bizMain.next()
+		self.assertEqual(bizChild.RowCount, 1)
+		self.assertEqual(bizChild.Record.cInvNum, "IN00024")
+		bizMain.requery()
+		self.assertEqual(bizChild.RowCount, 2)
+		# Cursors with unsaved changes are left alone.
+		bizMain.first()
+		bizChild.Record.cInvNum = "IN99999"
+		bizMain.prefetchChildren()
+		self.assertEqual(bizChild.Record.cInvNum, "IN99999")
+
+
+	def testBatchSave(self):
+		biz = self.biz
+		biz.BatchSave = True
+		for row in biz.bizIterator():
+			biz.Record.iField = row * 10
+		biz.new()
+		biz.Record.cField = "Ahmed"
+		biz.saveAll()
+		self.assertFalse(biz.isAnyChanged())
+		self.assertEqual(biz.Record.pk, 4)
+		biz.requery()
+		self.assertEqual([rec["iField"] for rec in biz.getDataSet()], [0, 10, 20, 0])
+
+
+	def testBatchSaveNotices(self):
+		biz = self.biz
+		biz.BatchSave = True
+		saved = []
+		def afterSave():
+			# The row's statement has been run by the time the hook is called.
+			saved.append((biz.Record.pk, biz.isChanged()))
+		biz.afterSave = afterSave
+		for row in biz.bizIterator():
+			biz.Record.iField = row * 10
+		biz.saveAll()
+		self.assertEqual(sorted(saved), [(1, False), (2, False), (3, False)])
+
+		# A failure that isn't a dException still ends the batch.
+		def beforeSave():
+			if biz.Record.pk == 2:
+				raise TypeError
+		biz.beforeSave = beforeSave
+		for row in biz.bizIterator():
+			biz.Record.iField = row + 100
+		self.assertRaises(TypeError, biz.saveAll)
+		del biz.beforeSave
+		del saved[:]
+		biz.RowNumber = 2
+		biz.save()
+		self.assertEqual(saved, [(3, False)])
+		crs = biz.getTempCursor("select iField from %s where pk = 3" % self.temp_table_name)
+		self.assertEqual(crs.Record.iField, 102)
+
+
 	def testSaveNewUnchanged(self):
 		"""See ticket #1101"""
 		bizMain = self.biz
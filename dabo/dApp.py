@@ -14,6 +14,7 @@ import sys
 import tempfile
 import urllib2
 import warnings
+import weakref
 from xml.sax._exceptions import SAXParseException
 from zipfile import ZipFile
 
@@ -873,6 +874,9 @@ try again when it is running.
 		self.dbConnectionDefs = {}
 		self.dbConnectionNameToFiles = {}
 		self.dbConnections = {}
+		self.dbConnectionPools = {}
+		# The bizobjs that may hold a connection open for requeryAsync().
+		self.dbRequeryBizobjs = weakref.WeakSet()
 
 		self._appInfo = {}
 		super(dApp, self)._initProperties()
@@ -1013,7 +1017,12 @@ try again when it is running.
 		for the same named connection will not open multiple
 		connections. If the name doesn't exist in self.dbConnectionDefs,
 		then an exception is raised.
+
+		When ConnectionPooling is True, each thread gets a connection of its
+		own from the connection's pool instead.
 		"""
+		if self.ConnectionPooling:
+			return self.getConnectionPool(connName).getThreadConnection()
 		if not connName in self.dbConnections:
 			if connName in self.dbConnectionDefs:
 				ci = self.dbConnectionDefs[connName]
@@ -1026,6 +1035,27 @@ try again when it is running.
 		return ret
 
 
+	def getConnectionPool(self, connName, **kwargs):
+		"""
+		Returns the dConnectionPool for the named connection, creating it
+		with the passed properties (such as MinSize and MaxSize) the first
+		time. If the name doesn't exist in self.dbConnectionDefs, then an
+		exception is raised.
+		"""
+		try:
+			return self.dbConnectionPools[connName]
+		except KeyError:
+			pass
+		try:
+			ci = self.dbConnectionDefs[connName]
+		except KeyError:
+			raise dException.ConnectionNotFoundException(
+					_("No connection named '%s' is defined") % connName)
+		ret = self.dbConnectionPools[connName] = dabo.db.dConnectionPool(ci, parent=self,
+				**kwargs)
+		return ret
+
+
 	def getConnectionNames(self):
 		"""Returns a list of all defined connection names"""
 		return self.dbConnectionDefs.keys()
@@ -1036,6 +1066,12 @@ try again when it is running.
 		for key, conn in self.dbConnections.items():
 			conn.close()
 			del self.dbConnections[key]
+		for key, pool in self.dbConnectionPools.items():
+			pool.close()
+			del self.dbConnectionPools[key]
+		for biz in list(self.dbRequeryBizobjs):
+			biz.closeRequeryConnection()
+		self.dbRequeryBizobjs.clear()
 
 
 	def addConnectInfo(self, ci, name=None):
@@ -1374,6 +1410,13 @@ try again when it is running.
 		super(dApp, self)._setBasePrefKey(val)
 
 
+	def _getConnectionPooling(self):
+		return getattr(self, "_connectionPooling", False)
+
+	def _setConnectionPooling(self, val):
+		self._connectionPooling = bool(val)
+
+
 	def _getCrypto(self):
 		if getattr(self, "_cryptoProvider", None) is None:
 			# Use the default crypto
@@ -1722,6 +1765,12 @@ try again when it is running.
 			will return the ActiveForm's BasePrefKey or the MainForm's BasePrefKey
 			in that order. (str)"""))
 
+	ConnectionPooling = property(_getConnectionPooling, _setConnectionPooling, None,
+			_("""When True, getConnectionByName() returns a connection from the
+			connection's dConnectionPool that is only used by the calling thread,
+			so that bizobjs in different threads don't share a connection.
+			(Default False)"""))
+
 	Crypto = property(_getCrypto, _setCrypto, None,
 			_("Reference to the object that provides cryptographic services.  (varies)" ) )
 
@@ -586,6 +586,22 @@ class SlidePanelCaptionClick(dEvent):
 	appliesToClass = classmethod(appliesToClass)
 
 
+class DataSetChanged(DataEvent):
+	"""Occurs when the records of a bizobj have changed.
+
+	If a single field value was set, EventData["row"] and EventData["field"]
+	identify it; otherwise they are None, and any of the records may have
+	changed, as after a requery, sort, new or delete.
+	"""
+	pass
+
+class RequeryProgress(DataEvent):
+	"""Occurs while the rows of a bizobj's asynchronous requery are being fetched.
+
+	EventData["rowCount"] holds the number of rows fetched so far.
+	"""
+	pass
+
 class RowNumChanged(DataEvent):
 	"""Occurs when the RowNumber of the PrimaryBizobj of the dForm has changed."""
 	pass
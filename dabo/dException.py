@@ -88,6 +88,9 @@ class DBQueryException(DatabaseException):
 			err += '\nSQL: ' + self.sql
 		return err
 
+class DBQueryCancelledException(DBQueryException):
+	pass
+
 class XmlException(dException):
 	pass
 
@@ -47,7 +47,7 @@ class dReportWriter(dObject, ReportWriter):
 		win = self.ProgressControl
 		if win:
 			win.Caption = "Processing %s..." % self.ReportForm.getProp("Title")
-			win.updateProgress(0, len(self.Cursor))
+			win.updateProgress(0, self.RecordCount)
 			win.show()
 			win.Form.fitToSizer()
 
@@ -55,7 +55,7 @@ class dReportWriter(dObject, ReportWriter):
 		if force or self.RecordNumber % 10 == 0:
 			win = self.ProgressControl
 			if win:
-				win.updateProgress(self.RecordNumber, len(self.Cursor))
+				win.updateProgress(self.RecordNumber, self.RecordCount)
 				dabo.ui.yieldUI(_safe=True)
 
 	def _hideProgress(self):
@@ -115,7 +115,8 @@ class dReportWriter(dObject, ReportWriter):
 		_("""Specifies the control to receive progress updates.
 
 		The specified control will be updated with every record processed. It must have
-		a updateProgress(current_row, num_rows) method.
+		a updateProgress(current_row, num_rows) method; num_rows is None when the
+		Cursor is streamed and the number of records isn't known.
 
 		For the default control, use dabo.ui.dReportProgress.
 		"""))
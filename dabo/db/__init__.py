@@ -31,10 +31,13 @@ some rows from a backend database in a script. Here's an example of that::
 import datetime
 from decimal import Decimal
 from dConnection import dConnection
+from dConnectionPool import dConnectionPool
 from dCursorMixin import dCursorMixin
 from dConnectInfo import dConnectInfo
 from dTable import dTable
 from dDataSet import dDataSet
+from dDataWindow import dDataWindow
+from dCompactRecord import dCompactRecord
 import dabo
 from dabo.dException import FieldNotFoundException
 
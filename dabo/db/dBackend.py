@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import sys
+import os
 import time
 import re
+import tempfile
+import cPickle
 import datetime
 import threading
 import decimal
@@ -14,6 +17,8 @@ from dNoEscQuoteStr import dNoEscQuoteStr
 from dabo.lib.utils import ustr
 from dCursorMixin import dCursorMixin
 
+# Cursor classes made by dBackend._getStreamCursorClass().
+_streamCursorClasses = {}
 
 class dBackend(dObject):
 	"""Abstract class inherited by the specific Dabo database connectors."""
@@ -24,6 +29,16 @@ class dBackend(dObject):
 	nameEnclosureChar = '"'
 	# The character used in sql to represent parameters to be substituted
 	paramPlaceholder = "%s"
+	# The largest number of parameters to use in a single statement, such as
+	# when fetching child records for many parents with an 'in' list.
+	maxParams = 999
+	# Trivial query used to check that a connection is alive.
+	pingSQL = "select 1"
+	# Whether NULLs come before all other values when sorting in ascending order.
+	nullsSortFirst = True
+	# Extra arguments for connections that are shared by threads in a
+	# dConnectionPool.
+	poolConnectionArgs = {}
 
 	def __init__(self):
 		self._baseClass = dBackend
@@ -33,6 +48,13 @@ class dBackend(dObject):
 		# Reference to the cursor that is using this object
 		self._cursor = None
 		self.lastExecuteTime = time.time() # For keep alive interval
+		# Table information read from the database catalog, keyed on
+		# (kind, table, ...) tuples. See getSchemaInfo().
+		self._schemaCache = {}
+		# The schema version that the cache was read or started with, and
+		# whether the cache has changed since it was written to SchemaCacheFile.
+		self._schemaVersion = None
+		self._schemaCacheChanged = False
 
 
 	def isValidModule(self):
@@ -63,6 +85,55 @@ class dBackend(dObject):
 		return cursorClass(self._connection)
 
 
+	def getStreamCursor(self, cursorClass):
+		"""
+		Return a cursor for reading the rows of a query as they are fetched,
+		instead of all at once. By default this is a normal cursor, whose module
+		may read the whole result set into memory when the query is executed.
+		Override in subclasses whose modules have server-side cursors.
+		"""
+		return self.getCursor(cursorClass)
+
+
+	def _getStreamCursorClass(self, cursorClass, dbapiCursorClass):
+		"""
+		Return a class that mixes the Dabo part of 'cursorClass' with
+		'dbapiCursorClass', a server-side cursor class of the backend's module.
+		"""
+		key = (cursorClass, dbapiCursorClass)
+		try:
+			return _streamCursorClasses[key]
+		except KeyError:
+			pass
+		main = getattr(cursorClass, "superMixin", dCursorMixin)
+		class StreamCursor(main, dbapiCursorClass):
+			superMixin = main
+			superCursor = dbapiCursorClass
+			def __init__(self, *args, **kwargs):
+				main.__init__(self)
+				dbapiCursorClass.__init__(self, *args, **kwargs)
+		_streamCursorClasses[key] = StreamCursor
+		return StreamCursor
+
+
+	def cancelQuery(self):
+		"""
+		Abort the statement that another thread is running on this backend's
+		connection. Returns True if the database was asked to cancel it, or
+		False if the backend can't do that, in which case the statement runs
+		to completion. Override in subclasses whose modules support it.
+		"""
+		return False
+
+
+	def isPrivateDatabase(self, connectInfo):
+		"""
+		Return True if the database can only be reached through the connection
+		that created it, so that a second connection wouldn't see its data.
+		"""
+		return False
+
+
 	def formatForQuery(self, val, fieldType=None):
 		if isinstance(val, (datetime.date, datetime.datetime)):
 			# Some databases have specific rules for formatting date values.
@@ -365,6 +436,15 @@ class dBackend(dObject):
 		return "limit"
 
 
+	def getLimitOffsetClause(self, limit, offset):
+		"""
+		Return the clause that follows the limit word to get 'limit' rows,
+		starting after the first 'offset' rows. Backends that can't skip rows
+		in a query return None.
+		"""
+		return "%d offset %d" % (limit, offset)
+
+
 	def formSQL(self, fieldClause, fromClause, joinClause,
 				whereClause, groupByClause, orderByClause, limitClause):
 		"""
@@ -488,36 +568,159 @@ class dBackend(dObject):
 			# No table specified, so no update checking is possible
 			return None
 		# This is the current description of the cursor.
+		descFlds = cursor.FieldDescription
 		auxCrs = cursor._getAuxCursor()
-		if not cursor.FieldDescription:
+		if not descFlds:
 			# A query hasn't been run yet; so we need to get one
 			holdWhere = auxCrs._whereClause
 			auxCrs.addWhere("1 = 0")
 			auxCrs.execute(auxCrs.getSQL())
 			auxCrs._whereClause = holdWhere
-		descFlds = auxCrs.FieldDescription
-		# Get the raw version of the table
-		sql = "select * from %s where 1=0 " % self.encloseNames(cursor.Table,
-				autoQuote=autoQuote)
-		auxCrs.execute(sql)
+			descFlds = auxCrs.FieldDescription
 		# This is the clean version of the table.
-		stdFlds = auxCrs.FieldDescription
-
-		# Get all the fields that are not in the table.
-		ret0 = [d[0] for d in descFlds
-				if d[0] not in [s[0] for s in stdFlds] ]
-		# Extract the remaining fields (no need to test any already excluded
-		remFlds = [ d for d in descFlds if d[0] not in ret0]
-
-		# Now add any for which the members (except the display value,
-		# which is in position 2) do not match
-		ret0 += [ b[0] for b in remFlds
-				for s in [z for z in stdFlds if z[0] == b[0] ]
-				if (b[1] != s[1]) or (b[3] != s[3]) or (b[4] != s[4])
-				or (b[5] != s[5]) or (b[6] != s[6]) ]
+		stdFlds = self.getSchemaInfo("description", cursor.Table,
+				self._getTableDescription, cursor.Table, auxCrs, autoQuote)
+		stdDict = dict([(fld[0], fld) for fld in stdFlds])
+
+		# Get all the fields that are not in the table, and any for which the
+		# members (except the display value, which is in position 2) do not match
+		ret0 = []
+		for fld in descFlds:
+			std = stdDict.get(fld[0])
+			if (std is None) or (fld[1] != std[1]) or (fld[3] != std[3]) \
+					or (fld[4] != std[4]) or (fld[5] != std[5]) or (fld[6] != std[6]):
+				ret0.append(fld[0])
 		return ret0
 
 
+	def _getTableDescription(self, table, cursor, autoQuote=True):
+		"""Return the cursor description of the raw table."""
+		sql = "select * from %s where 1=0 " % self.encloseNames(table,
+				autoQuote=autoQuote)
+		cursor.execute(sql)
+		return tuple([tuple(fld) for fld in cursor.FieldDescription])
+
+
+	def getSchemaInfo(self, kind, table, func, *args):
+		"""
+		Return information about the table that is read from the database
+		catalog, such as its fields or its description, from the schema cache.
+		If it isn't cached yet, func(*args) is called to get it.
+
+		The cache is kept for the life of the connection, and in SchemaCacheFile
+		if it is set. Use clearSchemaCache() when table definitions change.
+		"""
+		if not self.CacheSchema:
+			return func(*args)
+		key = (kind, table)
+		try:
+			return self._schemaCache[key]
+		except KeyError:
+			pass
+		ret = self._schemaCache[key] = func(*args)
+		self._schemaCacheChanged = True
+		return ret
+
+
+	def clearSchemaCache(self, table=None):
+		"""
+		Discard the cached schema information for the passed table, or for
+		all tables if no table is passed. This is done automatically when a
+		create, alter or drop statement is executed through a Dabo cursor.
+		"""
+		if table is None:
+			if not self._schemaCache:
+				return
+			self._schemaCache.clear()
+		else:
+			keys = [key for key in self._schemaCache if key[1] == table]
+			if not keys:
+				return
+			for key in keys:
+				del self._schemaCache[key]
+		self._schemaCacheChanged = True
+
+
+	def getSchemaVersion(self):
+		"""
+		Return a value that changes when the definitions of the tables in the
+		database change, or None if the backend can't tell. SchemaCacheFile is
+		only used when there is a version, and the cache read from it is
+		discarded once the version changes.
+		"""
+		return None
+
+
+	def _fetchSchemaVersion(self, sql):
+		"""Return the row of the schema version query as a tuple."""
+		crs = self._connection.cursor()
+		try:
+			crs.execute(sql)
+			row = crs.fetchone()
+		finally:
+			crs.close()
+		if isinstance(row, dict):
+			row = sorted(row.items())
+		return tuple(row)
+
+
+	def _loadSchemaCache(self):
+		"""
+		Replace the schema cache with the contents of SchemaCacheFile, if it
+		was written for the current schema version.
+		"""
+		pth = self.SchemaCacheFile
+		self._schemaVersion = None
+		if not pth:
+			return
+		try:
+			version = self.getSchemaVersion()
+		except StandardError, e:
+			dabo.log.error(_("Could not read the schema version: %s") % e)
+			version = None
+		if version is None:
+			dabo.log.info(_("The schema cache file '%s' is not used: the backend "
+					"can't tell when the tables change.") % pth)
+			return
+		self._schemaVersion = version
+		# Write the file for this version when the connection is closed.
+		self._schemaCacheChanged = True
+		if not os.path.exists(pth):
+			return
+		try:
+			fileVersion, cache = cPickle.load(open(pth, "rb"))
+		except StandardError, e:
+			dabo.log.error(_("Could not read the schema cache file '%(pth)s': %(e)s")
+					% locals())
+			return
+		if fileVersion == version and isinstance(cache, dict):
+			self._schemaCache = cache
+			self._schemaCacheChanged = False
+
+
+	def flushSchemaCache(self):
+		"""
+		Write the schema cache to SchemaCacheFile, if it has changed since it
+		was read or last written. This is done when the connection is closed.
+		"""
+		pth = self.SchemaCacheFile
+		if not pth or self._schemaVersion is None or not self._schemaCacheChanged:
+			return
+		try:
+			# Write to a temp file first, so that a partly-written file is never read.
+			fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(pth)))
+			os.write(fd, cPickle.dumps((self._schemaVersion, self._schemaCache),
+					cPickle.HIGHEST_PROTOCOL))
+			os.close(fd)
+			if os.path.exists(pth):
+				os.remove(pth)
+			os.rename(tmpPath, pth)
+			self._schemaCacheChanged = False
+		except (IOError, OSError, TypeError, cPickle.PicklingError), e:
+			dabo.log.error(_("Could not write the schema cache file '%(pth)s': %(e)s")
+					% locals())
+
+
 	def getStructureDescription(self, cursor):
 		"""Return the basic field structure."""
 		field_structure = {}
@@ -644,7 +847,7 @@ class dBackend(dObject):
 						return
 
 					if time.time() - self.backendObj.lastExecuteTime > kal:
-						cur.execute("select 1")
+						cur.execute(self.backendObj.pingSQL)
 						self.backendObj.lastExecuteTime = time.time()
 
 		existingThread = getattr(self, "_keepAliveThread", None)
@@ -654,6 +857,19 @@ class dBackend(dObject):
 			wt = self._keepAliveThread = WorkerThread(self)
 			wt.start()
 
+	def _getCacheSchema(self):
+		try:
+			ret = self._cacheSchema
+		except AttributeError:
+			ret = self._cacheSchema = True
+		return ret
+
+	def _setCacheSchema(self, val):
+		self._cacheSchema = bool(val)
+		if not val:
+			self._schemaCache.clear()
+
+
 	def _getEncoding(self):
 		"""Get backend encoding."""
 		try:
@@ -682,6 +898,29 @@ class dBackend(dObject):
 		self._applyKeepAlive()
 
 
+	def _getSchemaCacheFile(self):
+		try:
+			ret = self._schemaCacheFile
+		except AttributeError:
+			ret = self._schemaCacheFile = None
+		return ret
+
+	def _setSchemaCacheFile(self, val):
+		self.flushSchemaCache()
+		self._schemaCacheFile = val
+		self._loadSchemaCache()
+
+
+	CacheSchema = property(_getCacheSchema, _setCacheSchema, None,
+			_("""Specifies whether table information read from the database catalog
+			is cached.  (bool)
+
+			When True (the default), the fields, types and primary keys of each
+			table are only read once per connection, instead of each time a cursor
+			runs a new query. Call clearSchemaCache() if the tables are changed
+			outside of this connection.
+			"""))
+
 	Encoding = property(_getEncoding, _setEncoding, None,
 			_("Backend encoding  (str)"))
 
@@ -691,3 +930,13 @@ class dBackend(dObject):
 			Defaults to None, meaning we never send a KeepAlive query. The interval
 			is expressed in seconds.
 			"""))
+
+	SchemaCacheFile = property(_getSchemaCacheFile, _setSchemaCacheFile, None,
+			_("""Path of a file that keeps the schema cache between sessions.  (str)
+
+			Defaults to None, meaning the cache is only kept in memory. Setting it
+			replaces the cache with the contents of the file, if the file was written
+			for the current version of the schema (see getSchemaVersion()). The file
+			is written when the connection is closed, or when flushSchemaCache() is
+			called. Use a separate file for each database.
+			"""))
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+
+# Marks a field that is part of the layout, but isn't set in the record.
+_missing = object()
+# Record classes that have already been created, keyed on their field layout.
+_recordClasses = {}
+
+
+
+class dCompactRecord(object):
+	""" Dict-like record that keeps its values in a single tuple or list.
+
+	Each record only holds its values; the field names and their positions
+	are stored once, on a subclass that is shared by all the records with the
+	same fields. Use forFields() to get the class for a given field layout.
+	Keys that are not part of the layout, such as the cursor's internal flags,
+	are kept in a small overflow dict that is only created when needed.
+
+	The values are stored as passed (typically the tuple returned by the
+	database adapter) and are only copied to a list on the first change.
+	"""
+	__slots__ = ("_values", "_extra")
+	_fields = ()
+	_fieldMap = {}
+	_layout = ((), ())
+
+
+	def __init__(self, values, extra=None):
+		self._values = values
+		self._extra = extra
+
+
+	@classmethod
+	def forFields(cls, fields, reserved=()):
+		"""
+		Return the record class for the passed field names. Names in 'reserved'
+		are part of the layout, but are not present in a record until they are
+		set; this keeps frequently-set flags out of the overflow dict.
+		"""
+		layout = (tuple(fields), tuple(reserved))
+		try:
+			return _recordClasses[layout]
+		except KeyError:
+			pass
+		allFields = layout[0] + layout[1]
+		fieldMap = dict([(fld, idx) for idx, fld in enumerate(allFields)])
+		recClass = type("dCompactRecord", (cls, ), {"__slots__": (),
+				"_fields": allFields, "_fieldMap": fieldMap, "_layout": layout})
+		_recordClasses[layout] = recClass
+		return recClass
+
+
+	def __getitem__(self, key):
+		idx = self._fieldMap.get(key)
+		if idx is None:
+			if self._extra:
+				return self._extra[key]
+			raise KeyError(key)
+		try:
+			val = self._values[idx]
+		except IndexError:
+			raise KeyError(key)
+		if val is _missing:
+			raise KeyError(key)
+		return val
+
+
+	def __setitem__(self, key, val):
+		idx = self._fieldMap.get(key)
+		if idx is None:
+			if self._extra is None:
+				self._extra = {}
+			self._extra[key] = val
+			return
+		values = self._values
+		if not isinstance(values, list):
+			values = self._values = list(values)
+		if idx >= len(values):
+			values.extend([_missing] * (idx + 1 - len(values)))
+		values[idx] = val
+
+
+	def __delitem__(self, key):
+		if key not in self:
+			raise KeyError(key)
+		idx = self._fieldMap.get(key)
+		if idx is None:
+			del self._extra[key]
+		else:
+			self[key] = _missing
+
+
+	def __contains__(self, key):
+		idx = self._fieldMap.get(key)
+		if idx is None:
+			return bool(self._extra) and key in self._extra
+		values = self._values
+		return idx < len(values) and values[idx] is not _missing
+
+
+	def has_key(self, key):
+		return key in self
+
+
+	def __iter__(self):
+		return self.iterkeys()
+
+
+	def __len__(self):
+		return len(self.keys())
+
+
+	def iteritems(self):
+		for fld, val in zip(self._fields, self._values):
+			if val is not _missing:
+				yield (fld, val)
+		if self._extra:
+			for item in self._extra.iteritems():
+				yield item
+
+
+	def iterkeys(self):
+		for fld, val in self.iteritems():
+			yield fld
+
+
+	def itervalues(self):
+		for fld, val in self.iteritems():
+			yield val
+
+
+	def items(self):
+		return list(self.iteritems())
+
+
+	def keys(self):
+		return list(self.iterkeys())
+
+
+	def values(self):
+		return list(self.itervalues())
+
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+
+	def setdefault(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			self[key] = default
+			return default
+
+
+	def pop(self, key, *default):
+		try:
+			val = self[key]
+		except KeyError:
+			if default:
+				return default[0]
+			raise
+		del self[key]
+		return val
+
+
+	def update(self, other=None, **kwargs):
+		if other is not None:
+			if hasattr(other, "keys"):
+				other = [(key, other[key]) for key in other.keys()]
+			for key, val in other:
+				self[key] = val
+		for key, val in kwargs.iteritems():
+			self[key] = val
+
+
+	def copy(self):
+		"""Return a new record of the same class with a copy of the values."""
+		extra = self._extra
+		if extra is not None:
+			extra = extra.copy()
+		return self.__class__(list(self._values), extra)
+
+
+	def asDict(self):
+		"""Return the contents of this record as a regular dict."""
+		return dict(self.iteritems())
+
+
+	def __eq__(self, other):
+		if isinstance(other, dCompactRecord):
+			other = other.asDict()
+		elif not isinstance(other, dict):
+			return NotImplemented
+		return self.asDict() == other
+
+
+	def __ne__(self, other):
+		ret = self.__eq__(other)
+		if ret is NotImplemented:
+			return ret
+		return not ret
+
+
+	__hash__ = None
+
+
+	def __repr__(self):
+		return repr(self.asDict())
+
+
+	def __reduce__(self):
+		# The record classes are created on the fly, so pickle the layout.
+		return (_rebuildRecord, (self._layout, list(self._values), self._extra))
+
+
+
+def _rebuildRecord(layout, values, extra):
+	return dCompactRecord.forFields(*layout)(values, extra)
+
+
+
+def _recordSize(rec):
+	"""Approximate memory used by a record and its values container."""
+	if isinstance(rec, dCompactRecord):
+		ret = sys.getsizeof(rec) + sys.getsizeof(rec._values)
+		if rec._extra is not None:
+			ret += sys.getsizeof(rec._extra)
+		return ret
+	return sys.getsizeof(rec)
+
+
+
+if __name__ == "__main__":
+	# Compare fetch time and record memory for dict and compact records.
+	import dabo.db
+	numRows = 200000
+	con = dabo.db.dConnection(DbType="SQLite", Database=":memory:")
+	cur = con.getDaboCursor()
+	cur.executescript("""
+create table lookup (pk INTEGER PRIMARY KEY, code CHAR, descrip CHAR,
+		amount INT, active INT);
+""")
+	cur.executemany("insert into lookup (code, descrip, amount, active) values (?, ?, ?, ?)",
+			[("C%06d" % num, "Description %s" % num, num, num % 2)
+			for num in xrange(numRows)])
+	for compact in (False, True):
+		cur.CompactRecords = compact
+		# Don't time the release of the previous records.
+		cur.execute("select * from lookup where 0 = 1")
+		start = time.time()
+		cur.execute("select * from lookup")
+		elapsed = time.time() - start
+		size = sum([_recordSize(rec) for rec in cur._records])
+		print "%s records: fetched %s rows in %.3f s; %.1f MB of records" % (
+				("Compact" if compact else "Dict"), cur.RowCount, elapsed,
+				size / 1048576.0)
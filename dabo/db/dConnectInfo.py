@@ -74,6 +74,29 @@ class dConnectInfo(dObject):
 				self._customParameters[k] = v
 
 
+	def copy(self):
+		"""
+		Return a new dConnectInfo with the same settings, and a backend object
+		of its own, so that it can be used for a separate connection.
+		"""
+		ret = dConnectInfo()
+		ret._name = self._name
+		ret._host = self._host
+		ret._user = self._user
+		ret._password = self._password
+		ret._database = self._database
+		ret._port = self._port
+		ret._remoteHost = self._remoteHost
+		ret._keepAliveInterval = self._keepAliveInterval
+		ret._customParameters = self.CustomParameters
+		try:
+			ret._cryptoProvider = self._cryptoProvider
+		except AttributeError:
+			pass
+		ret.DbType = self.DbType
+		return ret
+
+
 	def getConnection(self, **kwargs):
 		kwargs.update(self.CustomParameters)
 		return self._backendObject.getConnection(self, **kwargs)
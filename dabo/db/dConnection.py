@@ -37,6 +37,7 @@ class dConnection(dObject):
 
 
 	def close(self):
+		self.getBackendObject().flushSchemaCache()
 		self._connection.close()
 
 
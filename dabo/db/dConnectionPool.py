@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from contextlib import contextmanager
+import dabo
+from dabo.dLocalize import _
+import dabo.dException as dException
+from dabo.dObject import dObject
+from dConnectInfo import dConnectInfo
+from dConnection import dConnection
+
+
+
+class dConnectionPool(dObject):
+	"""Keep a set of open connections to a database, for use by several threads.
+
+	A dConnection and the cursors created from it must only be used by one
+	thread at a time. A pool lets each thread check out a connection of its
+	own with getConnection(), and return it with release() when it is done, so
+	that the next thread can reuse it instead of opening a new one. A thread
+	that asks for a connection while it already has one checked out gets the
+	same one back. Connections of threads that ended without releasing them
+	are reclaimed when the pool runs out of connections.
+
+	Between MinSize and MaxSize connections are kept open. When all of them
+	are in use, getConnection() waits up to Timeout seconds for one to be
+	released. Idle connections are checked with a simple query before they
+	are handed out, and are kept alive by a background thread if
+	KeepAliveInterval is set; broken connections are replaced. The Stats
+	property reports how much the pool is used.
+
+	Every connection in the pool has its own backend object, so connection
+	settings such as the backend's SchemaCacheFile must be set on each of
+	them. For SQLite, ':memory:' databases can't be shared by connections.
+	"""
+	def __init__(self, connectInfo=None, parent=None, **kwargs):
+		self._baseClass = dConnectionPool
+		self._condition = threading.Condition()
+		# Idle connections, as [connection, lastUsedTime] lists; the most
+		# recently used ones are at the end.
+		self._idle = []
+		# Checked-out connections, as [connection, checkoutCount] lists keyed
+		# on the thread that checked them out.
+		self._checkedOut = {}
+		# Number of open connections, plus those being opened.
+		self._size = 0
+		self._closed = False
+		self._maintenanceThread = None
+		self._stopMaintenance = threading.Event()
+		self._statCounts = dict.fromkeys(("checkouts", "waits", "waitTime", "timeouts",
+				"created", "replaced", "reclaimed", "peakInUse"), 0)
+		if isinstance(connectInfo, dConnectInfo):
+			self._connectInfo = connectInfo
+		elif connectInfo:
+			self._connectInfo = dConnectInfo(connInfo=connectInfo)
+		else:
+			raise TypeError("dConnectInfo instance or dict not sent.")
+		super(dConnectionPool, self).__init__(**kwargs)
+		self.Parent = parent
+		self._fillToMinSize()
+		self._startMaintenance()
+
+
+	def getConnection(self, timeout=None):
+		"""
+		Check out a connection for the calling thread and return it. If the
+		thread already has one, it is returned again, and must be released
+		as many times as it was checked out. Waits up to 'timeout' seconds
+		(default: Timeout) for a connection to become available, and then
+		raises ConnectionNotFoundException.
+		"""
+		if timeout is None:
+			timeout = self.Timeout
+		thread = threading.currentThread()
+		cond = self._condition
+		cond.acquire()
+		try:
+			if self._closed:
+				raise dException.ConnectionNotFoundException(_("The connection pool is closed."))
+			entry = self._checkedOut.get(thread)
+			if entry is not None:
+				entry[1] += 1
+				return entry[0]
+			deadline = time.time() + timeout
+			waitStart = None
+			while True:
+				if self._idle:
+					conn, lastUsed = self._idle.pop()
+					break
+				if self._size < self.MaxSize:
+					# Reserve the place for a new connection.
+					conn = lastUsed = None
+					self._size += 1
+					break
+				abandoned = self._reclaimAbandoned()
+				if abandoned:
+					# Roll back whatever the ended threads left open before the
+					# connections are used again.
+					cond.release()
+					try:
+						for conn in abandoned:
+							self._checkIn(conn)
+					finally:
+						cond.acquire()
+					continue
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					self._statCounts["timeouts"] += 1
+					raise dException.ConnectionNotFoundException(
+							_("No connection became available in the pool within %s seconds.")
+							% timeout)
+				if waitStart is None:
+					waitStart = time.time()
+					self._statCounts["waits"] += 1
+				cond.wait(remaining)
+			if waitStart is not None:
+				self._statCounts["waitTime"] += time.time() - waitStart
+		finally:
+			cond.release()
+
+		# Opening and checking connections can take a while, so it's done
+		# without holding the lock.
+		try:
+			if conn is None:
+				conn = self._openConnection()
+			elif time.time() - lastUsed >= self.HealthCheckInterval \
+					and not self._isHealthy(conn):
+				conn = self._replaceConnection(conn)
+		except:
+			self._discard()
+			raise
+		cond.acquire()
+		try:
+			self._checkedOut[thread] = [conn, 1]
+			counts = self._statCounts
+			counts["checkouts"] += 1
+			counts["peakInUse"] = max(counts["peakInUse"], len(self._checkedOut))
+		finally:
+			cond.release()
+		return conn
+
+
+	def getThreadConnection(self):
+		"""
+		Return the connection checked out by the calling thread, checking one
+		out if it doesn't have one yet. Unlike getConnection(), calling this
+		again doesn't require another release().
+		"""
+		cond = self._condition
+		cond.acquire()
+		try:
+			entry = self._checkedOut.get(threading.currentThread())
+			if entry is not None:
+				return entry[0]
+		finally:
+			cond.release()
+		return self.getConnection()
+
+
+	def release(self, force=False):
+		"""
+		Return the calling thread's connection to the pool. If it was checked
+		out several times, it is only returned after the last release, unless
+		'force' is True. Any transaction that wasn't committed is rolled back.
+		"""
+		thread = threading.currentThread()
+		cond = self._condition
+		cond.acquire()
+		try:
+			entry = self._checkedOut.get(thread)
+			if entry is None:
+				return
+			entry[1] -= 1
+			if entry[1] > 0 and not force:
+				return
+			del self._checkedOut[thread]
+		finally:
+			cond.release()
+		self._checkIn(entry[0])
+
+
+	@contextmanager
+	def connection(self, timeout=None):
+		"""
+		Context manager that checks out a connection for the block, and
+		releases it at the end::
+
+			with pool.connection() as conn:
+				biz = MyBizobj(conn)
+				biz.requery()
+		"""
+		conn = self.getConnection(timeout)
+		try:
+			yield conn
+		finally:
+			self.release()
+
+
+	def checkIdleConnections(self):
+		"""
+		Check the idle connections: those that have been idle for longer than
+		KeepAliveInterval are sent a query to keep them alive, and replaced if
+		they don't respond; those above MinSize that have been idle for longer
+		than IdleTimeout are closed. This is called periodically by the pool's
+		background thread when KeepAliveInterval or IdleTimeout is set.
+		"""
+		now = time.time()
+		keepAlive = self.KeepAliveInterval
+		idleTimeout = self.IdleTimeout
+		toClose = []
+		toCheck = []
+		cond = self._condition
+		cond.acquire()
+		try:
+			keep = []
+			# The oldest connections are at the start of the list.
+			for entry in self._idle:
+				conn, lastUsed = entry
+				if idleTimeout is not None and now - lastUsed > idleTimeout \
+						and self._size - len(toClose) > self.MinSize:
+					toClose.append(conn)
+				elif keepAlive is not None and now - lastUsed > keepAlive:
+					toCheck.append(conn)
+				else:
+					keep.append(entry)
+			self._idle = keep
+			self._size -= len(toClose)
+		finally:
+			cond.release()
+		for conn in toClose:
+			self._closeConnection(conn)
+		for conn in toCheck:
+			if not self._isHealthy(conn):
+				try:
+					conn = self._replaceConnection(conn)
+				except StandardError, e:
+					dabo.log.error(_("Could not reopen a pooled connection: %s") % e)
+					self._discard()
+					continue
+			self._checkIn(conn, rollback=False)
+		self._fillToMinSize()
+
+
+	def close(self):
+		"""Close all the idle connections, and those checked out as they are released."""
+		self._stopMaintenance.set()
+		cond = self._condition
+		cond.acquire()
+		try:
+			self._closed = True
+			idle = [entry[0] for entry in self._idle]
+			self._idle = []
+			self._size -= len(idle)
+			cond.notifyAll()
+		finally:
+			cond.release()
+		for conn in idle:
+			self._closeConnection(conn)
+
+
+	def _openConnection(self):
+		"""Open a new connection with its own backend object."""
+		ci = self._connectInfo.copy()
+		# The pool checks the idle connections, instead of a keep-alive
+		# thread for each backend object.
+		ci.KeepAliveInterval = None
+		kwargs = ci.getBackendObject().poolConnectionArgs
+		conn = dConnection(ci, **kwargs)
+		self._condition.acquire()
+		self._statCounts["created"] += 1
+		self._condition.release()
+		return conn
+
+
+	def _replaceConnection(self, conn):
+		"""Close a broken connection and return a new one in its place."""
+		self._closeConnection(conn)
+		conn = self._openConnection()
+		self._condition.acquire()
+		self._statCounts["replaced"] += 1
+		self._condition.release()
+		return conn
+
+
+	def _closeConnection(self, conn):
+		try:
+			conn.close()
+		except StandardError:
+			# It's most likely already broken.
+			pass
+
+
+	def _checkIn(self, conn, rollback=True):
+		"""Put the connection back in the idle list."""
+		if rollback:
+			try:
+				conn.getConnection().rollback()
+			except StandardError:
+				# The connection is no longer usable.
+				self._closeConnection(conn)
+				self._discard()
+				return
+		cond = self._condition
+		cond.acquire()
+		try:
+			if self._closed:
+				self._size -= 1
+			else:
+				self._idle.append([conn, time.time()])
+			cond.notify()
+		finally:
+			cond.release()
+		if self._closed:
+			self._closeConnection(conn)
+
+
+	def _discard(self):
+		"""Give up the place of a connection that couldn't be used."""
+		cond = self._condition
+		cond.acquire()
+		try:
+			self._size -= 1
+			cond.notify()
+		finally:
+			cond.release()
+
+
+	def _reclaimAbandoned(self):
+		"""
+		Take back the connections of threads that have ended, and return them.
+		Must be called with the lock held. The connections still have to be
+		rolled back and checked in with _checkIn(), without the lock.
+		"""
+		dead = [thread for thread in self._checkedOut if not thread.isAlive()]
+		abandoned = [self._checkedOut.pop(thread)[0] for thread in dead]
+		self._statCounts["reclaimed"] += len(abandoned)
+		return abandoned
+
+
+	def _isHealthy(self, conn):
+		"""Run a trivial query on the connection to see that it still works."""
+		try:
+			crs = conn.getConnection().cursor()
+			crs.execute(conn.getBackendObject().pingSQL)
+			crs.fetchall()
+			crs.close()
+			return True
+		except StandardError:
+			return False
+
+
+	def _fillToMinSize(self):
+		"""Open connections until there are at least MinSize of them."""
+		while True:
+			cond = self._condition
+			cond.acquire()
+			try:
+				if self._closed or self._size >= self.MinSize:
+					return
+				self._size += 1
+			finally:
+				cond.release()
+			try:
+				conn = self._openConnection()
+			except:
+				self._discard()
+				raise
+			self._checkIn(conn, rollback=False)
+
+
+	def _startMaintenance(self):
+		"""Start the thread that checks the idle connections, if it's needed."""
+		intervals = [val for val in (self.KeepAliveInterval, self.IdleTimeout)
+				if val is not None]
+		if not intervals or self._maintenanceThread is not None:
+			return
+		interval = max(1, min(intervals) / 2.0)
+
+		def maintain():
+			while not self._stopMaintenance.isSet():
+				self._stopMaintenance.wait(interval)
+				if not self._stopMaintenance.isSet():
+					try:
+						self.checkIdleConnections()
+					except StandardError, e:
+						dabo.log.error(_("Error checking pooled connections: %s") % e)
+
+		thrd = self._maintenanceThread = threading.Thread(target=maintain,
+				name="dConnectionPool maintenance")
+		thrd.setDaemon(True)
+		thrd.start()
+
+
+	def _getConnectInfo(self):
+		return self._connectInfo
+
+
+	def _getHealthCheckInterval(self):
+		try:
+			ret = self._healthCheckInterval
+		except AttributeError:
+			ret = self._healthCheckInterval = 30
+		return ret
+
+	def _setHealthCheckInterval(self, val):
+		self._healthCheckInterval = val
+
+
+	def _getIdleTimeout(self):
+		try:
+			ret = self._idleTimeout
+		except AttributeError:
+			ret = self._idleTimeout = None
+		return ret
+
+	def _setIdleTimeout(self, val):
+		self._idleTimeout = val
+		self._startMaintenance()
+
+
+	def _getKeepAliveInterval(self):
+		try:
+			ret = self._keepAliveInterval
+		except AttributeError:
+			ret = self._keepAliveInterval = self._connectInfo.KeepAliveInterval
+		return ret
+
+	def _setKeepAliveInterval(self, val):
+		self._keepAliveInterval = val
+		self._startMaintenance()
+
+
+	def _getMaxSize(self):
+		try:
+			ret = self._maxSize
+		except AttributeError:
+			ret = self._maxSize = 10
+		return ret
+
+	def _setMaxSize(self, val):
+		self._maxSize = max(1, int(val))
+		self._condition.acquire()
+		self._condition.notifyAll()
+		self._condition.release()
+
+
+	def _getMinSize(self):
+		try:
+			ret = self._minSize
+		except AttributeError:
+			ret = self._minSize = 0
+		return ret
+
+	def _setMinSize(self, val):
+		self._minSize = max(0, int(val))
+
+
+	def _getName(self):
+		try:
+			return self._connectInfo.Name
+		except AttributeError:
+			return "?"
+
+
+	def _getStats(self):
+		cond = self._condition
+		cond.acquire()
+		try:
+			ret = self._statCounts.copy()
+			ret["size"] = self._size
+			ret["idle"] = len(self._idle)
+			ret["inUse"] = len(self._checkedOut)
+			ret["minSize"] = self.MinSize
+			ret["maxSize"] = self.MaxSize
+		finally:
+			cond.release()
+		return ret
+
+
+	def _getTimeout(self):
+		try:
+			ret = self._timeout
+		except AttributeError:
+			ret = self._timeout = 30
+		return ret
+
+	def _setTimeout(self, val):
+		self._timeout = val
+
+
+	ConnectInfo = property(_getConnectInfo, None, None,
+			_("The connectInfo that the pooled connections are made from.  (dConnectInfo)"))
+
+	HealthCheckInterval = property(_getHealthCheckInterval, _setHealthCheckInterval, None,
+			_("""Seconds that a connection can be idle before it is checked with a
+			query when it is checked out. Default=30  (int)"""))
+
+	IdleTimeout = property(_getIdleTimeout, _setIdleTimeout, None,
+			_("""Seconds after which idle connections above MinSize are closed, or
+			None to keep them open. Default=None  (int)"""))
+
+	KeepAliveInterval = property(_getKeepAliveInterval, _setKeepAliveInterval, None,
+			_("""Seconds after which an idle connection is sent a query to keep it
+			alive, or None to never send one. Defaults to the KeepAliveInterval of
+			the ConnectInfo.  (int)"""))
+
+	MaxSize = property(_getMaxSize, _setMaxSize, None,
+			_("Maximum number of open connections. Default=10  (int)"))
+
+	MinSize = property(_getMinSize, _setMinSize, None,
+			_("""Number of connections that are opened when the pool is created,
+			and kept open afterwards. Default=0  (int)"""))
+
+	Name = property(_getName, None, None,
+			_("The name of the connection.  (str)"))
+
+	Stats = property(_getStats, None, None,
+			_("""Usage statistics of the pool.  (dict)
+
+			Keys: 'size' (open connections), 'idle', 'inUse', 'minSize', 'maxSize',
+			'peakInUse' (most connections in use at once), 'checkouts', 'waits'
+			(checkouts that had to wait), 'waitTime' (total seconds waited),
+			'timeouts', 'created', 'replaced' (broken connections reopened) and
+			'reclaimed' (connections of threads that ended without releasing them).
+			"""))
+
+	Timeout = property(_getTimeout, _setTimeout, None,
+			_("""Seconds that getConnection() waits for a connection when all of
+			them are in use. Default=30  (int)"""))
@@ -3,6 +3,8 @@
 
 import datetime
 import time
+import bisect
+import operator
 import re
 from decimal import Decimal
 import functools
@@ -13,6 +15,8 @@ import dabo.dException as dException
 from dabo.dObject import dObject
 from dNoEscQuoteStr import dNoEscQuoteStr
 from dabo.db.dDataSet import dDataSet
+from dabo.db.dCompactRecord import dCompactRecord
+from dabo.db.dFieldMetadata import dFieldMetadata
 from dabo.lib import dates
 from dabo.lib.utils import noneSortKey, caseInsensitiveSortKey
 from dabo.lib.utils import ustr
@@ -62,6 +66,8 @@ class dCursorMixin(dObject):
 		self._blank = {}
 		# Flag for indicating NULL default values were set
 		self._nullDefaults = False
+		# Statements collected between beginBatchSave() and endBatchSave()
+		self.__saveBatch = None
 		# Writable version of the dbapi 'description' attribute
 		self.descriptionClean = None
 		# Last executed sql params
@@ -82,8 +88,21 @@ class dCursorMixin(dObject):
 		self.__lastFieldList = ""
 		self._whitespacePat = re.compile(r"(\s+)")
 		self._selectStatementPat = re.compile(r"\bselect\b(.+)\bfrom\b", re.I | re.M | re.S)
-		# Holds the keys in the original, unsorted order for unsorting the dataset
-		self.__unsortedRows = []
+		# Holds the records in their original, unsorted order for unsorting the dataset
+		self.__unsortedRows = None
+		# Maps PK values to row numbers. It is built lazily, and is only valid
+		# for the record set and KeyField it was built from.
+		self._pkIndex = None
+		self._pkIndexRecords = None
+		self._pkIndexKeyField = None
+		# Set when more than one row shares the same PK value.
+		self._pkIndexHasDups = False
+		# Fields registered with addIndex(), and the sorted seek() indexes built
+		# for them, keyed on (field, caseFolded). Like the PK index, these are
+		# only valid for the record set they were built from.
+		self._indexedFields = set()
+		self._seekIndexes = {}
+		self._seekIndexRecords = None
 		# Holds the name of fields to be skipped when updating the backend, such
 		# as calculated or derived fields, or fields that are otherwise not to be updated.
 		self.__nonUpdateFields = None
@@ -108,10 +127,14 @@ class dCursorMixin(dObject):
 
 		self._autoPopulatePK = True
 		self._autoQuoteNames = True
+		self._compactRecords = False
+		self._fetchBatchSize = 1000
 
 		self.__tmpPK = -1		# temp PK value for new records.
 		# Holds the data types for each field
 		self._types = {}
+		# Lookup tables for the DataStructure; see _getFieldMetadata().
+		self._fieldMetadata = None
 
 		# Holds reference to auxiliary cursor that handles queries that
 		# are not supposed to affect the record set.
@@ -257,17 +280,12 @@ class dCursorMixin(dObject):
 		elif pythonType in (datetime.date,) and isinstance(field_val, basestring):
 			return tryToCorrect(dates.getDateFromString, field_val, field_name)
 		elif pythonType in (Decimal,):
-			ds = self.DataStructure
 			_field_val = field_val
 			if type(field_val) in (float,):
 				# Can't convert to decimal directly from float
 				_field_val = ustr(_field_val)
 			# Need to convert to the correct scale:
-			try:
-				scale = [s[5] for s in ds
-						if s[0] == field_name][0]
-			except IndexError:
-				scale = None
+			scale = self._getFieldMetadata().Scales.get(field_name)
 			if scale is None:
 				try:
 					scale = len(_field_val.split(".")[1])
@@ -333,7 +351,8 @@ class dCursorMixin(dObject):
 			log("%s (couldn't log SQL or PARAMS)" % msg)
 
 
-	def execute(self, sql, params=None, errorClass=None, convertQMarks=False):
+	def execute(self, sql, params=None, errorClass=None, convertQMarks=False,
+			_fetch=True):
 		"""Execute the sql, and populate the DataSet if it is a select statement."""
 		# The idea here is to let the super class do the actual work in
 		# retrieving the data. However, many cursor classes can only return
@@ -361,23 +380,8 @@ class dCursorMixin(dObject):
 			if errorClass is not None and isinstance(e, errorClass):
 				raise e
 			self._dblogExecute("execute() FAILED", sql, params) 
-
-			# Database errors need to be decoded from database encoding.
-			try:
-				errMsg = unicode(str(e), self.Encoding)
-			except UnicodeError:
-				errMsg = ustr(e)
-			# If this is due to a broken connection, let the user know.
-			# Different backends have different messages, but they
-			# should all contain the string 'connect' in them.
-			if "connect" in errMsg.lower():
-				raise dException.ConnectionLostException(errMsg)
-			elif "access" in errMsg.lower():
-				raise dException.DBNoAccessException(errMsg)
-			else:
-				errMsg = _("DBQueryException encountered in execute(): %s") % errMsg
-				self._dblogExecute(errMsg, sql)
-				raise dException.DBQueryException(errMsg)
+			raise self._getExecuteException(e, sql,
+					_("DBQueryException encountered in execute(): %s"))
 
 		# Set the last execute time in case there is a Keep Alive Interval
 		self.BackendObject.lastExecuteTime = time.time()
@@ -389,8 +393,14 @@ class dCursorMixin(dObject):
 		if self._newStructure(sql):
 			self._storeFieldTypes()
 
-		if sql.split(None, 1)[0].lower() not in ("select", "pragma"):
-			# No need to massage the data for DML commands
+		command = sql.split(None, 1)[0].lower()
+		if command in ("create", "alter", "drop"):
+			# Table definitions may have changed.
+			self.BackendObject.clearSchemaCache()
+			self._fieldStructure.clear()
+		if not _fetch or command not in ("select", "pragma"):
+			# No need to massage the data for DML commands, or when the caller
+			# will fetch the rows itself.
 			self._records = dDataSet(tuple())
 			return res
 
@@ -405,7 +415,30 @@ class dCursorMixin(dObject):
 				errMsg = ustr(e)
 			dabo.log.error("Error fetching records: (%s, %s)" % (type(e), errMsg))
 
-		if _records and isinstance(_records[0], (tuple, list)):
+		self._records = self._makeDataSet(_records)
+		# This will handle bounds issues
+		self.RowNumber = self.RowNumber
+		return res
+
+
+	def _makeDataSet(self, _records):
+		"""Return a dDataSet of records for the rows fetched from the backend."""
+		if _records and self._compactRecords:
+			# Keep each row's values in a record that shares its field layout with
+			# all the other rows, instead of in a separate dict.
+			if isinstance(_records[0], (tuple, list)):
+				fldNames = [f[0] for f in self.FieldDescription]
+				recClass = dCompactRecord.forFields(fldNames, cursor_flags)
+				_records = [recClass(row) for row in _records]
+			else:
+				fldNames = _records[0].keys()
+				recClass = dCompactRecord.forFields(fldNames, cursor_flags)
+				if len(fldNames) > 1:
+					getValues = operator.itemgetter(*fldNames)
+				else:
+					getValues = lambda row: (row[fldNames[0]], )
+				_records = [recClass(getValues(row)) for row in _records]
+		elif _records and isinstance(_records[0], (tuple, list)):
 			# Need to convert each row to a Dict, since the backend didn't do it.
 			tmpRows = []
 			fldNames = [f[0] for f in self.FieldDescription]
@@ -415,10 +448,52 @@ class dCursorMixin(dObject):
 					dic[fldName] = row[idx]
 				tmpRows.append(dic)
 			_records = tmpRows
+		return dDataSet(_records)
 
-		self._records = dDataSet(_records)
-		# This will handle bounds issues
-		self.RowNumber = self.RowNumber
+
+	def _getExecuteException(self, e, sql, queryErrMsg):
+		"""
+		Return the Dabo exception to raise for an error from the backend.
+		'queryErrMsg' is the message template used for query errors.
+		"""
+		# Database errors need to be decoded from database encoding.
+		try:
+			errMsg = unicode(str(e), self.Encoding)
+		except UnicodeError:
+			errMsg = ustr(e)
+		# If this is due to a broken connection, let the user know.
+		# Different backends have different messages, but they
+		# should all contain the string 'connect' in them.
+		if "connect" in errMsg.lower():
+			return dException.ConnectionLostException(errMsg)
+		elif "access" in errMsg.lower():
+			return dException.DBNoAccessException(errMsg)
+		errMsg = queryErrMsg % errMsg
+		self._dblogExecute(errMsg, sql)
+		return dException.DBQueryException(errMsg)
+
+
+	def executeMany(self, sql, paramSeq, convertQMarks=False):
+		"""
+		Execute the passed DML statement once for each parameter tuple in
+		'paramSeq', using the backend's executemany(). Errors are reported
+		the same way as they are by execute().
+		"""
+		if isinstance(sql, unicode):
+			sql = sql.encode(self.Encoding)
+		if convertQMarks:
+			sql = self._qMarkToParamPlaceholder(sql)
+		sql = self.processFields(sql)
+		paramSeq = list(paramSeq)
+		try:
+			res = self.superCursor.executemany(self, sql, paramSeq)
+			if not self.IsPrefCursor:
+				self._dblogExecute("executeMany() (%s rows)" % len(paramSeq), sql)
+		except Exception, e:
+			self._dblogExecute("executeMany() FAILED", sql)
+			raise self._getExecuteException(e, sql,
+					_("DBQueryException encountered in executeMany(): %s"))
+		self.BackendObject.lastExecuteTime = time.time()
 		return res
 
 
@@ -435,6 +510,167 @@ class dCursorMixin(dObject):
 		return ac
 
 
+	def executeStream(self, sql, params=None, batchSize=None, convertQMarks=False):
+		"""
+		Execute the passed select statement, and return a generator that yields
+		each of the resulting records as a dict.
+
+		The rows are fetched from the backend in batches of 'batchSize' rows
+		(default: FetchBatchSize), and are not stored. The query runs on a
+		separate cursor, so the contents of this cursor aren't affected.
+		Virtual fields are not included in the records.
+
+		Memory use only stays flat when the backend supplies a server-side
+		cursor (see dBackend.getStreamCursor()); MySQL and PostgreSQL do. With
+		other backends the database module may read the whole result set when
+		the query is executed, and only the conversion of the rows to records
+		is done a batch at a time. On MySQL no other statement can run on the
+		connection until all the records are read or the generator is closed.
+		"""
+		crs = self._getStreamCursor()
+		crs.execute(sql, params, convertQMarks=convertQMarks, _fetch=False)
+		return crs._streamRecords(batchSize or self.FetchBatchSize)
+
+
+	def requeryStream(self, params=None, batchSize=None, convertQMarks=False):
+		"""
+		Run the current SQL, and return a generator that yields the records
+		as they are fetched. See executeStream() for details.
+		"""
+		return self.executeStream(self.CurrentSQL, params, batchSize=batchSize,
+				convertQMarks=convertQMarks)
+
+
+	def fetchRequery(self, connection, params=None, batchSize=None, progress=None,
+			cancelEvent=None, convertQMarks=False):
+		"""
+		Run the current SQL over 'connection', a dConnection other than the one
+		this cursor uses, and fetch all of the resulting records without
+		changing the contents of this cursor. This is meant to be called on a
+		worker thread; pass the return value to storeRequery() to load the
+		records into the cursor.
+
+		The rows are fetched in batches of 'batchSize' rows (default:
+		FetchBatchSize), and 'progress', if passed, is called with the number
+		of rows fetched so far after each batch. If the threading.Event
+		'cancelEvent' is set, fetching stops, and DBQueryCancelledException is
+		raised. To abort the running statement as well, call cancelQuery() on
+		the backend object of 'connection'.
+		"""
+		sql = self.CurrentSQL
+		crs = self._getStreamCursor(connection)
+		cancelled = _("The requery was cancelled")
+		records = []
+		try:
+			try:
+				if cancelEvent is not None and cancelEvent.isSet():
+					raise dException.DBQueryCancelledException(cancelled, sql)
+				crs.execute(sql, params, convertQMarks=convertQMarks, _fetch=False)
+				for batch in crs._streamBatches(batchSize or self.FetchBatchSize):
+					if cancelEvent is not None and cancelEvent.isSet():
+						raise dException.DBQueryCancelledException(cancelled, sql)
+					records.extend(batch)
+					if progress is not None:
+						progress(len(records))
+			except dException.DBQueryCancelledException:
+				raise
+			except Exception, e:
+				if cancelEvent is not None and cancelEvent.isSet():
+					# The backend aborted the statement.
+					raise dException.DBQueryCancelledException(cancelled, sql)
+				if isinstance(e, dException.dException):
+					raise
+				raise crs._getExecuteException(e, sql,
+						_("DBQueryException encountered in fetchRequery(): %s"))
+			return sql, params, crs.descriptionClean, records
+		finally:
+			crs.close()
+
+
+	def storeRequery(self, data):
+		"""
+		Load the records fetched by fetchRequery(), replacing the contents of
+		the cursor the same way that requery() does.
+		"""
+		sql, params, description, records = data
+		newQuery = (self._lastSQL != sql)
+		self._lastSQL = sql
+		self.lastParams = params
+		self._savedStructureDescription = []
+		# The description of the query that fetched the records takes the
+		# place of the one the backend would have set for this cursor.
+		self.descriptionClean = description
+		if self._newStructure(sql):
+			self._storeFieldTypes()
+		self._records = self._makeDataSet(records)
+		self.RowNumber = self.RowNumber
+		self._resetAfterRequery(newQuery)
+
+
+	def _getStreamCursor(self, connection=None):
+		"""
+		Return a new cursor with the same settings as this one for streaming
+		queries. It uses this cursor's connection, unless another dConnection is
+		passed.
+		"""
+		if connection is not None:
+			backend = connection.getBackendObject()
+			cursorClass = self.__class__
+		else:
+			backend = self.BackendObject
+			cursorClass = self._cursorFactoryClass or self.__class__
+		crs = backend.getStreamCursor(cursorClass)
+		crs.BackendObject = backend
+		crs._autoQuoteNames = self._autoQuoteNames
+		crs._dataStructure = self._dataStructure
+		crs._isPrefCursor = self._isPrefCursor
+		crs._keyField = self._keyField
+		crs._table = self._table
+		return crs
+
+
+	def _streamRecords(self, batchSize):
+		"""
+		Generator that fetches the rows of the last query, and yields them as
+		dicts. The cursor is closed when the generator finishes or is closed.
+		"""
+		try:
+			for batch in self._streamBatches(batchSize):
+				for rec in batch:
+					yield rec
+		finally:
+			self.close()
+
+
+	def _streamBatches(self, batchSize):
+		"""
+		Generator that fetches the rows of the last query 'batchSize' at a time,
+		and yields each batch as a list of dicts.
+		"""
+		fldNames = None
+		_correctFieldType = self._correctFieldType
+		while True:
+			rows = self.fetchmany(batchSize)
+			if not rows:
+				break
+			if fldNames is None:
+				# Server-side cursors may only describe the rows once some
+				# have been fetched.
+				if not self.FieldDescription:
+					self.BackendObject.massageDescription(self)
+				fldNames = [f[0] for f in self.FieldDescription]
+			batch = []
+			for row in rows:
+				if isinstance(row, (tuple, list)):
+					rec = dict(zip(fldNames, row))
+				else:
+					rec = row
+				for fld, val in rec.items():
+					rec[fld] = _correctFieldType(val, fld)
+				batch.append(rec)
+			yield batch
+
+
 	def _newStructure(self, sql):
 		"""
 		Attempts to parse the SQL to determine if the fields being selected will require
@@ -487,7 +723,12 @@ class dCursorMixin(dObject):
 		self._savedStructureDescription = []
 
 		self.execute(currSQL, params, convertQMarks=convertQMarks)
+		self._resetAfterRequery(newQuery)
+		return True
 
+
+	def _resetAfterRequery(self, newQuery):
+		"""Reset the cursor's state for the records that were just requeried."""
 		# clear mementos and new record flags:
 		self._mementos = {}
 		self._newRecords = {}
@@ -499,15 +740,14 @@ class dCursorMixin(dObject):
 			# any updates.
 			self.__setNonUpdateFields()
 
-		# Clear the unsorted list, and then apply the current sort
-		self.__unsortedRows = []
+		# Remember the unsorted order, and then apply the current sort
+		self.__unsortedRows = self._records
 		if self.sortColumn:
 			try:
 				self.sort(self.sortColumn, self.sortOrder)
 			except dException.NoRecordsException:
 				# No big deal
 				pass
-		return True
 
 
 	def _storeFieldTypes(self, target=None):
@@ -519,10 +759,29 @@ class dCursorMixin(dObject):
 			pass
 		if target is None:
 			target = self
-		target._types = {}
-		for field in self.DataStructure:
-			field_alias, field_type = field[0], field[1]
-			target._types[field_alias] = dabo.db.getPythonType(field_type)
+		meta = self._makeFieldMetadata()
+		target._fieldMetadata = meta if meta.Structure else None
+		target._types = dict(meta.PythonTypes)
+
+
+	def _makeFieldMetadata(self):
+		"""Build the DataStructure lookup tables for the current settings."""
+		aq = self.AutoQuoteNames
+		return dFieldMetadata(self.DataStructure, self.Table, aq, self.BackendObject)
+
+
+	def _getFieldMetadata(self):
+		"""
+		Return the dFieldMetadata object for the current DataStructure, Table and
+		AutoQuoteNames settings, rebuilding it if any of them has changed.
+		"""
+		meta = self._fieldMetadata
+		if meta is None or not meta.matches(self.Table, self.AutoQuoteNames):
+			meta = self._makeFieldMetadata()
+			if meta.Structure:
+				# Don't hold on to the lookups until the structure is known.
+				self._fieldMetadata = meta
+		return meta
 
 
 	def sort(self, col, ordr=None, caseSensitive=True):
@@ -539,19 +798,29 @@ class dCursorMixin(dObject):
 			CYCLE
 
 		Only the first three characters are significant; case is ignored.
+
+		To sort on several columns at once, pass a sequence of column names (or a
+		comma-separated string) as 'col'. In that case 'ordr' can be either a single
+		direction that applies to all the columns, or a sequence with one direction
+		per column; cycling is not supported for multi-column sorts.
 		"""
+		if isinstance(col, (list, tuple)) or (isinstance(col, basestring) and "," in col):
+			self.__multiColumnSort(col, ordr, caseSensitive)
+			return
 		currCol = self.sortColumn
 		currOrd = self.sortOrder
+		if isinstance(currCol, tuple):
+			# After a multi-column sort, carry on from its first column.
+			currCol = currCol[0] if currCol else ""
+			currOrd = currOrd[0] if currOrd else ""
 		if not ordr:
 			ordr = "ASC"
 		if ordr[:3].upper() == "CYC":
-			ordr = {"ASC": "DESC", "DES": None, None: "ASC"}[currOrd]
+			ordr = {"ASC": "DESC", "DES": None}.get((currOrd or "")[:3].upper(), "ASC")
 			col = currCol
 
 		# Make sure that the specified column is a column in the result set
-		if not [True for t in self.DataStructure if t[0] == col]  and col not in self.VirtualFields:
-			raise dException.dException(
-					_("Invalid column specified for sort: ") + col)
+		self.__checkSortColumn(col)
 
 		newCol = col
 		if col == currCol:
@@ -584,33 +853,67 @@ class dCursorMixin(dObject):
 					raise dException.dException(
 							_("Invalid Sort direction specified: ") + ordr)
 
-		self.__sortRows(newCol, newOrd, caseSensitive)
+		if newOrd:
+			self.__sortRows((newCol,), (newOrd,), caseSensitive)
+		else:
+			self.__sortRows((), (), caseSensitive)
 		# Save the current sort values
 		self.sortColumn = newCol
 		self.sortOrder = newOrd
 		self.sortCase = caseSensitive
 
 
-	def __sortRows(self, col, ordr, caseSensitive):
+	def __multiColumnSort(self, cols, ordr, caseSensitive):
+		"""Handles sort() calls that specify more than one column."""
+		if isinstance(cols, basestring):
+			cols = [c.strip() for c in cols.split(",")]
+		cols = tuple(cols)
+		if not ordr:
+			ordr = "ASC"
+		if isinstance(ordr, basestring):
+			ordr = (ordr,) * len(cols)
+		if len(ordr) != len(cols):
+			raise dException.dException(
+					_("Sort directions don't match the columns specified for sort: %s")
+					% ", ".join(cols))
+		newOrd = []
+		for col, colOrd in zip(cols, ordr):
+			self.__checkSortColumn(col)
+			colOrd = (colOrd or "ASC").upper()
+			if colOrd not in ("ASC", "DESC"):
+				raise dException.dException(
+						_("Invalid Sort direction specified: ") + colOrd)
+			newOrd.append(colOrd)
+		newOrd = tuple(newOrd)
+		self.__sortRows(cols, newOrd, caseSensitive)
+		# Save the current sort values
+		self.sortColumn = cols
+		self.sortOrder = newOrd
+		self.sortCase = caseSensitive
+
+
+	def __checkSortColumn(self, col):
+		"""Raise an exception if the column is not a valid sort column."""
+		if col not in self._getFieldMetadata().FieldTypes and col not in self.VirtualFields:
+			raise dException.dException(
+					_("Invalid column specified for sort: %s") % (col,))
+
+
+	def __sortRows(self, cols, ordrs, caseSensitive):
 		"""
 		Sort the rows of the cursor.
 
-		At this point, we know we have a valid column and order. We need to
+		At this point, we know we have valid columns and orders. We need to
 		preserve the unsorted order if we haven't done that yet; then we sort
-		the data according to the request.
+		the data according to the request in a single stable pass. If no columns
+		are passed, the rows are restored to their unsorted order.
 		"""
 		kf = self.KeyField
 		if not kf or not self.RowCount:
 			return
 
-		if not self.__unsortedRows:
-			# Record the PK values
-			for row in self._records:
-				if self._compoundKey:
-					key = tuple([row[k] for k in kf])
-					self.__unsortedRows.append(key)
-				else:
-					self.__unsortedRows.append(row[kf])
+		if self.__unsortedRows is None:
+			self.__unsortedRows = self._records
 
 		# First, preserve the PK of the current row so that we can reset
 		# the RowNumber property to point to the same row in the new order.
@@ -624,33 +927,55 @@ class dCursorMixin(dObject):
 			# Row no longer exists, such as after a Requery that returns
 			# fewer rows.
 			currRowKey = None
-		# Create the list to hold the rows for sorting
-		sortList = []
-		if not ordr:
-			# Restore the rows to their unsorted order
-			for row in self._records:
-				if self._compoundKey:
-					key = tuple([row[k] for k in kf])
-					sortList.append([self.__unsortedRows.index(key), row])
-				else:
-					sortList.append([self.__unsortedRows.index(row[kf]), row])
-		else:
-			for row, rec in enumerate(self._records):
-				sortList.append([self.getFieldVal(col, row), rec])
-		# At this point we have a list consisting of lists. Each of these member
-		# lists contain the sort value in the zeroth element, and the row as
-		# the first element.
-		# First, see if we are comparing strings
-		compString = isinstance(sortList[0][0], basestring)
 
-		if compString and not caseSensitive:
-			sortKey = caseInsensitiveSortKey
+		if not cols:
+			# Restore the rows to their unsorted order. Rows added since that
+			# order was recorded go at the end, in their current order.
+			present = set(map(id, self._records))
+			newRows = [rec for rec in self.__unsortedRows if id(rec) in present]
+			if len(newRows) < len(present):
+				known = set(map(id, newRows))
+				newRows.extend([rec for rec in self._records if id(rec) not in known])
 		else:
-			sortKey = noneSortKey
-		sortList.sort(key=sortKey, reverse=(ordr == "DESC"))
+			# Create the list to hold the rows for sorting. Each member is a
+			# list of the sort key for each column, followed by the row.
+			sortList = [[[], rec] for rec in self._records]
+			vFields = self.VirtualFields
+			for col in cols:
+				if col in vFields:
+					vals = [self.getFieldVal(col, row) for row in xrange(len(sortList))]
+				else:
+					_correctFieldTypesIfNeeded = self._correctFieldTypesIfNeeded
+					vals = []
+					for keys, rec in sortList:
+						_correctFieldTypesIfNeeded(rec)
+						vals.append(rec[col])
+				# See if we are comparing strings
+				compString = isinstance(vals[0], basestring)
+				if compString and not caseSensitive:
+					sortKey = caseInsensitiveSortKey
+				else:
+					sortKey = noneSortKey
+				for elem, val in zip(sortList, vals):
+					elem[0].append(sortKey((val,)))
 
-		# Extract the rows into a new list, then convert them back to the _records tuple
-		newRows = [elem[1] for elem in sortList]
+			if len(set(ordrs)) == 1:
+				sortList.sort(key=lambda elem: elem[0], reverse=(ordrs[0] == "DESC"))
+			else:
+				descending = [(ordr == "DESC") for ordr in ordrs]
+				def compareKeys(first, second):
+					for pos, desc in enumerate(descending):
+						ret = cmp(first[0][pos], second[0][pos])
+						if ret:
+							if desc:
+								return -ret
+							return ret
+					return 0
+				sortList.sort(cmp=compareKeys)
+
+			# Extract the rows into a new list
+			newRows = [elem[1] for elem in sortList]
+		# Convert them back to the _records tuple
 		self._records = dDataSet(newRows)
 
 		# restore the RowNumber
@@ -741,8 +1066,7 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		dataStructure = getattr(self, "_dataStructure", None)
 		if dataStructure is not None:
 			# Use the explicitly-set DataStructure to find the NonUpdateFields.
-			self.__nonUpdateFields = [f[0] for f in self.DataStructure
-					if (f[3] != self.Table) or not f[4]]
+			self.__nonUpdateFields = list(self._getFieldMetadata().NonUpdateFields)
 		else:
 			# Create the _dataStructure attribute
 			self._getDataStructure()
@@ -821,12 +1145,16 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		# are assigned to the same child, we need to use sqlManager
 		# for temporary key creation.
 		tmpPK = self.sqlManager._genTempPKVal(pkVal)
+		oldKey = self._pkFromRecord(rec)
 		if isinstance(kf, tuple):
 			for key in kf:
 				rec[key] = tmpPK
 		else:
 			rec[kf] = tmpPK
 		rec[kons.CURSOR_TMPKEY_FIELD] = tmpPK
+		self._updatePKIndex(self.RowNumber, oldKey, self._pkFromRecord(rec))
+		self._clearSeekIndexes(kf)
+		self._markRecordChanged(self.RowNumber)
 		return tmpPK
 
 
@@ -1074,6 +1402,7 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 						# Should't ever happen, but just in case of desynchronization.
 						if kons.CURSOR_TMPKEY_FIELD in rec:
 							rec[kons.CURSOR_TMPKEY_FIELD] = keyFieldValue
+					self._updatePKIndex(row, old_key, keyFieldValue)
 				elif self._compoundKey:
 					keyFieldValue = tuple([rec[k] for k in keyField])
 				else:
@@ -1102,9 +1431,18 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 
 			# Finally, save the new value to the field and signify that the field was changed:
 			rec[fld] = val
+			self._clearSeekIndexes(fld)
+			self._markRecordChanged(row)
 			return True
 
 
+	def _markRecordChanged(self, row):
+		"""Tell the data set that the values of a record were changed in place."""
+		markChanged = getattr(self._records, "markChanged", None)
+		if markChanged is not None:
+			markChanged(row)
+
+
 	def lookupPKWithAdd(self, field, val, tbl=None, pkCol=None):
 		"""Runs a lookup in the specified field for the desired value. If
 		found, returns the PK for that record. If not found, a record is
@@ -1284,11 +1622,8 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		"""
 		ret = {}
 		if pk is not None:
-			recs = [r for r in self._records
-					if r[self._keyField] == pk]
-			try:
-				rec = recs[0]
-			except IndexError:
+			row, rec = self._getRecordByPk(pk, raiseRowNotFound=False)
+			if rec is None:
 				return ret
 		else:
 			if row is None:
@@ -1316,11 +1651,8 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		"""
 		ret = {}
 		if pk is not None:
-			recs = [r for r in self._records
-					if r[self._keyField] == pk]
-			try:
-				rec = recs[0]
-			except IndexError:
+			row, rec = self._getRecordByPk(pk, raiseRowNotFound=False)
+			if rec is None:
 				return ret
 		else:
 			if row is None:
@@ -1328,9 +1660,9 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 			rec = self._records[row]
 			pk = self.pkExpression(rec)
 
+		tableFields = self._getFieldMetadata().TableFields
 		for k, v in rec.items():
-			if k not in cursor_flags and \
-					self.Table in [f[3] for f in self.DataStructure if f[0]==k]:
+			if k in tableFields:
 				ret[k] = (None, v)
 		return ret
 
@@ -1401,6 +1733,15 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		return dDataSet(ds)
 
 
+	def iterFieldVals(self, fld):
+		"""
+		Return an iterator over the value of the field in each row. Unlike
+		getDataSet(), the records aren't copied, and the values are returned
+		as they are stored; virtual fields aren't available.
+		"""
+		return (rec.get(fld) for rec in self._records)
+
+
 	def appendDataSet(self, ds, updateInternals=False):
 		"""
 		Appends the rows in the passed dataset to this cursor's dataset. No checking
@@ -1464,8 +1805,8 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		# Store the values
 		self._records = data
 		self._types = typs
-		# Clear the unsorted list, and then apply the current sort
-		self.__unsortedRows = []
+		# Remember the unsorted order, and then apply the current sort
+		self.__unsortedRows = self._records
 		if self.sortColumn:
 			try:
 				self.sort(self.sortColumn, self.sortOrder)
@@ -1480,7 +1821,10 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 
 
 	def filterByExpression(self, expr):
-		"""Allows you to filter by any valid Python expression."""
+		"""
+		Filter the records by a Python expression, or a sequence of them. See
+		dDataSet.filterByExpression() for what expressions can contain.
+		"""
 		self._records = self._records.filterByExpression(expr)
 
 
@@ -1516,6 +1860,9 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		self._records.Cursor = self
 		self._records.Bizobj = self._bizobj
 		self._records.replace(field, valOrExpr, scope=scope)
+		# The replacement may have changed key values in place.
+		self._invalidatePKIndex()
+		self._clearSeekIndexes(field)
 
 
 	def first(self):
@@ -1607,8 +1954,78 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 			rows = []
 			if self.isChanged(allRows=False, includeNewUnchanged=includeNewUnchanged):
 				rows = [self.RowNumber]
-		for row in rows:
-			saverow(row)
+		batchStarted = (len(rows) > 1) and (self.__saveBatch is None)
+		if batchStarted:
+			self.beginBatchSave()
+		try:
+			for row in rows:
+				saverow(row)
+		except StandardError:
+			if batchStarted:
+				self.endBatchSave(cancel=True)
+			raise
+		if batchStarted:
+			self.endBatchSave()
+
+
+	def beginBatchSave(self):
+		"""
+		Start collecting the statements for saved rows, instead of running
+		them one at a time.
+
+		Until endBatchSave() is called, consecutive rows that produce the same
+		INSERT or UPDATE statement are sent to the backend together with
+		executeMany(). Inserts that need the backend-generated PK right away
+		are still run individually, in order. Rows are only cleared of their
+		changes once their statement has been run. If the backend reports fewer
+		updated rows than a batch of UPDATEs has, noResultsOnSave() is called,
+		and none of the rows of the batch are cleared.
+		"""
+		if self.__saveBatch is None:
+			self.__saveBatch = []
+
+
+	def endBatchSave(self, cancel=False):
+		"""
+		Run any statements collected since beginBatchSave(), and go back to
+		saving rows one at a time. If 'cancel' is True, the collected
+		statements are discarded, and their rows keep their changes.
+		"""
+		try:
+			if not cancel:
+				self.flushBatchSave()
+		finally:
+			self.__saveBatch = None
+
+
+	def flushBatchSave(self):
+		"""
+		Run the save statements collected since beginBatchSave(), sending
+		consecutive identical statements to the backend together.
+		"""
+		batch = self.__saveBatch
+		if not batch:
+			return
+		self.__saveBatch = []
+		aux = self.AuxCursor
+		start = 0
+		while start < len(batch):
+			sql = batch[start][0]
+			end = start + 1
+			while end < len(batch) and batch[end][0] == sql:
+				end += 1
+			if end - start == 1:
+				res = aux.execute(sql, batch[start][1])
+			else:
+				res = aux.executeMany(sql, [params for stmt, params, info in batch[start:end]])
+				newrec = batch[start][2][3]
+				if not newrec and isinstance(res, (int, long)) and res < end - start:
+					# The count is for the whole batch, so the rows that weren't
+					# updated can't be told apart: none of them are cleared.
+					self.BackendObject.noResultsOnSave()
+			for stmt, params, info in batch[start:end]:
+				self.__afterSaveRow(res, *info)
+			start = end
 
 
 	def __saverow(self, row):
@@ -1631,107 +2048,133 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 			diff = self._getNewRecordDiff(row)
 		else:
 			diff = self.getRecordStatus(row)
+		if not diff:
+			return
+		batching = self.__saveBatch is not None
 		aq = self.AutoQuoteNames
-		if diff:
-			if newrec:
-				flds = ""
-				vals = []
-				kf = self.KeyField
-				for kk, vv in diff.items():
-					if self.AutoPopulatePK:
-						if self._compoundKey:
-							skipIt = (kk in kf)
-						else:
-							# Skip the key field, unless we pre-generated its value above.
-							skipIt = (kk == self.KeyField) and not newPKVal
-						if skipIt:
-							# we don't want to include the PK in the insert
-							continue
-					if kk in self.getNonUpdateFields():
-						# Skip it.
-						continue
-					if self._nullDefaults and vv == (None, None):
-						# Skip these, too
+		meta = self._getFieldMetadata()
+		if newrec:
+			flds = ""
+			vals = []
+			kf = self.KeyField
+			fieldTypes = meta.FieldTypes
+			quotedNames = meta.QuotedNames
+			nonup = set(self.getNonUpdateFields())
+			for kk, vv in diff.items():
+				if self.AutoPopulatePK:
+					if self._compoundKey:
+						skipIt = (kk in kf)
+					else:
+						# Skip the key field, unless we pre-generated its value above.
+						skipIt = (kk == self.KeyField) and not newPKVal
+					if skipIt:
+						# we don't want to include the PK in the insert
 						continue
-					# Append the field and its value.
-					flds += ", " + self.BackendObject.encloseNames(kk, aq)
-					# add value to expression
-					fieldType = [ds[1] for ds in self.DataStructure if ds[0] == kk][0]
-					val = vv[1]
-					if fieldType == "L" or (isinstance(val, basestring) and "\0" in val):
-						val = self.formatBLOB(val)
-					#elif fieldType in ("D", "T"):
-					#	val = self.formatDateTime(val)
-					vals.append(val)
-
-				# Trim leading comma-space from the 'flds' string
-				flds = flds[2:]
-				if not flds:
-					# Some backends (sqlite) require non-empty field clauses. We already
-					# know that we are expecting the backend to generate the PK, so send
-					# NULL as the PK Value:
-					flds = self.KeyField
-					vals = "NULL"
-				nms = self.BackendObject.encloseNames(self.Table, aq)
-				placeHolders = len(vals) * [self.ParamPlaceholder]
-				sql = "insert into %s (%s) values (%s) " % (nms, flds, ",".join(placeHolders))
-				params = tuple(vals)
+				if kk in nonup:
+					# Skip it.
+					continue
+				if self._nullDefaults and vv == (None, None):
+					# Skip these, too
+					continue
+				# Append the field and its value.
+				flds += ", " + quotedNames[kk]
+				# add value to expression
+				fieldType = fieldTypes[kk]
+				val = vv[1]
+				if fieldType == "L" or (isinstance(val, basestring) and "\0" in val):
+					val = self.formatBLOB(val)
+				#elif fieldType in ("D", "T"):
+				#	val = self.formatDateTime(val)
+				vals.append(val)
+
+			# Trim leading comma-space from the 'flds' string
+			flds = flds[2:]
+			if not flds:
+				# Some backends (sqlite) require non-empty field clauses. We already
+				# know that we are expecting the backend to generate the PK, so send
+				# NULL as the PK Value:
+				flds = self.KeyField
+				vals = "NULL"
+			nms = self.BackendObject.encloseNames(self.Table, aq)
+			placeHolders = len(vals) * [self.ParamPlaceholder]
+			sql = "insert into %s (%s) values (%s) " % (nms, flds, ",".join(placeHolders))
+			params = tuple(vals)
+		else:
+			updClause, params = self.makeUpdClause(diff)
+			if batching:
+				# Pass the PK values as parameters, so that rows changing the
+				# same fields share the same statement.
+				pkWhere, pkParams = self._makePkWhereParams(row)
+				params += pkParams
 			else:
 				pkWhere = self.makePkWhere(row)
-				updClause, params = self.makeUpdClause(diff)
-				sql = "update %s set %s where %s" % (self.BackendObject.encloseNames(self.Table, aq),
-						updClause, pkWhere)
-			#run the update
-			aux = self.AuxCursor
-			res = aux.execute(sql, params)
-
-			if newrec and self.AutoPopulatePK and (newPKVal is None):
-				# Call the database backend-specific code to retrieve the
-				# most recently generated PK value.
-				newPKVal = aux.getLastInsertID()
-				if newPKVal and not self._compoundKey:
-					self.setFieldVal(self.KeyField, newPKVal, row)
-
-			if newrec and self._nullDefaults:
-				# We need to retrieve any new default values
-				aux = self.AuxCursor
-				if not isinstance(self.KeyField, tuple):
-					keyFields = [self.KeyField]
-				else:
-					keyFields = self.KeyField
-				wheres = []
-				for kf in keyFields:
-					fld = self.BackendObject.encloseNames(kf, self.AutoQuoteNames)
-					val = self.getFieldVal(kf)
-					if isinstance(val, basestring):
-						val = "'" + val.encode(self.Encoding) + "' "
-					elif isinstance(val, (datetime.date, datetime.datetime)):
-						val = self.formatDateTime(val)
-					else:
-						val = ustr(val)
-					wheres.append("%s = %s" % (fld, val))
-				where = " and ".join(wheres)
-				aux.execute("select * from %s where %s" % (self.Table, where))
-				try:
-					data = aux.getDataSet()[0]
-					for fld, val in data.items():
-						try:
-							self.setFieldVal(fld, val)
-						except dException.FieldNotFoundException:
-							# Field is not in the dataset
-							pass
-				except IndexError:
-					# For some reason we could not retrieve the matching PK record
-					pass
+			sql = "update %s set %s where %s" % (self.BackendObject.encloseNames(self.Table, aq),
+					updClause, pkWhere)
 
-			self._clearMemento(row)
-			if newrec:
-				self._clearNewRecord(row=row, pkVal=recKey)
+		saveInfo = (rec, row, recKey, newrec, newPKVal)
+		needsInsertID = newrec and self.AutoPopulatePK and (newPKVal is None)
+		if batching and not needsInsertID:
+			self.__saveBatch.append((sql, params, saveInfo))
+			return
+		# Statements collected earlier must be run first to keep the rows in order.
+		self.flushBatchSave()
+		#run the update
+		res = self.AuxCursor.execute(sql, params)
+		self.__afterSaveRow(res, *saveInfo)
+
+
+	def __afterSaveRow(self, res, rec, row, recKey, newrec, newPKVal):
+		"""Update the saved row once its INSERT or UPDATE statement has been run."""
+		if self._records[row] is not rec:
+			# The rows have moved since the statement was created.
+			row = self._getRowByPk(self.pkExpression(rec))
+		aux = self.AuxCursor
+		if newrec and self.AutoPopulatePK and (newPKVal is None):
+			# Call the database backend-specific code to retrieve the
+			# most recently generated PK value.
+			newPKVal = aux.getLastInsertID()
+			if newPKVal and not self._compoundKey:
+				self.setFieldVal(self.KeyField, newPKVal, row)
+
+		if newrec and self._nullDefaults:
+			# We need to retrieve any new default values
+			if not isinstance(self.KeyField, tuple):
+				keyFields = [self.KeyField]
 			else:
-				if not res:
-					# Different backends may cause res to be None
-					# even if the save is successful.
-					self.BackendObject.noResultsOnSave()
+				keyFields = self.KeyField
+			wheres = []
+			for kf in keyFields:
+				fld = self.BackendObject.encloseNames(kf, self.AutoQuoteNames)
+				val = self.getFieldVal(kf, row)
+				if isinstance(val, basestring):
+					val = "'" + val.encode(self.Encoding) + "' "
+				elif isinstance(val, (datetime.date, datetime.datetime)):
+					val = self.formatDateTime(val)
+				else:
+					val = ustr(val)
+				wheres.append("%s = %s" % (fld, val))
+			where = " and ".join(wheres)
+			aux.execute("select * from %s where %s" % (self.Table, where))
+			try:
+				data = aux.getDataSet()[0]
+				for fld, val in data.items():
+					try:
+						self.setFieldVal(fld, val, row)
+					except dException.FieldNotFoundException:
+						# Field is not in the dataset
+						pass
+			except IndexError:
+				# For some reason we could not retrieve the matching PK record
+				pass
+
+		self._clearMemento(row)
+		if newrec:
+			self._clearNewRecord(row=row, pkVal=recKey)
+		else:
+			if not res:
+				# Different backends may cause res to be None
+				# even if the save is successful.
+				self.BackendObject.noResultsOnSave()
 
 
 	def _clearMemento(self, row=None):
@@ -1824,9 +2267,14 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 	def new(self):
 		"""Add a new record to the data set."""
 		blank = self._getBlankRecord()
+		pkIndexCurrent = self._pkIndexIsCurrent()
 		self._records = dDataSet(self._records + (blank,))
 		# Adjust the RowCount and position
 		self.RowNumber = self.RowCount - 1
+		if pkIndexCurrent:
+			self._pkIndexRecords = self._records
+			self._updatePKIndex(self.RowNumber, None, self._pkFromRecord(blank),
+					_isNewRow=True)
 
 
 	def cancel(self, allRows=False, ignoreNoRecords=None):
@@ -1869,7 +2317,11 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 				row, rec = self._getRecordByPk(rec_pk)
 				for fld, val in mem.items():
 					self._records[row][fld] = val
+				self._markRecordChanged(row)
 			self._mementos = {}
+			# Restoring the mementos may have reverted key values.
+			self._invalidatePKIndex()
+			self._clearSeekIndexes()
 
 		else:
 			row = self.RowNumber
@@ -1887,9 +2339,14 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 				return
 
 			# Not a new record: need to manually replace the old values:
-			for fld, val in self._mementos.get(recKey, {}).items():
+			mem = self._mementos.get(recKey, {})
+			for fld, val in mem.items():
 				self._records[row][fld] = val
 			self._clearMemento(row)
+			if mem:
+				self._updatePKIndex(row, recKey, self._pkFromRecord(rec))
+				self._clearSeekIndexes(mem.keys())
+				self._markRecordChanged(row)
 
 
 	def delete(self, delRowNum=None):
@@ -1931,10 +2388,20 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 	def _removeRow(self, row):
 		## Since record sets are tuples and thus immutable, we need to do this
 		## little dance to remove a row.
+		pkIndexCurrent = self._pkIndexIsCurrent()
 		lRec = list(self._records)
 		del lRec[row]
 		self._records = dDataSet(lRec)
 		self.RowNumber = min(self.RowNumber, self.RowCount - 1)
+		if pkIndexCurrent and not self._pkIndexHasDups:
+			# Drop the deleted row, and shift the rows that followed it.
+			pkIndex = self._pkIndex
+			for key, idx in pkIndex.items():
+				if idx > row:
+					pkIndex[key] = idx - 1
+				elif idx == row:
+					del pkIndex[key]
+			self._pkIndexRecords = self._records
 
 
 	def flush(self):
@@ -2045,14 +2512,106 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		return map(self._getRowByPk, chKeys)
 
 
+	def _pkIndexIsCurrent(self):
+		"""Return True if the PK index was built for the current records and KeyField."""
+		return (self._pkIndex is not None
+				and self._pkIndexRecords is self._records
+				and self._pkIndexKeyField == self.KeyField)
+
+
+	def _invalidatePKIndex(self):
+		"""Discard the PK index; it will be rebuilt on the next PK lookup."""
+		self._pkIndex = self._pkIndexRecords = self._pkIndexKeyField = None
+		self._pkIndexHasDups = False
+
+
+	def _pkFromRecord(self, rec):
+		"""Return the key value stored in the passed record, without type correction."""
+		kf = self.KeyField
+		if isinstance(kf, tuple):
+			return tuple([rec.get(k) for k in kf])
+		return rec.get(kf)
+
+
+	def _getPKIndex(self):
+		"""
+		Return the dict mapping PK values to row numbers, building it if the
+		record set or the KeyField changed since it was last built. When several
+		rows share a PK value, the first of them is indexed.
+		"""
+		if self._pkIndexIsCurrent():
+			return self._pkIndex
+		records = self._records
+		kf = self.KeyField
+		compoundKey = isinstance(kf, tuple)
+		pkIndex = {}
+		hasDups = False
+		_correctFieldType = self._correctFieldType
+		for row, rec in enumerate(records):
+			if rec.get(kons.CURSOR_FIELD_TYPES_CORRECTED, False):
+				if compoundKey:
+					key = tuple([rec[k] for k in kf])
+				else:
+					key = rec[kf]
+			elif compoundKey:
+				key = tuple([_correctFieldType(rec[k], k) for k in kf])
+			else:
+				key = _correctFieldType(rec[kf], kf)
+			if key in pkIndex:
+				hasDups = True
+			else:
+				pkIndex[key] = row
+		self._pkIndex = pkIndex
+		self._pkIndexRecords = records
+		self._pkIndexKeyField = kf
+		self._pkIndexHasDups = hasDups
+		return pkIndex
+
+
+	def _updatePKIndex(self, row, oldKey, newKey, _isNewRow=False):
+		"""Keep the PK index in sync after the key of the passed row changed."""
+		if not self._pkIndexIsCurrent() or (oldKey == newKey and not _isNewRow):
+			return
+		pkIndex = self._pkIndex
+		if not _isNewRow and pkIndex.get(oldKey) == row:
+			if self._pkIndexHasDups:
+				# Another row may hold the old key; let it be rebuilt.
+				self._invalidatePKIndex()
+				return
+			del pkIndex[oldKey]
+		try:
+			currRow = pkIndex.get(newKey)
+		except TypeError:
+			# Unhashable key value
+			self._invalidatePKIndex()
+			return
+		if currRow is None:
+			pkIndex[newKey] = row
+		else:
+			self._pkIndexHasDups = True
+			if row < currRow:
+				pkIndex[newKey] = row
+
+
 	def _getRecordByPk(self, pk, raiseRowNotFound=True):
 		"""Find the record with the passed primary key; return (row, record)."""
 		kf = self.KeyField
-		if kf:
-			for idx, rec in enumerate(self._records):
-				key = self.getFieldVal(kf, row=idx)
-				if key == pk:
-					return (idx, rec)
+		if kf and self._records:
+			if isinstance(pk, list):
+				pk = tuple(pk)
+			for attempt in (1, 2):
+				try:
+					row = self._getPKIndex().get(pk)
+				except (KeyError, TypeError):
+					# The key field isn't in the records, or the value can't be a key.
+					break
+				if row is None:
+					break
+				rec = self._records[row]
+				if self.pkExpression(rec) == pk:
+					return (row, rec)
+				# The key was changed behind the index's back; rebuild it once.
+				self._invalidatePKIndex()
 		if raiseRowNotFound:
 			tbl, rc = self.Table, self.RowCount
 			raise dException.RowNotFoundException(_("PK '%(pk)s' not found in table '%(tbl)s' (RowCount: %(rc)s)") % locals())
@@ -2067,8 +2626,8 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 
 	def hasPK(self, pk):
 		"""Return True if the passed pk is present in the dataset."""
-		kf = self.KeyField
-		return bool([v[kf] for v in self._records if v[kf] == pk])
+		row, rec = self._getRecordByPk(pk, raiseRowNotFound=False)
+		return row is not None
 
 
 	def moveToPK(self, pk):
@@ -2134,7 +2693,8 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		characters up until the length of val.
 
 		Multiple fields can be searched by sending tuples for the val and fld
-		arguments.
+		arguments. Single fields that were passed to addIndex() are searched
+		without sorting all of the rows.
 		"""
 		ret = -1
 		if fld is None:
@@ -2165,19 +2725,30 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		if badflds:
 			raise dException.FieldNotFoundException(_("Non-existent field(s) '%s'") % ", ".join(badflds))
 
-		# Copy the specified field vals and their row numbers to a list, and
-		# add those lists to the sort list
-		sortList = []
-		for row in xrange(0, self.RowCount):
+		kf = self.KeyField
+		if isinstance(kf, tuple):
+			keyFlds = list(kf)
+		else:
+			keyFlds = [kf]
+		if kf and not near and list(flds) == keyFlds:
+			# Exact matches on the key can be found with the PK index.
 			if simpleKey:
-				rowval = self.getFieldVal(fld, row=row)
+				vals = (val,)
 			else:
-				rowval = tuple([self.getFieldVal(f, row=row) for f in flds])
-			sortList.append([rowval, row])
+				vals = tuple(val)
+			if caseSensitive or not [v for v in vals if isinstance(v, basestring)]:
+				row, rec = self._getRecordByPk(vals if not simpleKey else val,
+						raiseRowNotFound=False)
+				if row is not None:
+					if movePointer:
+						self.RowNumber = row
+					return row
 
 		if simpleKey:
 			# Determine if we are seeking string values
-			field_type = self._types.get(fld, type(sortList[0][0]))
+			field_type = self._types.get(fld)
+			if field_type is None:
+				field_type = type(self.getFieldVal(fld, row=0))
 			compString = issubclass(field_type, basestring)
 		else:
 			compString = False
@@ -2202,6 +2773,24 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 				except ValueError:
 					val = float(0)
 
+		if simpleKey and sort and (fld in self._indexedFields) \
+				and (fld not in self.VirtualFields):
+			ret = self.__seekIndexed(val, fld, (compString and not caseSensitive),
+					near, incremental)
+			if movePointer and ret > -1:
+				self.RowNumber = ret
+			return ret
+
+		# Copy the specified field vals and their row numbers to a list, and
+		# add those lists to the sort list
+		sortList = []
+		for row in xrange(0, self.RowCount):
+			if simpleKey:
+				rowval = self.getFieldVal(fld, row=row)
+			else:
+				rowval = tuple([self.getFieldVal(f, row=row) for f in flds])
+			sortList.append([rowval, row])
+
 		if sort:
 			if compString and not caseSensitive:
 				sortList.sort(key=caseInsensitiveSortKey)
@@ -2243,7 +2832,7 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 								ret = sortList[idx][1]
 								break
 						elif not isinstance(matchVal, basestring) and testVal > matchVal:
-							ret = idx
+							ret = sortList[idx][1]
 							break
 				else:
 					# Find the first row greater than the match value
@@ -2260,6 +2849,101 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		return ret
 
 
+	def addIndex(self, fld):
+		"""
+		Keep a sorted index on the passed field.
+
+		seek() and locate() on an indexed field use a binary search on the
+		index instead of sorting every row on each call. The index is built on
+		first use, and rebuilt after the field's values or the records change.
+		"""
+		self._indexedFields.add(fld)
+
+
+	def removeIndex(self, fld):
+		"""Stop keeping a sorted index on the passed field."""
+		self._indexedFields.discard(fld)
+		self._clearSeekIndexes(fld)
+
+
+	def _clearSeekIndexes(self, flds=None):
+		"""Discard the seek() indexes for the passed field(s), or all of them."""
+		if not self._seekIndexes:
+			return
+		if flds is None:
+			self._seekIndexes = {}
+			return
+		if isinstance(flds, basestring):
+			flds = (flds,)
+		for fld in flds:
+			self._seekIndexes.pop((fld, False), None)
+			self._seekIndexes.pop((fld, True), None)
+
+
+	def _seekIndexKey(self, val, caseFold):
+		"""Return the sort key used for the passed value in a seek() index."""
+		if val is None:
+			# Sort nulls first, without comparing them to the other values.
+			return (0, None)
+		if caseFold:
+			try:
+				val = val.lower()
+			except AttributeError:
+				pass
+		return (1, val)
+
+
+	def _getSeekIndex(self, fld, caseFold):
+		"""
+		Return the (keys, rows) lists of the sorted index for the passed field,
+		building it if needed. Rows with equal values stay in row order, so the
+		first match found is the same one that sorting all the rows would give.
+		"""
+		if self._seekIndexRecords is not self._records:
+			self._seekIndexes = {}
+			self._seekIndexRecords = self._records
+		try:
+			return self._seekIndexes[(fld, caseFold)]
+		except KeyError:
+			pass
+		_correctFieldType = self._correctFieldType
+		_seekIndexKey = self._seekIndexKey
+		entries = []
+		for row, rec in enumerate(self._records):
+			val = rec[fld]
+			if not rec.get(kons.CURSOR_FIELD_TYPES_CORRECTED, False):
+				val = _correctFieldType(val, fld)
+			entries.append((_seekIndexKey(val, caseFold), row))
+		entries.sort()
+		index = ([key for key, row in entries], [row for key, row in entries])
+		self._seekIndexes[(fld, caseFold)] = index
+		return index
+
+
+	def __seekIndexed(self, val, fld, caseFold, near, incremental):
+		"""Use the sorted index on 'fld' to find the row that seek() should return."""
+		keys, rows = self._getSeekIndex(fld, caseFold)
+		matchKey = self._seekIndexKey(val, caseFold)
+		pos = bisect.bisect_left(keys, matchKey)
+		if pos < len(keys) and keys[pos] == matchKey:
+			return rows[pos]
+		if not near:
+			return -1
+		if incremental and isinstance(val, basestring):
+			# Values that start with the seek value sort together, right where
+			# the seek value itself would be inserted.
+			if pos < len(keys):
+				testVal = keys[pos][1]
+				if isinstance(testVal, basestring) and testVal.startswith(matchKey[1]):
+					return rows[pos]
+			return len(rows) - 1
+		# Return the first row greater than the seek value.
+		try:
+			return rows[pos]
+		except IndexError:
+			return len(rows) - 1
+
+
 	def checkPK(self):
 		"""Verify that the field(s) specified in the KeyField prop exist."""
 		# First, make sure that there is *something* in the field
@@ -2291,7 +2975,7 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		bo = self.BackendObject
 		tblPrefix = bo.getWhereTablePrefix(self.Table,
 					autoQuote=self.AutoQuoteNames)
-		if not row:
+		if row is None:
 			row = self.RowNumber
 		rec = self._records[row]
 
@@ -2323,6 +3007,28 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		return "".join(ret)
 
 
+	def _makePkWhereParams(self, row):
+		"""
+		Like makePkWhere(), but with parameter placeholders instead of the PK
+		values. Returns a 2-tuple of the clause and the parameter values.
+		"""
+		tblPrefix = self.BackendObject.getWhereTablePrefix(self.Table,
+					autoQuote=self.AutoQuoteNames)
+		rec = self._records[row]
+		if self._compoundKey:
+			keyFields = list(self.KeyField)
+		else:
+			keyFields = [self.KeyField]
+		mem = self._mementos.get(self.pkExpression(rec), {})
+		clauses = []
+		params = []
+		for fld in keyFields:
+			fldSafe = self.BackendObject.encloseNames(fld, self.AutoQuoteNames)
+			clauses.append("%s%s = %s " % (tblPrefix, fldSafe, self.ParamPlaceholder))
+			params.append(mem.get(fld, rec[fld]))
+		return (" AND ".join(clauses), tuple(params))
+
+
 	def makeUpdClause(self, diff):
 		"""
 		Create the 'set field=val' section of the Update statement. Return a 2-tuple
@@ -2331,23 +3037,23 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		"""
 		retSql = []
 		retParams = []
-		bo = self.BackendObject
-		aq = self.AutoQuoteNames
-		tblPrefix = bo.getUpdateTablePrefix(self.Table, autoQuote=aq)
-		nonup = self.getNonUpdateFields()
+		meta = self._getFieldMetadata()
+		tblPrefix = meta.TablePrefix
+		fieldTypes = meta.FieldTypes
+		quotedNames = meta.QuotedNames
+		nonup = set(self.getNonUpdateFields())
 		for fld, val in diff.items():
 			old_val, new_val = val
 			# Skip the fields that are not to be updated.
 			if fld in nonup:
 				continue
-			fieldType = [ds[1] for ds in self.DataStructure if ds[0] == fld][0]
+			fieldType = fieldTypes[fld]
 			val = new_val
 			if fieldType == "L" or (isinstance(val, basestring) and "\0" in val):
 				val = self.formatBLOB(val)
 			# elif fieldType in ("D", "T"):
 			#		val = self.formatDateTime(val)
-			nms = bo.encloseNames(fld, aq)
-			retSql.append("%s%s = %s" % (tblPrefix, nms, self.ParamPlaceholder))
+			retSql.append("%s%s = %s" % (tblPrefix, quotedNames[fld], self.ParamPlaceholder))
 			retParams.append(val)
 		return (", ".join(retSql), tuple(retParams))
 
@@ -2392,7 +3098,9 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		try:
 			return self._fieldStructure[key]
 		except KeyError:
-			flds = self.BackendObject.getFields(tableName, self.AuxCursor)
+			backend = self.BackendObject
+			flds = backend.getSchemaInfo("fields", tableName, backend.getFields,
+					tableName, self.AuxCursor)
 			self._fieldStructure[key] = flds
 			return flds
 
@@ -2607,7 +3315,27 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 
 	def setChildFilter(self, fld):
 		"""This method sets the appropriate WHERE filter for dependent child queries."""
+		alias = self._getChildFilterAlias()
+		if not isinstance(fld, (list, tuple)):
+			fld = (fld,)
+		filtExpr = "and".join([" %s.%s = %s " % (alias, fldExpr, self.ParamPlaceholder)
+				for fldExpr in fld])
+		self.setChildFilterClause(filtExpr)
+
 
+	def setChildInFilter(self, fld, numValues):
+		"""
+		Set a child filter that matches any of 'numValues' parameter values
+		for the passed link field. This is used to fetch the child records
+		for several parent records with a single query.
+		"""
+		alias = self._getChildFilterAlias()
+		placeholders = ", ".join([self.ParamPlaceholder] * numValues)
+		self.setChildFilterClause(" %s.%s in (%s) " % (alias, fld, placeholders))
+
+
+	def _getChildFilterAlias(self):
+		"""Return the table alias to use in child filter expressions."""
 		def getTableAlias(fromClause):
 			if not fromClause.strip():
 				return None
@@ -2627,11 +3355,7 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		if not alias:
 			# Use the old way (pre 2180) of using the Table (DataSource) property.
 			alias = self.Table
-		if not isinstance(fld, (list, tuple)):
-			fld = (fld,)
-		filtExpr = "and".join([" %s.%s = %s " % (alias, fldExpr, self.ParamPlaceholder)
-				for fldExpr in fld])
-		self.setChildFilterClause(filtExpr)
+		return alias
 
 
 	def setNonMatchChildFilterClause(self):
@@ -2884,6 +3608,13 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 			self.__auxCursor.__backend = obj
 
 
+	def _getCompactRecords(self):
+		return self._compactRecords
+
+	def _setCompactRecords(self, val):
+		self._compactRecords = bool(val)
+
+
 	def _getCurrentSQL(self):
 		if self.UserSQL:
 			return self.UserSQL
@@ -2947,6 +3678,7 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 			val[idx] = (field_alias, field_type, field_pk, table_name, field_name, field_scale)
 			self._types[field_name] = dabo.db.getPythonType(field_type)
 		self._dataStructure = self.AuxCursor._dataStructure = tuple(val)
+		self._fieldMetadata = self.AuxCursor._fieldMetadata = None
 
 
 	def _getEncoding(self):
@@ -2956,6 +3688,13 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 		self.BackendObject.Encoding = val
 
 
+	def _getFetchBatchSize(self):
+		return self._fetchBatchSize
+
+	def _setFetchBatchSize(self, val):
+		self._fetchBatchSize = val
+
+
 	def _getIsAdding(self):
 		"""Return True if the current record is a new record."""
 		if self.RowCount <= 0:
@@ -3084,6 +3823,12 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 	BackendObject = property(_getBackendObject, _setBackendObject, None,
 			_("Returns a reference to the object defining backend-specific behavior (dBackend)"))
 
+	CompactRecords = property(_getCompactRecords, _setCompactRecords, None,
+			_("""When True, fetched rows are stored in compact dict-like records that
+			share a single field layout, instead of in a dict per row. This uses
+			much less memory for large data sets, at the cost of slightly slower
+			field access. Takes effect on the next requery. Default=False  (bool)"""))
+
 	CurrentSQL = property(_getCurrentSQL, None, None,
 			_("Returns the current SQL that will be run, which is one of UserSQL or AutoSQL."))
 
@@ -3108,6 +3853,10 @@ xsi:noNamespaceSchemaLocation = "http://dabodev.com/schema/dabocursor.xsd">
 	Encoding = property(_getEncoding, _setEncoding, None,
 			_("Encoding type used by the Backend  (string)"))
 
+	FetchBatchSize = property(_getFetchBatchSize, _setFetchBatchSize, None,
+			_("""Number of rows fetched from the backend at a time by executeStream()
+			and requeryStream(). Default=1000  (int)"""))
+
 	FieldDescription = property(_getDescrip, None, None,
 			_("Tuple of field names and types, as returned by the backend  (tuple)"))
 
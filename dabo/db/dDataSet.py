@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 import sys
-import re
+import ast
 import operator
 import datetime
-import hashlib
+import itertools
 
 from decimal import Decimal
 try:
@@ -25,9 +25,136 @@ pysqlite2: http://initd.org/tracker/pysqlite
 
 import dabo
 from dabo.dLocalize import _
+import dabo.dException as dException
 from dabo.lib.utils import ustr
 
 
+# Operators accepted by dDataSet.filter()
+_filterOps = {"eq": operator.eq,
+		"=": operator.eq,
+		"equals": operator.eq,
+		"ne": operator.ne,
+		"!=": operator.ne,
+		"nequals": operator.ne,
+		"gt": operator.gt,
+		">": operator.gt,
+		"gte": operator.ge,
+		">=": operator.ge,
+		"lt": operator.lt,
+		"<": operator.lt,
+		"lte": operator.le,
+		"<=": operator.le}
+
+# The only syntax allowed in filter and replace expressions. Anything else,
+# such as lambdas, comprehensions or backquotes, is rejected.
+_exprNodes = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.IfExp,
+		ast.Compare, ast.Call, ast.keyword, ast.Attribute, ast.Subscript, ast.Index,
+		ast.Slice, ast.Name, ast.Num, ast.Str, ast.Tuple, ast.List,
+		ast.expr_context, ast.boolop, ast.operator, ast.unaryop, ast.cmpop)
+# Names other than the field names that expressions can use
+_exprGlobals = {"None": None, "True": True, "False": False, "abs": abs,
+		"bool": bool, "cmp": cmp, "float": float, "int": int, "len": len,
+		"long": long, "max": max, "min": min, "round": round, "str": str,
+		"unicode": unicode, "ustr": ustr, "Decimal": Decimal, "datetime": datetime}
+# Attributes that would give access to code, frames or globals.
+_blockedAttrPrefixes = ("_", "func_", "im_", "gi_", "f_", "tb_", "co_")
+# Name of the record variable in the compiled code. Field names can't start
+# with an underscore in expressions, so this can't collide with them.
+_recName = "_dabo_rec"
+_recsName = "_dabo_recs"
+# Compiled expressions, keyed on their kind, text and the record's field names.
+_compiledExpressions = {}
+_maxCompiledExpressions = 500
+# Gives each data set a unique identity for the SQLite tables mirroring it.
+_mirrorTokens = itertools.count(1)
+
+
+
+class _ExpressionTransformer(ast.NodeTransformer):
+	"""
+	Checks that an expression only uses the allowed syntax, and replaces the
+	references to field names with lookups in the record.
+	"""
+	def __init__(self, expr, fields):
+		self.expr = expr
+		self.fields = fields
+
+
+	def fail(self, msg):
+		expr = self.expr
+		raise dException.QueryException(
+				_("Invalid expression '%(expr)s': %(msg)s") % locals())
+
+
+	def generic_visit(self, node):
+		if not isinstance(node, _exprNodes):
+			self.fail(_("'%s' is not allowed") % node.__class__.__name__)
+		return super(_ExpressionTransformer, self).generic_visit(node)
+
+
+	def visit_Name(self, node):
+		name = node.id
+		if name in self.fields:
+			return ast.copy_location(ast.Subscript(
+					value=ast.Name(id=_recName, ctx=ast.Load()),
+					slice=ast.Index(value=ast.Str(s=name)), ctx=node.ctx), node)
+		if name not in _exprGlobals:
+			self.fail(_("unknown name '%s'") % name)
+		return node
+
+
+	def visit_Attribute(self, node):
+		if node.attr.startswith(_blockedAttrPrefixes):
+			self.fail(_("attribute '%s' is not allowed") % node.attr)
+		return self.generic_visit(node)
+
+
+
+def _parseExpression(expr, fields):
+	"""Return the validated AST for the expression, with the fields replaced."""
+	try:
+		tree = ast.parse(expr.strip(), mode="eval")
+	except SyntaxError, e:
+		raise dException.QueryException(
+				_("Invalid expression '%(expr)s': %(e)s") % locals())
+	return _ExpressionTransformer(expr, fields).visit(tree).body
+
+
+def _compileExpressions(kind, exprs, fields):
+	"""
+	Compile the expressions into a function, and cache it. For the 'filter'
+	kind, the function takes a sequence of records and returns the list of the
+	records matching all of the expressions, in a single pass. For the 'value'
+	kind, there must be one expression, and the function takes a single record
+	and returns the expression's value for it.
+	"""
+	key = (kind, exprs, fields)
+	try:
+		return _compiledExpressions[key]
+	except KeyError:
+		pass
+	recLoad = ast.Name(id=_recName, ctx=ast.Load())
+	bodies = [_parseExpression(expr, fields) for expr in exprs]
+	if kind == "filter":
+		argName = _recsName
+		body = ast.ListComp(elt=recLoad, generators=[ast.comprehension(
+				target=ast.Name(id=_recName, ctx=ast.Store()),
+				iter=ast.Name(id=_recsName, ctx=ast.Load()), ifs=bodies)])
+	else:
+		argName = _recName
+		body = bodies[0]
+	func = ast.Expression(body=ast.Lambda(args=ast.arguments(
+			args=[ast.Name(id=argName, ctx=ast.Param())], vararg=None, kwarg=None,
+			defaults=[]), body=body))
+	ast.fix_missing_locations(func)
+	code = compile(func, "<dDataSet expression>", "eval")
+	ret = eval(code, {"__builtins__": _exprGlobals})
+	if len(_compiledExpressions) >= _maxCompiledExpressions:
+		_compiledExpressions.clear()
+	_compiledExpressions[key] = ret
+	return ret
+
+
 
 class dDataSet(tuple):
 	""" This class assumes that its contents are not ordinary tuples, but
@@ -51,8 +178,18 @@ class dDataSet(tuple):
 		self._typeStructure = {}
 		# We may need to encode fields that are not legal names.
 		self.fieldAliases = {}
-		# Keep a hash value to tell if we need to re-populate
-		self._dataHash = ""
+		# Change tracking for the SQLite tables that mirror this data set. The
+		# version is increased by markChanged(); _changedRows maps the changed
+		# rows to the version they were changed in, and _reloadVersion is the
+		# last version in which all the rows were changed.
+		self._mirrorToken = _mirrorTokens.next()
+		self._version = 0
+		self._changedRows = {}
+		self._reloadVersion = 0
+		self._recordIndex = None
+		self._indexHints = []
+		# The SQLite tables in this data set's connection, keyed by alias.
+		self._mirrors = {}
 
 		sqlite.register_adapter(Decimal, self._adapt_decimal)
 		# When filtering datasets, we need a reference to the dataset
@@ -97,6 +234,51 @@ class dDataSet(tuple):
 		return Decimal(strVal)
 
 
+	def markChanged(self, row=None):
+		"""Record that the values in the specified row have been changed in
+		place, so that execute() will update its copy of the row. If no row
+		is specified, all rows are considered changed.
+
+		Dabo's cursors and the replace() method call this for you; call it if
+		you change the record dicts directly and then use execute().
+		"""
+		self._version += 1
+		changedRows = self._changedRows
+		if row is None or len(changedRows) >= len(self) // 2:
+			# Reloading everything will be quicker than updating each row.
+			self._reloadVersion = self._version
+			changedRows.clear()
+		else:
+			changedRows[row] = self._version
+		source = self._sourceDataSet
+		if source is not None:
+			# Filtered data sets share their records with their source.
+			if row is None:
+				source.markChanged()
+			else:
+				sourceRow = source._getRowIndex(self[row])
+				if sourceRow is not None:
+					source.markChanged(sourceRow)
+
+
+	def addIndexHint(self, *flds):
+		"""Create an index on the passed field(s) in the SQLite table that
+		mirrors this data set in execute(). Use it for the fields used in
+		the joins and filters of queries that are run repeatedly.
+		"""
+		if flds not in self._indexHints:
+			self._indexHints.append(flds)
+
+
+	def _getRowIndex(self, rec):
+		"""Returns the index of the passed record object, or None."""
+		index = self._recordIndex
+		if index is None:
+			index = self._recordIndex = dict([(id(item), idx)
+					for idx, item in enumerate(self)])
+		return index.get(id(rec))
+
+
 	def _index(self, rec):
 		"""Returns the index of the record object, or None."""
 		for idx, item in enumerate(self):
@@ -111,29 +293,25 @@ class dDataSet(tuple):
 		All records matching the scope are affected; if	no scope is specified,
 		all records are affected.
 
-		Scope is a boolean expression.
+		Scope is a boolean expression. If valOrExpr is a string beginning with
+		'=', the rest of it is an expression that is evaluated for each record;
+		otherwise it is used as a literal value. See filterByExpression() for
+		what expressions can contain.
 		"""
-		if scope is not None:
-			scope = self._fldReplace(scope, "rec")
-
-		literal = True
-		if isinstance(valOrExpr, basestring):
-			if valOrExpr.strip()[0] == "=":
-				literal = False
-				valOrExpr = valOrExpr.replace("=", "", 1)
-			valOrExpr = self._fldReplace(valOrExpr, "rec")
-		if literal:
-			upDict = {field: valOrExpr}
-			if scope is None:
-				[rec.update(upDict) for rec in self]
-			else:
-				[rec.update(upDict) for rec in self
-						if eval(scope)]
+		if not self:
+			return
+		if scope is None:
+			recs = self
 		else:
-			# Need to go record-by-record so that the expression evaluates correctly
-			for rec in self:
-				if eval(scope):
-					rec[field] = eval(valOrExpr)
+			recs = self._getExpressionFunc("filter", (scope, ))(self)
+		if isinstance(valOrExpr, basestring) and valOrExpr.strip().startswith("="):
+			valFunc = self._getExpressionFunc("value", (valOrExpr.strip()[1:], ))
+			for rec in recs:
+				rec[field] = valFunc(rec)
+		else:
+			for rec in recs:
+				rec[field] = valOrExpr
+		self.markChanged()
 
 
 	def sort(self, col, ascdesc=None, caseSensitive=None):
@@ -171,24 +349,7 @@ class dDataSet(tuple):
 			# No rows, so nothing to filter
 			return self
 		op = op.strip().lower()
-		opDict = {"eq": operator.eq,
-				"=": operator.eq,
-				"equals": operator.eq,
-				"ne": operator.ne,
-				"!=": operator.ne,
-				"nequals": operator.ne,
-				"gt": operator.gt,
-				">": operator.gt,
-				"gte": operator.ge,
-				">=": operator.ge,
-				"lt": operator.lt,
-				"<": operator.lt,
-				"lte": operator.le,
-				"<=": operator.le}
-		try:
-			fnc = opDict[op]
-		except KeyError:
-			fnc = None
+		fnc = _filterOps.get(op)
 		if fnc:
 			filtered = [rec for rec in self if fnc(rec[fld], expr)]
 		elif op in ("startswith", "beginswith"):
@@ -197,6 +358,8 @@ class dDataSet(tuple):
 			filtered = [rec for rec in self if (rec[fld] or "").endswith(expr)]
 		elif op == "contains":
 			filtered = [rec for rec in self if expr in (rec[fld] or "")]
+		else:
+			raise dException.QueryException(_("Unknown filter operator: '%s'") % op)
 		ret = self.__class__(filtered)
 		ret._sourceDataSet = self
 		ret._filtered_fld = fld
@@ -206,13 +369,24 @@ class dDataSet(tuple):
 
 
 	def filterByExpression(self, expr):
-		"""Allows you to filter by any valid Python expression."""
+		"""Filter by a Python expression that uses the field names as variables,
+		such as "price > 50 and name.startswith('A')".
+
+		Expressions are limited to literals, operators, comparisons, field values,
+		their methods and a few builtins such as len(), int() or Decimal(); names
+		beginning with an underscore are not allowed. Each expression is compiled
+		once, and reused for data sets with the same fields.
+
+		You may also pass a sequence of expressions; this gives the same records
+		as calling this method once for each expression, but in a single pass,
+		and it only adds one filter level to be removed by removeFilter().
+		"""
 		if not self:
 			# No rows, so nothing to filter
 			return self
-		stmnt = """ [rec for rec in self if %s] """ % self._fldReplace(expr, "rec")
-		recs = eval(stmnt)
-		ret = self.__class__(recs)
+		if isinstance(expr, basestring):
+			expr = (expr, )
+		ret = self.__class__(self._getExpressionFunc("filter", expr)(self))
 		ret._sourceDataSet = self
 		return ret
 
@@ -233,29 +407,16 @@ class dDataSet(tuple):
 		return ret
 
 
-	def _fldReplace(self, expr, dictName=None):
-		"""The list comprehensions require the field names be the keys
-		in a dictionary expression. Users, though, should not have to know
-		about this. This takes a user-defined, SQL-like expressions, and
-		substitutes any field name with the corresponding dict
-		expression. If no dictName is supplied, the name 'rec' will be used,
-		for the typical list comprehension of :
-			[rec for rec in self where ...]
-		Examples (assuming 'price' is a column in the data):
-			self._fldReplace("price > 50")
-				=> returns "rec['price'] > 50"
-			self._fldReplace("price > 50", "foo")
-				=> returns "foo['price'] > 50"
+	def _getExpressionFunc(self, kind, exprs):
+		"""Return the compiled function for the expressions and this data set's fields."""
+		return _compileExpressions(kind, tuple(exprs), frozenset(self[0]))
+
+
+	def _mirrorFields(self, ds):
+		"""Returns the fields of 'ds' that are copied to SQLite. Dabo's internal
+		flags are left out, since they aren't present in every record.
 		"""
-		patTemplate = r"\b%s\b"
-		ret = expr
-		if dictName is None:
-			dictName = "rec"
-		for kk in self[0]:
-			pat = patTemplate % kk
-			replacement = "%s['%s']" % (dictName, kk)
-			ret = re.sub(pat, replacement, ret)
-		return ret
+		return tuple([fld for fld in ds[0] if not fld.startswith("dabo-")])
 
 
 	def _makeCreateTable(self, ds, alias=None):
@@ -275,27 +436,25 @@ class dDataSet(tuple):
 		rec = ds[0]
 		retList = []
 
-		for key in rec:
-			if key.startswith("dabo-"):
-				# This is an internal field
-				safekey = key.replace("-", "_")
-				self.fieldAliases[safekey] = key
-			else:
-				safekey = key
+		for key in self._mirrorFields(ds):
 			try:
 				typ = dabo.db.getPythonType(self._typeStructure[key][0])
 			except KeyError:
 				typ = type(rec[key])
 			try:
-				retList.append("%s %s" % (safekey, ds._typeDict[typ]))
+				retList.append("%s %s" % (key, ds._typeDict[typ]))
 			except KeyError:
-				retList.append(safekey)
+				retList.append(key)
 		return "create table %s (%s)" % (alias, ", ".join(retList))
 
 
 	def _populate(self, ds, alias=None):
 		"""This is the method that converts a Python dataset
 		into a SQLite table with the name specified by 'alias'.
+
+		The table is kept for later calls. If 'ds' has been loaded into it
+		before, only the rows marked as changed since then are updated; it is
+		only reloaded when most of the rows or the fields have changed.
 		"""
 		if alias is None:
 			# Use the default
@@ -305,29 +464,45 @@ class dDataSet(tuple):
 			dabo.log.info(_("Cannot populate without data for alias '%s'")
 					% alias)
 			return None
-		hs = hashlib.md5(ustr(ds)).hexdigest()
-		if hs == ds._dataHash:
-			# Data's already there and hasn't changed; no need to re-load it
-			return
-		ds._dataHash = hs
-		if ds._populated:
-			# Clear out the old records
-			self._cursor.execute("delete from %s" % alias)
-		else:
-			# Create the table
-			self._cursor.execute(self._makeCreateTable(ds, alias))
-
-		# Fields may contain illegal names. This will correct them
-		flds = [fld.replace("dabo-", "dabo_") for fld in ds[0]]
-		fldParams = [":%s" % fld for fld in flds]
-		insStmnt = "insert into %s (%s) values (%s)" % (alias,
-				", ".join(flds), ", ".join(fldParams))
-
-		def recGenerator(ds):
-			for rec in ds:
-				yield rec
-
-		self._cursor.executemany(insStmnt, recGenerator(ds))
+		crs = self._cursor
+		flds = self._mirrorFields(ds)
+		state = self._mirrors.get(alias)
+		if state is not None and ((state["token"] != ds._mirrorToken)
+				or (state["fields"] != flds)):
+			# A different data set, or its fields have changed.
+			crs.execute("drop table %s" % alias)
+			state = None
+		if state is None:
+			crs.execute(self._makeCreateTable(ds, alias))
+			state = self._mirrors[alias] = {"token": ds._mirrorToken,
+					"fields": flds, "version": None, "indexes": set()}
+
+		def getValues(rec):
+			return [rec.get(fld) for fld in flds]
+
+		version = state["version"]
+		if version is None or version < ds._reloadVersion:
+			if version is not None:
+				# Clear out the old records
+				crs.execute("delete from %s" % alias)
+			# The rowid is the position of the record in the data set.
+			insStmnt = "insert into %s (rowid, %s) values (?, %s)" % (alias,
+					", ".join(flds), ", ".join(["?"] * len(flds)))
+			crs.executemany(insStmnt, ([idx] + getValues(rec)
+					for idx, rec in enumerate(ds)))
+		elif version < ds._version:
+			updStmnt = "update %s set %s where rowid = ?" % (alias,
+					", ".join(["%s = ?" % fld for fld in flds]))
+			crs.executemany(updStmnt, [getValues(ds[row]) + [row]
+					for row, rowVersion in ds._changedRows.iteritems()
+					if rowVersion > version])
+		state["version"] = ds._version
+
+		for hint in ds._indexHints:
+			if hint not in state["indexes"]:
+				crs.execute("create index %s_%s_idx on %s (%s)" % (alias,
+						"_".join(hint), alias, ", ".join(hint)))
+				state["indexes"].add(hint)
 		if ds is self:
 			self._populated = True
 
@@ -400,6 +575,9 @@ class dDataSet(tuple):
 		# modified data set.
 		if not sqlExpr.lower().strip().startswith("select "):
 			self._cursor.execute("select * from dataset")
+			# The tables no longer match the data sets; reload them next time.
+			for state in self._mirrors.values():
+				state["version"] = -1
 		tmpres = self._cursor.fetchall()
 
 # 		ft = time.clock()
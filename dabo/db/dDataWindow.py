@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+from dabo.dLocalize import _
+import dabo.dException as dException
+from dabo.dObject import dObject
+from dabo.lib.lruCache import LRUCache
+
+
+
+class dDataWindow(dObject):
+	"""Random access to the rows of a cursor's query, without fetching them all.
+
+	The window runs the cursor's query wrapped in a derived table: the number
+	of rows comes from a count(*) query, and rows are fetched a page at a time
+	with the backend's limit/offset clause when they are first asked for. At
+	most MaxPages pages are kept; the least recently used ones are dropped.
+	Backends that can't skip rows in a query fetch the rows of a page by
+	reading past the ones before it.
+
+	Sorting is done by the database, and the rows are always ordered by the
+	cursor's KeyField after the sort column, so that the pages are stable.
+	seek() finds a value in the sort column with a count query, instead of
+	reading through the rows.
+
+	The queries run on a separate cursor, so the contents of the cursor are
+	not changed, and changes that haven't been saved are not seen by the
+	window. Call refresh() to see the current data in the database.
+	"""
+	def __init__(self, cursor, params=None, pageSize=200, maxPages=10, **kwargs):
+		self._baseClass = dDataWindow
+		self._cursor = cursor
+		self._params = tuple(params or ())
+		self._pageSize = max(1, int(pageSize))
+		self._pages = LRUCache(maxPages)
+		self._rowCount = None
+		self._sortColumn = None
+		self._sortOrder = "ASC"
+		self._sortCase = True
+		self._baseSQL = None
+		super(dDataWindow, self).__init__(**kwargs)
+
+
+	def refresh(self):
+		"""Discard the fetched rows and the row count, and re-read the query."""
+		self._baseSQL = None
+		self._rowCount = None
+		self._pages.clear(resetCounts=False)
+
+
+	def getFieldVal(self, fld, row):
+		"""Return the value of the field in the row."""
+		try:
+			return self.getRecord(row)[fld]
+		except KeyError:
+			raise dException.FieldNotFoundException(_("Field '%s' does not exist in the data set")
+					% fld)
+
+
+	def getRecord(self, row):
+		"""Return the record of the row as a dict."""
+		if not 0 <= row < self.RowCount:
+			raise dException.RowNotFoundException(_("Row #%s does not exist") % row)
+		pageNum, pos = divmod(row, self._pageSize)
+		page = self._pages.get(pageNum)
+		if page is None:
+			page = self._pages[pageNum] = self._fetchPage(pageNum)
+		try:
+			return page[pos]
+		except IndexError:
+			# Rows were deleted since the row count was taken.
+			raise dException.RowNotFoundException(_("Row #%s does not exist") % row)
+
+
+	def sort(self, col, ordr="ASC", caseSensitive=True):
+		"""
+		Order the rows by the column 'col', in the order 'ordr' ("ASC" or
+		"DESC"). Pass None for 'col' to order them by the KeyField only.
+		"""
+		ordr = (ordr or "ASC").upper()
+		if ordr not in ("ASC", "DESC"):
+			raise ValueError(_("Invalid sort order: %s") % ordr)
+		self._sortColumn = col
+		self._sortOrder = ordr
+		self._sortCase = caseSensitive
+		self._pages.clear(resetCounts=False)
+
+
+	def seek(self, val, fld=None, near=True):
+		"""
+		Return the row of the first record whose value in 'fld' (default: the
+		sort column) is 'val', or, if 'near' is True, where it would be. The
+		rows must be sorted on 'fld', and strings are compared with the case
+		sensitivity of the sort. Returns -1 if the value isn't found.
+		"""
+		if fld is None:
+			fld = self._sortColumn
+		if fld is None or fld != self._sortColumn:
+			raise ValueError(_("The data window must be sorted on the seek field."))
+		ignoreCase = self._ignoreCase(fld)
+		col = self._colName(fld)
+		if ignoreCase:
+			col = "lower(%s)" % col
+			if isinstance(val, basestring):
+				val = val.lower()
+		backend = self._cursor.BackendObject
+		if self._sortOrder == "ASC":
+			op = "<"
+		else:
+			op = ">"
+		where = "%s %s %s" % (col, op, backend.paramPlaceholder)
+		if (self._sortOrder == "ASC") == backend.nullsSortFirst:
+			# The rows with NULLs come before the value.
+			where = "(%s or %s is null)" % (where, col)
+		ret = self._count(where, (val,))
+		if near:
+			return min(ret, max(self.RowCount - 1, 0))
+		if ret < self.RowCount:
+			found = self.getFieldVal(fld, ret)
+			if ignoreCase and isinstance(found, basestring):
+				found = found.lower()
+			if found == val:
+				return ret
+		return -1
+
+
+	def _ignoreCase(self, fld):
+		"""Return True if the values of the field are compared without case."""
+		return not self._sortCase and self._cursor.getDataTypes().get(fld) in (str, unicode)
+
+
+	def _getBaseSQL(self):
+		"""Return the cursor's query, without its limit and order by clauses."""
+		if self._baseSQL is None:
+			crs = self._cursor
+			if crs.UserSQL:
+				sql = crs.UserSQL.strip().rstrip(";")
+			else:
+				holdLimit = crs.getLimitClause()
+				holdOrder = crs.getOrderByClause()
+				crs.setLimitClause(None)
+				crs.setOrderByClause("")
+				try:
+					sql = crs.getSQL()
+				finally:
+					crs.setLimitClause(holdLimit)
+					crs.setOrderByClause(holdOrder)
+			self._baseSQL = sql
+		return self._baseSQL
+
+
+	def _colName(self, fld):
+		crs = self._cursor
+		return crs.BackendObject.encloseNames(fld, autoQuote=crs.AutoQuoteNames)
+
+
+	def _count(self, where=None, params=()):
+		sql = "select count(*) from (%s) dabo_window" % self._getBaseSQL()
+		if where:
+			sql = "%s where %s" % (sql, where)
+		crs = self._cursor._getStreamCursor()
+		try:
+			crs.execute(sql, self._params + params, _fetch=False)
+			row = crs.fetchmany(1)[0]
+		finally:
+			crs.close()
+		if isinstance(row, dict):
+			row = row.values()
+		return int(row[0])
+
+
+	def _fetchPage(self, pageNum):
+		"""Fetch the records of the page from the database."""
+		crs = self._cursor
+		backend = crs.BackendObject
+		pageSize = self._pageSize
+		offset = pageNum * pageSize
+		orderBy = []
+		if self._sortColumn:
+			col = self._colName(self._sortColumn)
+			if self._ignoreCase(self._sortColumn):
+				col = "lower(%s)" % col
+			orderBy.append("%s %s" % (col, self._sortOrder))
+		keys = crs.KeyField
+		if isinstance(keys, basestring):
+			keys = keys.split(",")
+		orderBy.extend([self._colName(key.strip()) for key in keys or ()])
+		orderByClause = ""
+		if orderBy:
+			orderByClause = " order by " + ", ".join(orderBy)
+		limitClause = backend.getLimitOffsetClause(pageSize, offset)
+		if limitClause is None:
+			# Read past the rows of the pages before this one.
+			limitClause = ""
+			skip = offset
+		else:
+			limitClause = " %s %s" % (backend.getLimitWord(), limitClause)
+			skip = 0
+		sql = backend.formSQL("*", "  from (%s) dabo_window" % self._getBaseSQL(), "",
+				"", "", orderByClause, limitClause)
+		ret = []
+		stream = crs._getStreamCursor()
+		try:
+			stream.execute(sql, self._params, _fetch=False)
+			for batch in stream._streamBatches(pageSize):
+				if skip >= len(batch):
+					skip -= len(batch)
+					continue
+				ret.extend(batch[skip:])
+				skip = 0
+				if len(ret) >= pageSize:
+					break
+		finally:
+			stream.close()
+		return ret[:pageSize]
+
+
+	def _getCursor(self):
+		return self._cursor
+
+
+	def _getMaxPages(self):
+		return self._pages.MaxSize
+
+	def _setMaxPages(self, val):
+		self._pages.MaxSize = val
+
+
+	def _getPageSize(self):
+		return self._pageSize
+
+	def _setPageSize(self, val):
+		val = max(1, int(val))
+		if val != self._pageSize:
+			self._pageSize = val
+			self._pages.clear(resetCounts=False)
+
+
+	def _getRowCount(self):
+		if self._rowCount is None:
+			self._rowCount = self._count()
+		return self._rowCount
+
+
+	def _getSortColumn(self):
+		return self._sortColumn
+
+
+	def _getSortOrder(self):
+		return self._sortOrder
+
+
+	def _getStats(self):
+		pages = self._pages
+		return {"pages": len(pages), "hits": pages.Hits, "misses": pages.Misses}
+
+
+	Cursor = property(_getCursor, None, None,
+			_("The cursor whose query the window runs.  (read-only) (dCursorMixin)"))
+
+	MaxPages = property(_getMaxPages, _setMaxPages, None,
+			_("Maximum number of pages of rows that are kept. Default=10  (int)"))
+
+	PageSize = property(_getPageSize, _setPageSize, None,
+			_("Number of rows that are fetched at a time. Default=200  (int)"))
+
+	RowCount = property(_getRowCount, None, None,
+			_("Number of rows returned by the query.  (read-only) (int)"))
+
+	SortColumn = property(_getSortColumn, None, None,
+			_("The column that the rows are sorted on, or None.  (read-only) (str)"))
+
+	SortOrder = property(_getSortOrder, None, None,
+			_("The sort order, 'ASC' or 'DESC'.  (read-only) (str)"))
+
+	Stats = property(_getStats, None, None,
+			_("""Dict with the number of pages that are kept, and the hits and
+			misses of page lookups.  (read-only) (dict)"""))
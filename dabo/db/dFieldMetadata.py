@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import time
+import dabo
+from dabo.dLocalize import _
+
+
+
+class dFieldMetadata(object):
+	""" Read-only lookup tables built from a cursor's DataStructure.
+
+	The DataStructure is a sequence of 6-element tuples, which is fine for
+	describing the fields but slow to search: finding the type of a single
+	field means scanning the whole sequence. The cursor builds one of these
+	objects each time its structure changes, so that the code that runs for
+	every field of every row can use dict and set lookups instead.
+
+	The lookup tables must not be modified; a new object is created whenever
+	the structure, the table or the quoting of names changes.
+	"""
+	__slots__ = ("_structure", "_table", "_autoQuote", "_fields", "_fieldTypes",
+			"_pythonTypes", "_scales", "_pkFields", "_tableFields",
+			"_nonUpdateFields", "_quotedNames", "_tablePrefix")
+
+
+	def __init__(self, structure, table="", autoQuote=True, backend=None):
+		setattr = object.__setattr__
+		structure = tuple(structure)
+		setattr(self, "_structure", structure)
+		setattr(self, "_table", table)
+		setattr(self, "_autoQuote", autoQuote)
+		setattr(self, "_fields", tuple([fld[0] for fld in structure]))
+		fieldTypes = {}
+		pythonTypes = {}
+		scales = {}
+		pkFields = set()
+		tableFields = set()
+		nonUpdateFields = set()
+		for field_alias, field_type, field_pk, table_name, field_name, field_scale in structure:
+			fieldTypes[field_alias] = field_type
+			pythonTypes[field_alias] = dabo.db.getPythonType(field_type)
+			scales[field_alias] = field_scale
+			if field_pk:
+				pkFields.add(field_alias)
+			if table_name == table:
+				tableFields.add(field_alias)
+			if (table_name != table) or not field_name:
+				nonUpdateFields.add(field_alias)
+		setattr(self, "_fieldTypes", fieldTypes)
+		setattr(self, "_pythonTypes", pythonTypes)
+		setattr(self, "_scales", scales)
+		setattr(self, "_pkFields", frozenset(pkFields))
+		setattr(self, "_tableFields", frozenset(tableFields))
+		setattr(self, "_nonUpdateFields", frozenset(nonUpdateFields))
+		if backend is None:
+			quotedNames = dict([(fld, fld) for fld in fieldTypes])
+			tablePrefix = "%s." % table
+		else:
+			quotedNames = dict([(fld, backend.encloseNames(fld, autoQuote))
+					for fld in fieldTypes])
+			tablePrefix = backend.getUpdateTablePrefix(table, autoQuote=autoQuote)
+		setattr(self, "_quotedNames", quotedNames)
+		setattr(self, "_tablePrefix", tablePrefix)
+
+
+	def __setattr__(self, att, val):
+		raise AttributeError(_("dFieldMetadata objects are read-only"))
+
+
+	def matches(self, table, autoQuote):
+		"""Return True if this object was built for the passed settings."""
+		return (self._table == table) and (self._autoQuote == autoQuote)
+
+
+	def _getAutoQuote(self):
+		return self._autoQuote
+
+
+	def _getFields(self):
+		return self._fields
+
+
+	def _getFieldTypes(self):
+		return self._fieldTypes
+
+
+	def _getNonUpdateFields(self):
+		return self._nonUpdateFields
+
+
+	def _getPKFields(self):
+		return self._pkFields
+
+
+	def _getPythonTypes(self):
+		return self._pythonTypes
+
+
+	def _getQuotedNames(self):
+		return self._quotedNames
+
+
+	def _getScales(self):
+		return self._scales
+
+
+	def _getStructure(self):
+		return self._structure
+
+
+	def _getTable(self):
+		return self._table
+
+
+	def _getTableFields(self):
+		return self._tableFields
+
+
+	def _getTablePrefix(self):
+		return self._tablePrefix
+
+
+	AutoQuote = property(_getAutoQuote, None, None,
+			_("Whether names were quoted when this object was built. (bool)"))
+
+	Fields = property(_getFields, None, None,
+			_("Field aliases, in DataStructure order.  (tuple)"))
+
+	FieldTypes = property(_getFieldTypes, None, None,
+			_("Dabo type code for each field alias.  (dict)"))
+
+	NonUpdateFields = property(_getNonUpdateFields, None, None,
+			_("""Fields that don't belong to the table, or that don't have a
+			field name in the table.  (frozenset)"""))
+
+	PKFields = property(_getPKFields, None, None,
+			_("Fields that are flagged as part of the primary key.  (frozenset)"))
+
+	PythonTypes = property(_getPythonTypes, None, None,
+			_("Python type for each field alias.  (dict)"))
+
+	QuotedNames = property(_getQuotedNames, None, None,
+			_("Each field alias, enclosed as needed by the backend.  (dict)"))
+
+	Scales = property(_getScales, None, None,
+			_("Decimal scale for each field alias, or None if unknown.  (dict)"))
+
+	Structure = property(_getStructure, None, None,
+			_("The DataStructure this object was built from.  (tuple)"))
+
+	Table = property(_getTable, None, None,
+			_("The table this object was built for.  (str)"))
+
+	TableFields = property(_getTableFields, None, None,
+			_("Fields that belong to the table.  (frozenset)"))
+
+	TablePrefix = property(_getTablePrefix, None, None,
+			_("Prefix placed before field names in UPDATE statements.  (str)"))
+
+
+
+if __name__ == "__main__":
+	# Time the structure-dependent cursor operations on a wide cursor.
+	import dabo.db
+	numCols = 120
+	numRows = 500
+	con = dabo.db.dConnection(DbType="SQLite", Database=":memory:")
+	cur = con.getDaboCursor()
+	colNames = ["col%03d" % num for num in xrange(numCols)]
+	colTypes = ["int", "char", "decimal(10,2)"]
+	cur.execute("create table wide (pk INTEGER PRIMARY KEY, %s)"
+			% ", ".join(["%s %s" % (nm, colTypes[num % 3])
+			for num, nm in enumerate(colNames)]))
+	rowVals = [num if num % 3 == 0 else "%s" % num if num % 3 == 1 else "%s.25" % num
+			for num in xrange(numCols)]
+	cur.executemany("insert into wide (%s) values (%s)" % (", ".join(colNames),
+			", ".join(["?"] * numCols)), [rowVals] * numRows)
+	cur.Table = "wide"
+	cur.KeyField = "pk"
+	cur.UserSQL = "select * from wide"
+	cur.requery()
+
+	start = time.time()
+	for row in xrange(cur.RowCount):
+		for nm in colNames:
+			cur.getFieldVal(nm, row)
+	print "getFieldVal: %.3f s for %s rows" % (time.time() - start, cur.RowCount)
+
+	start = time.time()
+	for nm in colNames:
+		cur.sort(nm, "DESC")
+	print "sort: %.3f s for %s columns" % (time.time() - start, numCols)
+
+	for row in xrange(cur.RowCount):
+		for nm in colNames[1::3]:
+			cur.setFieldVal(nm, u"changed", row)
+	start = time.time()
+	cur.save(allRows=True)
+	print "save: %.3f s for %s rows" % (time.time() - start, cur.RowCount)
@@ -10,6 +10,10 @@ from dabo.lib.utils import ustr
 class Firebird(dBackend):
 	"""Class providing Firebird connectivity. Uses kinterbasdb."""
 
+	# Firebird allows at most 1500 expressions in an 'in' list.
+	maxParams = 1500
+	pingSQL = "select 1 from rdb$database"
+
 	# Firebird treats quotes names differently than unquoted names. This
 	# will turn off the effect of automatically quoting all entities in Firebird;
 	# if you need quotes for spaces and bad names, you'll have to supply
@@ -237,6 +241,11 @@ class Firebird(dBackend):
 		return "first"
 
 
+	def getLimitOffsetClause(self, limit, offset):
+		"""Firebird puts the rows to skip after the number of rows to get."""
+		return "%d skip %d" % (limit, offset)
+
+
 	def formSQL(self, fieldClause, fromClause, joinClause,
 				whereClause, groupByClause, orderByClause, limitClause):
 		"""Firebird wants the limit clause before the field clause."""
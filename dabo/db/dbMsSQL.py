@@ -8,6 +8,10 @@ from dabo.lib.utils import ustr
 
 class MSSQL(dBackend):
 	"""Class providing Microsoft SQL Server connectivity. Uses pymssql."""
+
+	# SQL Server accepts up to 2100 parameters per statement.
+	maxParams = 2000
+
 	def __init__(self):
 		dBackend.__init__(self)
 		#- jfcs 11/06/06 first try getting Microsoft SQL 2000 server working
@@ -63,6 +67,12 @@ class MSSQL(dBackend):
 						for key in range(len(row) / 2):
 							row.pop(key, None)
 					return rows
+				def fetchmany(self, *args, **kwargs):
+					rows = super(ConCursor, self).fetchmany(*args, **kwargs)
+					for row in rows:
+						for key in range(len(row) / 2):
+							row.pop(key, None)
+					return rows
 		else:
 			class ConCursor(self.dbapi.pymssqlCursor):
 				def __init__(self, *args, **kwargs):
@@ -261,6 +271,11 @@ select kc.COLUMN_NAME from INFORMATION_SCHEMA.KEY_COLUMN_USAGE as kc
 		return "TOP"
 
 
+	def getLimitOffsetClause(self, limit, offset):
+		"""TOP can't skip rows."""
+		return None
+
+
 	def formSQL(self, fieldClause, fromClause, joinClause,
 				whereClause, groupByClause, orderByClause, limitClause):
 		"""MS SQL wants the limit clause before the field clause."""
@@ -10,18 +10,22 @@ from dabo.lib.utils import ustr
 from dCursorMixin import dCursorMixin
 
 class MySQLAutoReconnectCursor(dCursorMixin):
-	def execute(self, sql, params=None, errorClass=None, convertQMarks=False):
+	def execute(self, sql, params=None, errorClass=None, convertQMarks=False,
+			_fetch=True):
 		from MySQLdb import OperationalError
 		try:
-			return super(MySQLAutoReconnectCursor, self).execute(sql, params=params, errorClass=OperationalError, convertQMarks=convertQMarks)
+			return super(MySQLAutoReconnectCursor, self).execute(sql, params=params, errorClass=OperationalError, convertQMarks=convertQMarks, _fetch=_fetch)
 		except OperationalError:
 			self.connection.ping(True)
-			return super(MySQLAutoReconnectCursor, self).execute(sql, params=params, errorClass=None, convertQMarks=convertQMarks)
+			return super(MySQLAutoReconnectCursor, self).execute(sql, params=params, errorClass=None, convertQMarks=convertQMarks, _fetch=_fetch)
 
 
 class MySQL(dBackend):
 	"""Class providing MySQL connectivity. Uses MySQLdb."""
 
+	# No practical parameter limit; keep the statements a reasonable size.
+	maxParams = 5000
+
 	# MySQL uses the backtick to enclose names with spaces.
 	nameEnclosureChar = "`"
 
@@ -94,6 +98,15 @@ class MySQL(dBackend):
 	def getMainCursorClass(self):
 		return MySQLAutoReconnectCursor
 
+
+	def getStreamCursor(self, cursorClass):
+		# SSDictCursor leaves the result set on the server, and reads the rows
+		# as they are fetched. No other statement can run on the connection
+		# until all the rows are read or the cursor is closed.
+		from MySQLdb.cursors import SSDictCursor
+		return self._getStreamCursorClass(cursorClass, SSDictCursor)(self._connection)
+
+
 	def beginTransaction(self, cursor):
 		""" Begin a SQL transaction."""
 		cursor.execute("START TRANSACTION")
@@ -152,6 +165,13 @@ class MySQL(dBackend):
 		return cursor.getDataSet()[0]["ncount"]
 
 
+	def getSchemaVersion(self):
+		"""A checksum of the definitions of the columns of the database's tables."""
+		return self._fetchSchemaVersion("select count(*), sum(crc32(concat_ws(':',"
+				" table_name, column_name, column_type, column_key)))"
+				" from information_schema.columns where table_schema = database()")
+
+
 	def getFields(self, tableName, cursor):
 		if not tableName:
 			return tuple()
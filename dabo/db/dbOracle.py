@@ -12,6 +12,11 @@ from dabo.lib.utils import ustr
 
 
 class Oracle(dBackend):
+	# Oracle allows at most 1000 expressions in an 'in' list.
+	maxParams = 1000
+	pingSQL = "select 1 from dual"
+	nullsSortFirst = False
+
 	def __init__(self):
 		import cx_Oracle as dbapi
 		dBackend.__init__(self)
@@ -38,6 +43,11 @@ class Oracle(dBackend):
 		return self.dbapi.Cursor
 
 
+	def cancelQuery(self):
+		self._connection.cancel()
+		return True
+
+
 	def escQuote(self, val):
 		# escape backslashes and single quotes, and
 		# wrap the result in single quotes
@@ -132,6 +142,11 @@ class Oracle(dBackend):
 		return "rownum <="
 
 
+	def getLimitOffsetClause(self, limit, offset):
+		"""The rownum limit is applied before the rows are sorted, and can't skip rows."""
+		return None
+
+
 	def formSQL(self, fieldClause, fromClause, joinClause,
 				whereClause, groupByClause, orderByClause, limitClause):
 		""" Oracle wants the limit clause as where clause. """
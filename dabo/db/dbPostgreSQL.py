@@ -2,16 +2,24 @@
 
 import codecs
 import datetime
+import itertools
 import dabo
 from dabo.dLocalize import _
 from dBackend import dBackend
 from dabo.lib.utils import ustr
 
+# Numbers for the names of server-side cursors.
+_streamCursorIds = itertools.count(1)
 
 
 class Postgres(dBackend):
 	"""Class providing PostgreSQL connectivity. Uses psycopg."""
 
+	# No practical parameter limit; keep the statements a reasonable size.
+	maxParams = 5000
+	# NULLs are larger than all other values.
+	nullsSortFirst = False
+
 
 	_encodings = {
 		# mapping from Python encoding names
@@ -100,12 +108,30 @@ class Postgres(dBackend):
 		return True
 
 
+	def cancelQuery(self):
+		# Available in psycopg2 2.3 and later.
+		try:
+			cancel = self._connection.cancel
+		except AttributeError:
+			return False
+		cancel()
+		return True
+
+
 	def getDictCursorClass(self):
 		# the new psycopg 2.0 supports DictCursor
 		import psycopg2.extras as cursors
 		return cursors.DictCursor
 
 
+	def getStreamCursor(self, cursorClass):
+		# A named cursor keeps the result set on the server, and fetches the
+		# rows as they are asked for. It must run inside a transaction.
+		import psycopg2.extras as cursors
+		cls = self._getStreamCursorClass(cursorClass, cursors.DictCursor)
+		return cls(self._connection, "dabo_stream_%d" % _streamCursorIds.next())
+
+
 	def escQuote(self, val):
 		# escape backslashes and single quotes, and
 		# wrap the result in single quotes
@@ -214,6 +240,16 @@ class Postgres(dBackend):
 		return
 
 
+	def getSchemaVersion(self):
+		"""A checksum of the definitions of the columns of the visible tables."""
+		return self._fetchSchemaVersion("SELECT count(*), md5(string_agg(c.relname"
+				" || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod),"
+				" ',' ORDER BY c.relname, a.attnum))"
+				" FROM pg_class c JOIN pg_attribute a ON a.attrelid = c.oid"
+				" WHERE c.relkind = 'r' AND a.attnum > 0 AND NOT a.attisdropped"
+				" AND pg_table_is_visible(c.oid)")
+
+
 	def flush(self, cursor):
 		"""
 		Postgres requires an explicit commit in order to have changes
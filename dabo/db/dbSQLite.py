@@ -13,6 +13,9 @@ from dabo.lib.utils import ustr
 
 class SQLite(dBackend):
 	"""Class providing SQLite connectivity. Uses sqlite3 or pysqlite2 package."""
+	# Pooled connections are checked out by one thread after another.
+	poolConnectionArgs = {"check_same_thread": False}
+
 	def __init__(self):
 		dBackend.__init__(self)
 		self.dbModuleName = "pysqlite2"
@@ -67,7 +70,8 @@ class SQLite(dBackend):
 			pth = pth.decode(dabo.fileSystemEncoding).encode("utf-8")
 
 		# Need to specify "isolation_level=None" to have transactions working correctly.
-		self._connection = self.dbapi.connect(pth, factory=DictConnection, isolation_level=None)
+		self._connection = self.dbapi.connect(pth, factory=DictConnection, isolation_level=None,
+				check_same_thread=kwargs.get("check_same_thread", True))
 
 		# Non-utf8-encoded bytestrings could be in the database, and Dabo will try various encodings
 		# to deal with it. So tell sqlite not to decode with utf-8, but to just return the bytes:
@@ -84,6 +88,16 @@ class SQLite(dBackend):
 		return self._dictCursorClass
 
 
+	def cancelQuery(self):
+		self._connection.interrupt()
+		return True
+
+
+	def isPrivateDatabase(self, connectInfo):
+		# Each connection to ':memory:' gets a new, empty database.
+		return connectInfo.Database == ":memory:"
+
+
 	def formatForQuery(self, val, fieldType=None):
 		if isinstance(val, bool):
 			return ustr(int(val))
@@ -213,10 +227,8 @@ class SQLite(dBackend):
 		descFlds = cursor.FieldDescription
 		# Get the field info for the table
 		auxCrs = cursor._getAuxCursor()
-		auxCrs.execute("pragma table_info('%s')" % cursor.Table)
-		rs = auxCrs._records
-
-		stdFlds = [ff["name"] for ff in rs]
+		stdFlds = set([fld[0] for fld in self.getSchemaInfo("fields", cursor.Table,
+				self.getFields, cursor.Table, auxCrs)])
 		# Get all the fields that are not in the table.
 		return [d[0] for d in descFlds
 				if d[0] not in stdFlds ]
@@ -237,6 +249,11 @@ class SQLite(dBackend):
 		pass
 
 
+	def getSchemaVersion(self):
+		"""SQLite counts the changes to the schema of the database file."""
+		return self._fetchSchemaVersion("pragma schema_version")
+
+
 	def createTableAndIndexes(self, tabledef, cursor, createTable=True,
 			createIndexes=True):
 		if not tabledef.Name:
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import os
+import tempfile
+import threading
 import unittest
 import dabo.db
+import dabo.dException as dException
 
 
 class Test_dConnectInfo(unittest.TestCase):
@@ -25,6 +29,88 @@ class Test_dConnectInfo(unittest.TestCase):
 			co = dabo.db.dConnection(DbType="SQLite", Db=":memory:")
 		self.assertRaises(Exception, anotherBogusParm)
 
+
+class Test_dConnectionPool(unittest.TestCase):
+	def setUp(self):
+		fd, self.dbFile = tempfile.mkstemp(suffix=".db")
+		os.close(fd)
+		self.pool = dabo.db.dConnectionPool({"DbType": "SQLite", "Database": self.dbFile},
+				MinSize=1, MaxSize=2, Timeout=0.2)
+
+	def tearDown(self):
+		self.pool.close()
+		os.remove(self.dbFile)
+
+	def inThread(self, func):
+		result = []
+		thrd = threading.Thread(target=lambda: result.append(func()))
+		thrd.start()
+		thrd.join()
+		return result[0]
+
+	def test_threadConnections(self):
+		pool = self.pool
+		self.assertEqual(pool.Stats["idle"], 1)
+		conn = pool.getConnection()
+		self.assertTrue(pool.getConnection() is conn)
+		self.assertTrue(pool.getThreadConnection() is conn)
+		other = self.inThread(pool.getConnection)
+		self.assertTrue(other is not conn)
+		# Both connections are taken: the one of the ended thread is reclaimed.
+		self.assertTrue(self.inThread(pool.getConnection) is other)
+		pool.release()
+		# Still checked out, as getConnection() was called twice.
+		self.assertEqual(pool.Stats["inUse"], 2)
+		pool.release()
+		stats = pool.Stats
+		self.assertEqual((stats["size"], stats["inUse"], stats["created"]), (2, 1, 2))
+		self.assertEqual(stats["reclaimed"], 1)
+		crs = conn.getDaboCursor()
+		crs.execute("select 1 as one")
+		self.assertEqual(crs.getFieldVal("one"), 1)
+
+	def test_reclaimRollsBack(self):
+		pool = self.pool
+		conn = pool.getConnection()
+		crs = conn.getDaboCursor()
+		crs.execute("create table test (val INT)")
+		def abandon():
+			other = pool.getConnection()
+			crs = other.getConnection().cursor()
+			crs.execute("begin")
+			crs.execute("insert into test values (1)")
+			return other
+		other = self.inThread(abandon)
+		self.assertTrue(self.inThread(pool.getConnection) is other)
+		# The ended thread's open transaction was rolled back.
+		crs.execute("select count(*) as cnt from test")
+		self.assertEqual(crs.getFieldVal("cnt"), 0)
+		crs.execute("insert into test values (2)")
+		conn.getConnection().commit()
+
+	def test_timeout(self):
+		pool = self.pool
+		held = threading.Event()
+		done = threading.Event()
+		def holdConnection():
+			with pool.connection():
+				held.set()
+				done.wait()
+		threads = [threading.Thread(target=holdConnection) for i in range(2)]
+		for thrd in threads:
+			thrd.start()
+			held.wait()
+			held.clear()
+		self.assertRaises(dException.ConnectionNotFoundException, pool.getConnection)
+		done.set()
+		for thrd in threads:
+			thrd.join()
+		self.assertTrue(pool.getConnection() is not None)
+		stats = pool.Stats
+		self.assertEqual((stats["timeouts"], stats["peakInUse"], stats["idle"]), (1, 2, 1))
+
+
 if __name__ == "__main__":
-	suite = unittest.TestLoader().loadTestsFromTestCase(Test_dConnectInfo)
+	suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(cls)
+			for cls in (Test_dConnectInfo, Test_dConnectionPool)])
 	unittest.TextTestRunner(verbosity=2).run(suite)
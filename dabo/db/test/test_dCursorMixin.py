@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import unittest
 import datetime
+import os
+import tempfile
 from decimal import Decimal
 import dabo.db
+from dabo.db.dBackend import dBackend
 from dabo.lib import getRandomUUID
 
 
@@ -210,6 +213,338 @@ insert into %s (cfield, ifield, nfield) values (NULL, NULL, NULL)
 		self.assertEqual(cur.Record.cfield, newVal)
 		self.assertRaises(dabo.dException.FieldNotFoundException, cur.oldVal, "bogusField")
 
+	def test_CompactRecords(self):
+		cur = self.cur
+		dictRecs = cur.getDataSet()
+		cur.CompactRecords = True
+		cur.requery()
+		self.assertIsInstance(cur._records[0], dabo.db.dCompactRecord)
+		self.assertEqual(len(cur._records.execute("select * from dataset where ifield > 30")), 2)
+		self.assertEqual(cur.getDataSet(), dictRecs)
+		self.assertEqual(cur.getFieldVal("cfield", 1), "Edward Leafe")
+		cur.RowNumber = 1
+		cur.setFieldVal("cfield", "Ed Leafe")
+		self.assertTrue(cur.isChanged())
+		self.assertEqual(cur.oldVal("cfield"), "Edward Leafe")
+		cur.save()
+		cur.requery()
+		self.assertEqual(cur.getFieldVal("cfield", 1), "Ed Leafe")
+		cur.sort("cfield")
+		self.assertEqual([rec["pk"] for rec in cur._records], [3, 2, 1])
+		self.assertEqual(len(cur._records.filter("ifield", 42)), 1)
+		cur.new()
+		cur.genTempAutoPK()
+		cur.setNewFlag()
+		cur.setFieldVal("cfield", "Carl")
+		cur.cancel()
+		self.assertEqual(cur.RowCount, 3)
+		rec = cur._records[0].copy()
+		self.assertEqual(rec, cur._records[0])
+		del rec["cfield"]
+		self.assertFalse("cfield" in rec)
+		self.assertRaises(KeyError, rec.__getitem__, "cfield")
+		self.assertEqual(cur._records[0]["cfield"], "Carl Karsten")
+
+	def test_requeryStream(self):
+		cur = self.cur
+		cur.RowNumber = 1
+		cur.setFieldVal("cfield", "Ed Leafe")
+		recs = list(cur.requeryStream(batchSize=2))
+		self.assertEqual(len(recs), 3)
+		self.assertEqual(recs[1]["cfield"], "Edward Leafe")
+		self.assertIsInstance(recs[2]["nfield"], Decimal)
+		# The cursor's own data isn't touched.
+		self.assertEqual(cur.RowCount, 3)
+		self.assertEqual(cur.Record.cfield, "Ed Leafe")
+		sql = "select * from %s where ifield > 30" % self.temp_table_name
+		self.assertEqual([rec["pk"] for rec in cur.executeStream(sql)], [2, 3])
+
+	def test_batchSave(self):
+		cur = self.cur
+		for row, val in ((0, "Paul"), (1, "Ed"), (2, "Carl")):
+			cur.setFieldVal("cfield", val, row)
+		cur.setFieldVal("ifield", 7, 2)
+		cur.AutoPopulatePK = False
+		for pk in (10, 11):
+			cur.new()
+			cur.genTempAutoPK()
+			cur.setNewFlag()
+			cur.setFieldVal("pk", pk)
+			cur.setFieldVal("cfield", "New %s" % pk)
+		executeMany = cur.AuxCursor.executeMany
+		batchSizes = []
+		def countingExecuteMany(sql, paramSeq, *args, **kwargs):
+			paramSeq = list(paramSeq)
+			batchSizes.append(len(paramSeq))
+			return executeMany(sql, paramSeq, *args, **kwargs)
+		cur.AuxCursor.executeMany = countingExecuteMany
+		cur.save(allRows=True)
+		self.assertEqual(batchSizes, [2, 2])
+		self.assertFalse(cur.isChanged())
+		cur.requery()
+		self.assertEqual([(rec["pk"], rec["cfield"], rec["ifield"]) for rec in cur._records],
+				[(1, "Paul", 23), (2, "Ed", 42), (3, "Carl", 7), (10, "New 10", 0),
+				(11, "New 11", 0)])
+
+	def test_batchSaveRowCount(self):
+		cur = self.cur
+		for row, val in ((0, "Paul"), (1, "Ed"), (2, "Carl")):
+			cur.setFieldVal("cfield", val, row)
+		# Another user deletes one of the rows.
+		cur.AuxCursor.execute("delete from %s where pk = 2" % self.temp_table_name)
+		aux = cur.AuxCursor
+		executeMany = aux.executeMany
+		def executeManyRowCount(sql, paramSeq, *args, **kwargs):
+			# Like backends that return the number of rows that were changed.
+			executeMany(sql, paramSeq, *args, **kwargs)
+			return aux.rowcount
+		aux.executeMany = executeManyRowCount
+		backend = cur.BackendObject
+		backend.noResultsOnSave = lambda: dBackend.noResultsOnSave(backend)
+		try:
+			self.assertRaises(dabo.dException.dException, cur.save, allRows=True)
+		finally:
+			del backend.noResultsOnSave
+		self.assertEqual(cur.getChangedRows(), [0, 1, 2])
+
+	def test_fieldMetadata(self):
+		cur = self.cur
+		meta = cur._getFieldMetadata()
+		self.assertTrue(meta is cur._getFieldMetadata())
+		self.assertEqual(meta.Fields, ("pk", "cfield", "ifield", "nfield", "ffield"))
+		self.assertEqual(meta.FieldTypes["cfield"], "C")
+		self.assertEqual(meta.PythonTypes["nfield"], Decimal)
+		self.assertEqual(meta.TableFields, frozenset(meta.Fields))
+		self.assertRaises(AttributeError, setattr, meta, "_table", "foo")
+		# Changing the structure or the quoting of names replaces the lookups.
+		cur.AutoQuoteNames = not cur.AutoQuoteNames
+		self.assertFalse(cur._getFieldMetadata() is meta)
+		ds = list(cur.DataStructure)
+		ds.append(("calc", "I", False, "_foreign_table_", "calc", None))
+		cur.DataStructure = ds
+		meta = cur._getFieldMetadata()
+		self.assertEqual(meta.NonUpdateFields, frozenset(["calc"]))
+		self.assertRaises(dabo.dException.dException, cur.sort, "bogus")
+
+	def test_filterByExpression(self):
+		cur = self.cur
+		cur.filterByExpression("ifield > 30 and cfield.startswith('Carl')")
+		self.assertEqual([rec["pk"] for rec in cur._records], [3])
+		cur.removeFilter()
+		# Field names inside string literals are left alone.
+		cur.filterByExpression("cfield != 'cfield'")
+		self.assertEqual(cur.RowCount, 3)
+		cur.removeFilter()
+		# Several expressions are fused into one filter level.
+		cur.filterByExpression(("ifield > 30", "cfield.endswith('Leafe')"))
+		self.assertEqual([rec["pk"] for rec in cur._records], [2])
+		cur.removeFilter()
+		self.assertEqual(cur.RowCount, 3)
+		for expr in ("__import__('os')", "cfield.__class__", "[x for x in cfield]",
+				"pk ==", "cur.Table"):
+			self.assertRaises(dabo.dException.QueryException,
+					cur.filterByExpression, expr)
+		cur.replace("ifield", "=ifield * 2", scope="pk > 1")
+		self.assertEqual([rec["ifield"] for rec in cur._records], [23, 84, 20446])
+		cur.replace("cfield", "ifield")
+		self.assertEqual(cur.getFieldVal("cfield", 0), "ifield")
+
+	def test_dataSetExecute(self):
+		cur = self.cur
+		ds = cur._records
+		ds.addIndexHint("ifield")
+		sql = "select pk, ifield from dataset where ifield > 30 order by pk"
+		self.assertEqual([rec["pk"] for rec in ds.execute(sql)], [2, 3])
+		self.assertEqual(len(ds.execute("select name from sqlite_master where type = 'index'")), 1)
+		# Changes made through the cursor are copied to the SQLite table.
+		cur.setFieldVal("ifield", 99, 0)
+		self.assertEqual([rec["pk"] for rec in ds.execute(sql)], [1, 2, 3])
+		cur.cancel()
+		self.assertEqual([rec["pk"] for rec in ds.execute(sql)], [2, 3])
+		# ...including those made through a filtered data set.
+		cur.filter("pk", 1)
+		cur.setFieldVal("ifield", 77)
+		cur.removeFilter()
+		self.assertTrue(cur._records is ds)
+		self.assertEqual([rec["ifield"] for rec in ds.execute(sql)], [77, 42, 10223])
+		# DML statements only change the table, which is then reloaded.
+		self.assertEqual(len(ds.execute("delete from dataset where pk = 1")), 2)
+		self.assertEqual(len(ds.execute(sql)), 3)
+		# Records with the cursor's internal flags can be queried, too.
+		cur.new()
+		cur.genTempAutoPK()
+		cur.setNewFlag()
+		self.assertEqual(len(cur._records.execute("select * from dataset")), 4)
+
+	def test_schemaCache(self):
+		cur = self.cur
+		backend = cur.BackendObject
+		tableName = self.temp_table_name
+		self.assertTrue(("fields", tableName) in backend._schemaCache)
+		calls = []
+		getFields = backend.getFields
+		def countingGetFields(table, crs):
+			calls.append(table)
+			return getFields(table, crs)
+		backend.getFields = countingGetFields
+		# A new query on the same table gets the table information from the cache.
+		cur.UserSQL = "select pk, cfield from %s" % tableName
+		cur.requery()
+		self.assertEqual(cur.getNonUpdateFields(), [])
+		self.assertEqual(calls, [])
+		# DDL statements clear the cache.
+		cur.execute("create table other_%s (pk INTEGER PRIMARY KEY)" % tableName)
+		self.assertEqual(backend._schemaCache, {})
+		self.assertEqual(len(cur.getFields()), 5)
+		self.assertEqual(calls, [tableName])
+		# The cache can be kept in a file between sessions.
+		fd, pth = tempfile.mkstemp()
+		os.close(fd)
+		os.remove(pth)
+		try:
+			backend.SchemaCacheFile = pth
+			# The file is only written when the cache is flushed.
+			cur.UserSQL = "select * from other_%s" % tableName
+			cur.requery()
+			self.assertFalse(os.path.exists(pth))
+			backend.flushSchemaCache()
+			self.assertTrue(os.path.exists(pth))
+			mtime = int(os.path.getmtime(pth)) - 10
+			os.utime(pth, (mtime, mtime))
+			backend.flushSchemaCache()
+			self.assertEqual(os.path.getmtime(pth), mtime)
+			# A connection to a database with the same schema reads it.
+			otherConn = dabo.db.dConnection(DbType="SQLite", Database=":memory:")
+			other = otherConn.getBackendObject()
+			for table in (tableName, "other_%s" % tableName):
+				otherConn.getConnection().execute("create table %s (pk INTEGER PRIMARY KEY)"
+						% table)
+			other.SchemaCacheFile = pth
+			self.assertEqual(other._schemaCache, backend._schemaCache)
+			otherConn.close()
+			# Once the schema has changed, the file is out of date.
+			otherConn = dabo.db.dConnection(DbType="SQLite", Database=":memory:")
+			other = otherConn.getBackendObject()
+			for table in (tableName, "other_%s" % tableName, "third_%s" % tableName):
+				otherConn.getConnection().execute("create table %s (pk INTEGER PRIMARY KEY)"
+						% table)
+			other.SchemaCacheFile = pth
+			self.assertEqual(other._schemaCache, {})
+			otherConn.close()
+		finally:
+			os.remove(pth)
+
+	def test_pkLookups(self):
+		cur = self.cur
+		self.assertTrue(cur.hasPK(2))
+		self.assertFalse(cur.hasPK(99))
+		self.assertEqual(cur._getRowByPk(3), 2)
+		self.assertRaises(dabo.dException.RowNotFoundException, cur._getRowByPk, 99)
+		# The index has to follow sorts, new records, deletions and key changes.
+		cur.sort("cfield")
+		self.assertEqual(cur._getRowByPk(3), 0)
+		cur.moveToPK(1)
+		self.assertEqual(cur.Record.pk, 1)
+		cur.new()
+		cur.genTempAutoPK()
+		cur.setNewFlag()
+		self.assertEqual(cur._getRowByPk(-1), 3)
+		cur.setFieldVal("pk", 42)
+		self.assertFalse(cur.hasPK(-1))
+		self.assertEqual(cur._getRowByPk(42), 3)
+		cur.moveToPK(3)
+		cur.delete()
+		self.assertFalse(cur.hasPK(3))
+		self.assertEqual(cur._getRowByPk(42), 2)
+		self.assertEqual(cur.seek(2, "pk"), cur._getRowByPk(2))
+
+	def test_seekIndex(self):
+		cur = self.cur
+		queries = [("Edward Leafe", "cfield", True, False, False),
+				("edward leafe", "cfield", False, False, False),
+				("carl", "cfield", False, True, True),
+				("Dave", "cfield", True, True, False),
+				("Zed", "cfield", True, True, True),
+				(42, "ifield", True, False, False),
+				(100, "ifield", True, True, False),
+				(100, "ifield", True, True, True),
+				(99999, "ifield", True, True, False),
+				(7, "ifield", True, False, False)]
+		def seekAll():
+			return [cur.seek(val, fld, caseSensitive=cs, near=near,
+					incremental=inc, movePointer=False)
+					for val, fld, cs, near, inc in queries]
+		unindexed = seekAll()
+		cur.addIndex("cfield")
+		cur.addIndex("ifield")
+		self.assertEqual(seekAll(), unindexed)
+		self.assertTrue(cur.locate("paul keith mcnett", "cfield", caseSensitive=False))
+		self.assertEqual(cur.RowNumber, 0)
+		# The indexes have to follow field changes, sorts and new records.
+		cur.RowNumber = 1
+		cur.setFieldVal("cfield", "Zed")
+		self.assertEqual(cur.seek("Zed", "cfield", movePointer=False), 1)
+		self.assertEqual(cur.seek("Edward Leafe", "cfield", movePointer=False), -1)
+		cur.sort("ifield", "DESC")
+		self.assertEqual(cur.seek(23, "ifield", movePointer=False), 2)
+		cur.new()
+		cur.setFieldVal("ifield", 5)
+		self.assertEqual(cur.seek(5, "ifield", movePointer=False), 3)
+		indexed = seekAll()
+		cur.removeIndex("cfield")
+		cur.removeIndex("ifield")
+		self.assertEqual(seekAll(), indexed)
+
+	def test_sort(self):
+		cur = self.cur
+		cur.sort("cfield")
+		self.assertEqual([rec["pk"] for rec in cur._records], [3, 2, 1])
+		cur.sort("ifield", "DESC")
+		self.assertEqual([rec["pk"] for rec in cur._records], [3, 2, 1])
+		cur.new()
+		cur.genTempAutoPK()
+		cur.setNewFlag()
+		# Clearing the sort restores the original order, with new rows last.
+		cur.sort("ifield", "cycle")
+		self.assertEqual([rec["pk"] for rec in cur._records], [1, 2, 3, -1])
+		self.assertEqual(cur.Record.pk, -1)
+
+	def test_sort_multiColumn(self):
+		cur = self.cur
+		cur.setFieldVal("ifield", 42, row=2)
+		cur.sort(("ifield", "cfield"))
+		self.assertEqual([rec["pk"] for rec in cur._records], [1, 3, 2])
+		self.assertEqual(cur.sortColumn, ("ifield", "cfield"))
+		cur.sort("ifield, cfield", ("DESC", "DESC"))
+		self.assertEqual([rec["pk"] for rec in cur._records], [2, 3, 1])
+		cur.sort(["ifield", "cfield"], ["DESC", "ASC"])
+		self.assertEqual([rec["pk"] for rec in cur._records], [3, 2, 1])
+		self.assertRaises(dabo.dException.dException, cur.sort, ("ifield", "cfield"), ("ASC",))
+
+	def test_sort_cycleAfterMultiColumn(self):
+		cur = self.cur
+		cur.sort(("ifield", "cfield"), ("ASC", "DESC"))
+		# Cycling carries on from the first column of the multi-column sort.
+		cur.sort("ifield", "CYCLE")
+		self.assertEqual(cur.sortColumn, "ifield")
+		self.assertEqual(cur.sortOrder, "DESC")
+		self.assertEqual([rec["pk"] for rec in cur._records], [3, 2, 1])
+		cur.sort(("ifield", "cfield"), "DESC")
+		cur.sort("ifield", "CYCLE")
+		self.assertEqual(cur.sortOrder, "")
+		self.assertEqual([rec["pk"] for rec in cur._records], [1, 2, 3])
+
+	def test_pkLookups_compoundKey(self):
+		cur = self.cur
+		cur.KeyField = "pk, ifield"
+		self.assertTrue(cur.hasPK((2, 42)))
+		self.assertFalse(cur.hasPK((2, 23)))
+		cur.moveToPK((3, 10223))
+		self.assertEqual(cur.RowNumber, 2)
+		cur.setFieldVal("ifield", 24, row=0)
+		self.assertTrue(cur.hasPK((1, 24)))
+		self.assertFalse(cur.hasPK((1, 23)))
+
 	## - End method unit tests -
 
 	def testMementos(self):
@@ -7,10 +7,13 @@ later on to support other UI toolkits.
 from datetime import datetime
 import time
 import os
+import sys
 import re
 import random
 import codecs
 import tempfile
+import hashlib
+import marshal
 import dabo
 dabo.ui.loadUI("wx")
 from dabo.dLocalize import _
@@ -23,6 +26,8 @@ from dabo.lib.utils import ustr
 # Doesn't matter what platform we're on; Python needs
 # newlines in its compiled code.
 LINESEP = "\n"
+# Change this when the generated code changes, to invalidate cached classes.
+CACHE_FORMAT = 1
 
 
 class DesignerClassConverter(dObject):
@@ -63,13 +68,27 @@ class DesignerClassConverter(dObject):
 		self._srcFile = None
 		# Encoding to be used
 		self._encoding = dabo.getEncoding()
+		# Content hashes of the files read to create the class, keyed on path.
+		self._dependencies = {}
 
 
 	def classFromText(self, src):
 		"""Given a text file, returns a class object that that file
 		represents. You can pass the text as either a file path,
 		a file object, or raw XML/JSON text.
+
+		If the cdxmlCacheDirectory setting is turned on, the generated class
+		code is cached on disk along with the content hashes of all the files
+		it was created from, and reused until any of them change.
 		"""
+		self._dependencies = {}
+		cacheKey = self._getCacheKey(src)
+		if cacheKey is not None:
+			cls = self._classFromCache(cacheKey)
+			if cls is not None:
+				return cls
+			# Create the class from the resolved file that was hashed.
+			src = self._cacheSource
 		dct = self.dictFromStoredText(src)
 		# Traverse the dct, looking for superclass information
 		super = self.flattenClassDict(dct)
@@ -82,7 +101,15 @@ class DesignerClassConverter(dObject):
 		self.classText += "\n"
 		if isinstance(self.classText, unicode):
 			self.classText = self.classText.encode(self._encoding)
-		open(self._classFileName, "w").write(self.classText)
+		if cacheKey is not None:
+			# The cached copy of the text is what the code refers to.
+			classFileName = self._writeCacheFile(cacheKey, ".py", self.classText)
+		else:
+			classFileName = None
+		if classFileName is None:
+			cacheKey = None
+			classFileName = self._classFileName
+			open(classFileName, "w").write(self.classText)
 
 		## For debugging. This creates a copy of the generated code
 		## so that you can help determine any problems.
@@ -94,12 +121,124 @@ class DesignerClassConverter(dObject):
 		# jfcs added self._codeFileName to below
 		# egl - created a tmp file for the main class code that we can use
 		#   for compiling. This allows for full Python introspection.
-		compClass = compile(self.classText, self._classFileName, "exec")
+		compClass = compile(self.classText, classFileName, "exec")
+		if cacheKey is not None:
+			self._writeCacheFile(cacheKey, ".cache", marshal.dumps((CACHE_FORMAT,
+					self._dependencies, self.mainClassName, compClass)))
 		nmSpace = {}
 		exec compClass in nmSpace
 		return nmSpace[self.mainClassName]
 
 
+	@staticmethod
+	def getCacheDirectory():
+		"""Return the directory for cached classes, or None if caching is off."""
+		cacheDir = getattr(dabo, "cdxmlCacheDirectory", False)
+		if not cacheDir:
+			return None
+		if cacheDir is True:
+			userDir = utils.getUserAppDataDirectory()
+			if userDir is None:
+				return None
+			cacheDir = os.path.join(userDir, "classcache")
+		if not os.path.isdir(cacheDir):
+			try:
+				os.makedirs(cacheDir)
+			except OSError:
+				return None
+		return cacheDir
+
+
+	def _getCacheKey(self, src):
+		"""Return the key for the cached class for 'src', or None if it can't
+		be cached. File objects aren't cached, since their content can't be
+		hashed without consuming it.
+		"""
+		if not isinstance(src, basestring) or self.getCacheDirectory() is None:
+			return None
+		srcPath = None
+		text = src
+		if not src.lstrip().startswith("<"):
+			pth = utils.resolvePathAndUpdate(src)
+			if os.path.exists(pth):
+				src = pth
+				srcPath = os.path.abspath(pth)
+				try:
+					text = open(srcPath, "rb").read()
+				except IOError:
+					return None
+		if isinstance(text, unicode):
+			text = text.encode("utf-8")
+		self._cacheSource = src
+		# Relative paths in the class are resolved against the source file
+		# or the current directory, so the generated code depends on them.
+		keyInfo = repr((CACHE_FORMAT, sys.version, dabo.__version__, self._encoding,
+				self.CreateDesignerControls, srcPath, os.getcwd()))
+		return hashlib.sha1(keyInfo + text).hexdigest()
+
+
+	def _classFromCache(self, cacheKey):
+		"""Return the cached class for the key, or None if it isn't cached or
+		any of the files it was created from have changed.
+		"""
+		cachePath = os.path.join(self.getCacheDirectory(), cacheKey)
+		try:
+			data = open(cachePath + ".cache", "rb").read()
+			fmt, dependencies, clsName, compClass = marshal.loads(data)
+		except (IOError, EOFError, ValueError, TypeError):
+			return None
+		if fmt != CACHE_FORMAT:
+			return None
+		for pth, contentHash in dependencies.items():
+			if self._hashFile(pth) != contentHash:
+				return None
+		if not os.path.exists(cachePath + ".py"):
+			# The code can't be introspected without its source.
+			return None
+		self._dependencies = dependencies
+		self.mainClassName = clsName
+		nmSpace = {}
+		exec compClass in nmSpace
+		return nmSpace[clsName]
+
+
+	def _writeCacheFile(self, cacheKey, ext, data):
+		"""Write the data to the cache file with the given extension, and
+		return its path, or None if it couldn't be written.
+		"""
+		cacheDir = self.getCacheDirectory()
+		if cacheDir is None:
+			return None
+		pth = os.path.join(cacheDir, cacheKey + ext)
+		try:
+			# Write to a temp file first, so that a partly-written file is never read.
+			fd, tmpPath = tempfile.mkstemp(dir=cacheDir)
+			os.write(fd, data)
+			os.close(fd)
+			if os.path.exists(pth):
+				os.remove(pth)
+			os.rename(tmpPath, pth)
+		except (IOError, OSError), e:
+			dabo.log.info(_("Could not write class cache file '%(pth)s': %(e)s") % locals())
+			return None
+		return pth
+
+
+	@staticmethod
+	def _hashFile(pth):
+		"""Return the content hash of the file, or None if it doesn't exist."""
+		try:
+			return hashlib.sha1(open(pth, "rb").read()).hexdigest()
+		except IOError:
+			return None
+
+
+	def _addDependency(self, pth):
+		"""Record a file that the generated class depends on."""
+		if pth and pth not in self._dependencies:
+			self._dependencies[pth] = self._hashFile(pth)
+
+
 	def dictFromStoredText(self, src):
 		"""Takes either a path to a text file, an open file containing the text,
 		or the raw text itself. Determines the format of the stored text, and
@@ -122,6 +261,7 @@ class DesignerClassConverter(dObject):
 			encoding = self._encoding
 		# Get the associated code file, if any
 		codePth = "%s-code.py" % os.path.splitext(pth)[0]
+		self._addDependency(codePth)
 		if os.path.exists(codePth):
 			try:
 				codeContent = codecs.open(codePth, "r", encoding).read()
@@ -145,6 +285,7 @@ class DesignerClassConverter(dObject):
 		except AttributeError:
 			if os.path.exists(src):
 				self._srcFile = src = utils.resolvePathAndUpdate(src)
+				self._addDependency(src)
 				jsonText = file(src).read()
 			else:
 				# It must be raw json
@@ -168,6 +309,7 @@ class DesignerClassConverter(dObject):
 				xml = src = utils.resolvePathAndUpdate(src)
 			if os.path.exists(src):
 				self._srcFile = src
+				self._addDependency(src)
 			else:
 				parseCode = False
 				self._srcFile = os.getcwd()
@@ -218,6 +360,10 @@ class DesignerClassConverter(dObject):
 		classFile = utils.resolvePath(atts.get("designerClass", ""))
 		superclass = utils.resolvePath(atts.get("superclass", ""))
 		superclassID = atts.get("superclassID", "")
+		if superclassID:
+			self._addDependency(superclass)
+		if classID:
+			self._addDependency(classFile)
 		if superclassID and os.path.exists(superclass):
 			# Get the superclass info
 			superCD = self.dictFromStoredText(superclass)
@@ -779,6 +925,7 @@ class DesignerClassConverter(dObject):
 		conv = DesignerClassConverter()
 		xmlDict = conv.importXmlSrc(pth)
 		conv.createClassText(xmlDict, addImports=False, specList=specList)
+		self._dependencies.update(conv._dependencies)
 		self.innerClassText += conv.classText + (2 * LINESEP)
 		self.innerClassNames.append(conv.mainClassName)
 		return conv.mainClassName
@@ -1074,3 +1221,34 @@ def getControlClass(base):
 		sizerDict[currParent] = []
 		currSizer = pg.Sizer
 """
+
+
+
+if __name__ == "__main__":
+	# Time creating the classes for the cdxml files passed on the command line
+	# (default: the ones in the ide and demo directories), without and with
+	# the class cache.
+	import glob
+	srcFiles = sys.argv[1:]
+	if not srcFiles:
+		baseDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+		for subDir in ("ide", "demo"):
+			srcFiles += glob.glob(os.path.join(baseDir, subDir, "*.cdxml"))
+	app = dabo.dApp()
+	reps = 20
+	cacheDir = tempfile.mkdtemp()
+	for cacheSetting in (False, cacheDir):
+		dabo.cdxmlCacheDirectory = cacheSetting
+		for srcFile in srcFiles:
+			# Change to the file's directory, as the ide and demo apps do.
+			os.chdir(os.path.dirname(os.path.abspath(srcFile)))
+			# The first call fills the cache.
+			DesignerClassConverter().classFromText(srcFile)
+			start = time.time()
+			for rep in xrange(reps):
+				DesignerClassConverter().classFromText(srcFile)
+			print "%s, cache %s: %.1f ms per class" % (os.path.basename(srcFile),
+					("on" if cacheSetting else "off"), (time.time() - start) * 1000.0 / reps)
+	for pth in glob.glob(os.path.join(cacheDir, "*")):
+		os.remove(pth)
+	os.rmdir(cacheDir)
@@ -7,6 +7,7 @@ import sys
 import os
 import re
 import pickle
+import threading
 from os.path import join as pathjoin
 from zipfile import ZipFile
 from cStringIO import StringIO
@@ -18,6 +19,10 @@ from dabo.dObject import dObject
 from dabo.dLocalize import _
 from dabo.lib.utils import ustr
 from dabo.lib.manifest import Manifest
+from dabo.db.dDataSet import dDataSet
+from dabo.lib import dataCodec
+from dabo.lib.lruCache import LRUCache
+from dabo.lib.httpSession import HttpSession
 jsonEncode = dabo.lib.jsonEncode
 jsonDecode = dabo.lib.jsonDecode
 
@@ -27,11 +32,19 @@ class RemoteConnector(object):
 	"""This class handles all of the methods that will need to be carried out on
 	the server instead of locally.
 	"""
+	# The HttpSessions shared by the connectors, keyed on the host and credentials.
+	_sessions = {}
+	_sessionLock = threading.Lock()
+
 	def __init__(self, obj):
 		self.obj = obj
 		self._baseURL = None
 		self._authHandler = None
 		self._urlOpener = None
+		self._binaryProtocol = None
+		# Set once the server has answered in the binary format.
+		self._serverUsesBinary = False
+		self._dataCache = LRUCache(10)
 		appDir = dabo.lib.utils.getUserAppDataDirectory()
 		self._dataDir = pathjoin(appDir, "webapps")
 
@@ -69,7 +82,41 @@ class RemoteConnector(object):
 		return ret
 
 
+	def _openBinary(self, url, body, method):
+		"""
+		Send 'body', which is already encoded with dataCodec, and ask for the
+		response in the same format. The method is passed in the URL, as the
+		body isn't url-encoded.
+		"""
+		url = "%s?%s" % (url, urllib.urlencode({"_method": method}))
+		req = urllib2.Request(url, data=body,
+				headers={"Content-Type": dataCodec.CONTENT_TYPE, "Accept": dataCodec.CONTENT_TYPE})
+		return self.UrlOpener.open(req, idempotent=(method == "GET"))
+
+
+	def _readResponse(self, res):
+		"""Read the body of a response, noting whether it is in the binary format."""
+		ret = res.read()
+		contentType = res.info().getheader("Content-Type") or ""
+		if contentType.startswith(dataCodec.CONTENT_TYPE) or dataCodec.isEncoded(ret):
+			self._serverUsesBinary = True
+		return ret
+
+
+	def _useBinary(self):
+		"""Return True if changes are sent to the server in the binary format."""
+		if self._binaryProtocol is None:
+			return self._serverUsesBinary
+		return self._binaryProtocol
+
+
 	def _storeEncodedDataSet(self, enc):
+		if dataCodec.isEncoded(enc):
+			data, typs, stru = dataCodec.decodeDataSet(enc)
+			self.obj._storeData(data, typs, stru)
+			return
+		# Servers that don't know the binary format send the values pickled
+		# in a JSON list.
 		pdata, ptyps, pstru = jsonDecode(enc)
 		# The values are pickled, so we need to unpickle them first
 		def safeLoad(val):
@@ -92,6 +139,36 @@ class RemoteConnector(object):
 
 
 	def requery(self):
+		req, cacheKey, cached = self._getRequeryRequest()
+		try:
+			res = self.UrlOpener.open(req)
+		except urllib2.HTTPError, e:
+			res = e
+		self._storeRequeryResponse(res, cacheKey, cached)
+
+
+	@classmethod
+	def requeryMany(cls, connectors):
+		"""
+		Requery the bizobjs of several connectors, such as the children of a
+		bizobj, with the requests sent to the server in parallel.
+		"""
+		if len(connectors) < 2:
+			for conn in connectors:
+				conn.requery()
+			return
+		reqs = [conn._getRequeryRequest() for conn in connectors]
+		results = connectors[0].UrlOpener.openMany([req[0] for req in reqs])
+		for conn, (req, cacheKey, cached), res in zip(connectors, reqs, results):
+			if isinstance(res, urllib2.HTTPError) or not isinstance(res, Exception):
+				conn._storeRequeryResponse(res, cacheKey, cached)
+			else:
+				# Let requery() handle the network error.
+				conn.requery()
+
+
+	def _getRequeryRequest(self):
+		"""Return the request for the bizobj's data, with its DataCache key and entry."""
 		biz = self.obj
 		biz.setChildLinkFilter()
 		url = self._getFullUrl("requery")
@@ -103,23 +180,65 @@ class RemoteConnector(object):
 		sqlparams = ustr(biz.getParams())
 		params = {"SQL": sql, "SQLParams": sqlparams, "KeyField": biz.KeyField, "_method": "GET"}
 		prm = urllib.urlencode(params)
-		try:
-			res = self.UrlOpener.open(url, data=prm)
-		except urllib2.HTTPError, e:
-			print "ERR", e
+		headers = {"Accept": dataCodec.CONTENT_TYPE}
+		# If we have a version of the data for this query, the server only
+		# needs to send what changed since then.
+		cacheKey = (sql, sqlparams)
+		cached = self.DataCache.get(cacheKey)
+		if cached:
+			headers["If-None-Match"] = '"%s"' % cached[0]
+		return urllib2.Request(url, data=prm, headers=headers), cacheKey, cached
+
+
+	def _storeRequeryResponse(self, res, cacheKey, cached):
+		"""Store the data from the response to a requery request."""
+		if isinstance(res, urllib2.HTTPError):
+			if res.code == 304 and cached:
+				self._storeCachedData(cached)
+				return
+			print "ERR", res
 			return
-		encdata = res.read()
-		self._storeEncodedDataSet(encdata)
+		encdata = self._readResponse(res)
+		version = (res.info().getheader("ETag") or "").strip('"')
+		if dataCodec.isDelta(encdata):
+			try:
+				data, version, typs, stru = dataCodec.applyDataDelta(cached[1], encdata,
+						self.obj.KeyField, cached[0])
+			except (TypeError, ValueError), e:
+				dabo.log.error(_("Invalid data delta from the server: %s") % e)
+				if cached:
+					# Get the full data set instead.
+					del self.DataCache[cacheKey]
+					self.requery()
+				return
+		elif dataCodec.isEncoded(encdata):
+			data, typs, stru = dataCodec.decodeDataSet(encdata)
+		else:
+			self._storeEncodedDataSet(encdata)
+			return
+		cached = (version, data, typs, stru)
+		if version:
+			self.DataCache[cacheKey] = cached
+		self._storeCachedData(cached)
+
+
+	def _storeCachedData(self, cached):
+		"""Give the bizobj a copy of a data set from the DataCache."""
+		version, data, typs, stru = cached
+		self.obj._storeData(dDataSet([rec.copy() for rec in data]), dict(typs or {}), stru)
 
 
 	def save(self, startTransaction=False, allRows=False):
 		biz = self.obj
 		url = self._getFullUrl("save")
 		chgDict = biz.getDataDiff(allRows=allRows)
-		params = {"DataDiff": jsonEncode(chgDict), "_method": "POST"}
-		prm = urllib.urlencode(params)
 		try:
-			res = self.UrlOpener.open(url, data=prm)
+			if self._useBinary():
+				res = self._openBinary(url, dataCodec.encodeValue(chgDict), "POST")
+			else:
+				params = {"DataDiff": jsonEncode(chgDict), "_method": "POST"}
+				prm = urllib.urlencode(params)
+				res = self.UrlOpener.open(url, data=prm, idempotent=False)
 		except urllib2.HTTPError, e:
 			# There was a problem on the server side. Re-raise the appropriate
 			# exception so that the UI can handle it.
@@ -149,8 +268,9 @@ class RemoteConnector(object):
 		url = self._getFullUrl("delete")
 		params = {"PK": biz.getPK(), "KeyField": biz.KeyField, "_method": "DELETE"}
 		prm = urllib.urlencode(params)
-		res = self.UrlOpener.open(url, data=prm)
-		encdata = res.read()
+		req = urllib2.Request(url, data=prm, headers={"Accept": dataCodec.CONTENT_TYPE})
+		res = self.UrlOpener.open(req, idempotent=False)
+		encdata = self._readResponse(res)
 		self._storeEncodedDataSet(encdata)
 
 
@@ -159,8 +279,9 @@ class RemoteConnector(object):
 		url = self._getFullUrl("deleteAll")
 		params = {"KeyField": biz.KeyField, "_method": "DELETE"}
 		prm = urllib.urlencode(params)
-		res = self.UrlOpener.open(url, data=prm)
-		encdata = res.read()
+		req = urllib2.Request(url, data=prm, headers={"Accept": dataCodec.CONTENT_TYPE})
+		res = self.UrlOpener.open(req, idempotent=False)
+		encdata = self._readResponse(res)
 		self._storeEncodedDataSet(encdata)
 
 
@@ -341,10 +462,30 @@ class RemoteConnector(object):
 		return flds
 
 
+	def _getBinaryProtocol(self):
+		return self._binaryProtocol
+
+	def _setBinaryProtocol(self, val):
+		if val is not None:
+			val = bool(val)
+		self._binaryProtocol = val
+
+
 	def _getConnection(self):
 		return self.obj._getConnection()
 
 
+	def _getDataCache(self):
+		return self._dataCache
+
+
+	def _getDataCacheSize(self):
+		return self._dataCache.MaxSize
+
+	def _setDataCacheSize(self, val):
+		self._dataCache.MaxSize = val
+
+
 	def _getPassword(self):
 		try:
 			ci = self.Connection.ConnectInfo
@@ -379,10 +520,20 @@ class RemoteConnector(object):
 
 	def _getUrlOpener(self):
 		if self._urlOpener is None:
-			# Create an OpenerDirector with support for HTTP Digest Authentication...
-			auth_handler = urllib2.HTTPDigestAuthHandler()
-			auth_handler.add_password(None, self.RemoteHost, self.UserName, self.Password)
-			self._urlOpener = urllib2.build_opener(auth_handler)
+			# All the connectors for the same server and user share a session,
+			# and with it the open connections and the authentication.
+			key = (self.RemoteHost, self.UserName, self.Password)
+			lock = self._sessionLock
+			lock.acquire()
+			try:
+				session = self._sessions.get(key)
+				if session is None:
+					session = self._sessions[key] = HttpSession(self.UserName, self.Password)
+					session.Timeout = dabo.remoteTimeout
+					session.Retries = dabo.remoteRetries
+			finally:
+				lock.release()
+			self._urlOpener = session
 		return self._urlOpener
 
 
@@ -393,9 +544,26 @@ class RemoteConnector(object):
 			return ""
 
 
+	BinaryProtocol = property(_getBinaryProtocol, _setBinaryProtocol, None,
+			_("""When True, changes are sent to the server in the compact binary
+			format of dabo.lib.dataCodec instead of as url-encoded JSON; when False,
+			they are always sent as JSON. When None (default), they are sent in the
+			binary format once the server has answered in it, since servers that
+			don't know the format only send JSON. Data sent by the server is read
+			in either format.  (bool or None)"""))
+
 	Connection = property(_getConnection, None, None,
 			_("Reference to the connection object for the bizobj being decorated  (dabo.db.dConnection)"))
 
+	DataCache = property(_getDataCache, None, None,
+			_("""Cache of the last data sets received for this bizobj, keyed on the SQL
+			and parameters, as (version, data, types, structure) tuples. When a
+			query is repeated, the server is sent the version, and only replies
+			with the changes since, or 'not modified'.  (read-only) (LRUCache)"""))
+
+	DataCacheSize = property(_getDataCacheSize, _setDataCacheSize, None,
+			_("Number of data sets kept in the DataCache; 0 disables it. Default=10  (int)"))
+
 	Password = property(_getPassword, None, None,
 			_("Plain-text password for authentication on the remote server. (str)"))
 
@@ -406,7 +574,186 @@ class RemoteConnector(object):
 			_("URL for the remote server  (read-only) (str)"))
 
 	UrlOpener = property(_getUrlOpener, None, None,
-			_("Reference to the object that opens URLs and optionally authenticates.  (read-only) (urllib2.urlopener)"))
+			_("""Reference to the object that opens URLs and optionally authenticates.
+			It keeps the connections to the server open, and is shared by all the
+			connectors for the same server and user.  (read-only) (HttpSession)"""))
 
 	UserName = property(_getUserName, None, None,
 			_("Username for authentication on the remote server  (str)"))
+
+
+
+if __name__ == "__main__":
+	# Time requery() and save() against an in-process HTTP server, with the
+	# binary format and with the pickle-in-JSON format that older servers use,
+	# then repeated requeries that only get what changed on the server, and
+	# the time per request with a simulated network round trip.
+	# Pass the number of rows on the command line (default 20000).
+	import datetime
+	import threading
+	import time
+	from decimal import Decimal
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+	import dabo.dConstants as kons
+
+	numRows = 20000
+	if len(sys.argv) > 1:
+		numRows = int(sys.argv[1])
+	startDate = datetime.date(2010, 1, 1)
+	def makeRecord(row):
+		return {"pk": row, "name": u"Customer %s" % row, "city": u"Springfield",
+				"balance": Decimal("%s.%02d" % (row, row % 100)), "rating": row / 7.0,
+				"since": startDate + datetime.timedelta(row % 3000), "active": bool(row % 3),
+				"notes": None}
+	data = [makeRecord(row) for row in xrange(numRows)]
+	typs = {"pk": int, "name": unicode, "city": unicode, "balance": Decimal,
+			"rating": float, "since": datetime.date, "active": bool, "notes": unicode}
+	stru = tuple((fld, dabo.db.getDaboType(typ), fld == "pk", "customer", fld, None)
+			for fld, typ in typs.items())
+	jsonResponse = jsonEncode([pickle.dumps(val).decode("latin-1")
+			for val in (data, typs, stru)])
+
+	class Server(ThreadingMixIn, HTTPServer):
+		daemon_threads = True
+		# Simulated network round trip, in seconds
+		rtt = 0
+		# The version and signatures of the current data
+		signatures = None
+
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+		disable_nagle_algorithm = True
+
+		def setup(self):
+			# Opening a connection takes a round trip.
+			time.sleep(self.server.rtt)
+			BaseHTTPRequestHandler.setup(self)
+
+		def do_POST(self):
+			server = self.server
+			time.sleep(server.rtt)
+			body = self.rfile.read(int(self.headers["Content-Length"]))
+			server.received.append(len(body))
+			status = 200
+			headers = {}
+			if "/customer/requery" not in self.path:
+				ret = ""
+			elif dataCodec.CONTENT_TYPE not in self.headers.get("Accept", "") \
+					or not server.binary:
+				ret = jsonResponse
+			else:
+				# What RemoteBizobj.getRequeryResponse() does.
+				if server.signatures is None:
+					server.signatures = dataCodec.getDataSignatures(data, "pk", typs, stru)
+				version, sigs = server.signatures
+				clientVersion = self.headers.get("If-None-Match", "").strip('"')
+				headers["ETag"] = '"%s"' % version
+				ret = None
+				if clientVersion == version:
+					status = 304
+					ret = ""
+				elif clientVersion in server.versions:
+					ret = dataCodec.encodeDataDelta(data, "pk", version, sigs, clientVersion,
+							server.versions[clientVersion], typs, stru)
+				if ret is None:
+					ret = dataCodec.encodeDataSet(data, typs, stru)
+				server.versions[version] = sigs
+			server.sent.append(len(ret))
+			self.send_response(status)
+			headers["Content-Length"] = str(len(ret))
+			for key, val in headers.items():
+				self.send_header(key, val)
+			self.end_headers()
+			self.wfile.write(ret)
+
+		def log_message(self, *args):
+			pass
+
+	class BizStandIn(object):
+		"""Provides what RemoteConnector uses from a bizobj."""
+		DataSource = "customer"
+		KeyField = "pk"
+		def setChildLinkFilter(self): pass
+		def getSQL(self): return "select * from customer"
+		def getParams(self): return ()
+		def _storeData(self, data, typs, stru):
+			self.data = data
+		def getDataDiff(self, allRows=False):
+			# Only types that every JSON module can encode.
+			changes = [dict([("pk", rec["pk"]), ("name", (rec["name"], rec["name"].upper())),
+					("rating", (rec["rating"], 0.5)), (kons.CURSOR_TMPKEY_FIELD, False)])
+					for rec in data[:numRows // 10]]
+			return {hash(self): (self.DataSource, self.KeyField, changes, {})}
+
+	server = Server(("127.0.0.1", 0), Handler)
+	server.received = []
+	server.sent = []
+	server.versions = {}
+	thrd = threading.Thread(target=server.serve_forever)
+	thrd.setDaemon(True)
+	thrd.start()
+	biz = BizStandIn()
+	conn = RemoteConnector(biz)
+	baseURL = conn._baseURL = "http://127.0.0.1:%s" % server.server_port
+
+	def timeRequery(label):
+		del server.sent[:]
+		start = time.time()
+		conn.requery()
+		elapsed = time.time() - start
+		assert list(biz.data) == list(data)
+		print "requery %-16s: %.3f s, %s bytes" % (label, elapsed, server.sent[0])
+
+	for binary in (False, True):
+		fmt = binary and "binary" or "json"
+		server.binary = conn.BinaryProtocol = binary
+		timeRequery(fmt)
+		del server.received[:]
+		start = time.time()
+		conn.save(allRows=True)
+		print "save    %-16s: %.3f s, %s bytes for %s changed rows" % (fmt,
+				time.time() - start, server.received[0], numRows // 10)
+
+	timeRequery("not modified")
+	# Change some records on the server.
+	for rec in data[:20]:
+		rec["balance"] += 1
+	del data[20:25]
+	data.extend(makeRecord(row) for row in xrange(numRows, numRows + 5))
+	server.signatures = None
+	timeRequery("delta")
+	data.reverse()
+	server.signatures = None
+	timeRequery("new order")
+
+	# Small data sets from here on, so that the times are mostly network.
+	del data[100:]
+	server.signatures = None
+	server.rtt = 0.02
+	numRequests = 20
+	for label, opener in (("urllib2", urllib2.build_opener()), ("HttpSession", HttpSession())):
+		conn._urlOpener = opener
+		start = time.time()
+		for num in xrange(numRequests):
+			conn.requery()
+		print "%-11s: %.1f ms per requery with a %.0f ms round trip" % (label,
+				(time.time() - start) * 1000 / numRequests, server.rtt * 1000)
+		opener.close()
+	# Requery the children of a bizobj.
+	children = []
+	for num in xrange(4):
+		child = RemoteConnector(BizStandIn())
+		child._baseURL = baseURL
+		child.requery()
+		children.append(child)
+	start = time.time()
+	for child in children:
+		child.requery()
+	print "%s children one by one: %.1f ms" % (len(children), (time.time() - start) * 1000)
+	start = time.time()
+	RemoteConnector.requeryMany(children)
+	print "%s children in parallel: %.1f ms" % (len(children), (time.time() - start) * 1000)
+	children[0].UrlOpener.close()
+	server.shutdown()
+	server.server_close()
@@ -0,0 +1,637 @@
+# -*- coding: utf-8 -*-
+"""Compact binary encoding of data sets and data diffs.
+
+This is the format used by RemoteConnector and RemoteBizobj to send data
+between the client and the server, and to cache data sets on the server. A
+data set is stored column by column: columns that hold a single type of value
+are packed into arrays, and the result is compressed with zlib. Other values
+(types dicts, DataStructure, data diffs) are stored with a simple tagged
+encoding. Only the types that occur in Dabo data are supported; nothing is
+unpickled or evaluated on decoding, so data from an untrusted source can at
+worst raise ValueError.
+
+The encoded data starts with a header holding the format version, so that
+older data can be recognized by isEncoded() and newer versions rejected.
+
+	enc = encodeDataSet(cursor.getDataSet(), cursor.getDataTypes())
+	data, typs, stru = decodeDataSet(enc)
+
+A client that already has a version of a data set only needs the records
+that changed since: the server keeps the signatures of the versions it sent
+(getDataSignatures()), and sends the difference with encodeDataDelta(), which
+the client applies to its copy with applyDataDelta().
+"""
+import datetime
+import struct
+from hashlib import sha1
+import zlib
+from decimal import Decimal
+from itertools import izip
+
+from dabo.dLocalize import _
+from dabo.db.dDataSet import dDataSet
+
+
+# Identifies the encoded data, followed by the version and flag bytes.
+MAGIC = "DBOC"
+VERSION = 1
+FLAG_COMPRESSED = 1
+FLAG_DELTA = 2
+# The MIME type used when sending encoded data over HTTP.
+CONTENT_TYPE = "application/x-dabo-data"
+# The largest payload that compressed data is allowed to expand to when it
+# is decoded, so that a small malicious message can't exhaust the memory.
+MAX_DECODED_SIZE = 256 * 1024 * 1024
+
+_header = struct.Struct("<4sBB")
+_uint = struct.Struct("<I")
+_int64 = struct.Struct("<q")
+_int32 = struct.Struct("<i")
+_float = struct.Struct("<d")
+_minInt64 = -2 ** 63
+_maxInt64 = 2 ** 63 - 1
+_usPerDay = 86400 * 1000000
+_usPerSecond = 1000000
+# Types that can be stored in a types dict.
+_typeNames = {"unicode": unicode, "str": str, "int": int, "long": long, "float": float,
+		"bool": bool, "Decimal": Decimal, "date": datetime.date,
+		"datetime": datetime.datetime, "time": datetime.time, "buffer": buffer,
+		"NoneType": type(None)}
+_namesOfTypes = dict((typ, nm) for nm, typ in _typeNames.items())
+# Marks a field that isn't present in a row of a data set.
+_missing = object()
+
+
+
+def isEncoded(data):
+	"""Return True if 'data' is encoded with this module."""
+	return isinstance(data, str) and data.startswith(MAGIC)
+
+
+def encodeValue(val, compressLevel=6):
+	"""
+	Encode a value made up of None, bool, int, long, float, str, unicode,
+	buffer, Decimal, date, datetime, time, and lists, tuples and dicts of
+	these. Raises TypeError for other values.
+	"""
+	out = []
+	_writeValue(out, val)
+	return _finish(out, compressLevel)
+
+
+def decodeValue(data):
+	"""Decode a value encoded with encodeValue()."""
+	rdr = _Reader(_payload(data))
+	ret = _decode(rdr.readValue)
+	rdr.checkEnd()
+	return ret
+
+
+def encodeDataSet(data, typs=None, stru=None, compressLevel=6):
+	"""
+	Encode a data set (a sequence of dicts, such as a dDataSet), along with
+	the cursor's types dict and DataStructure, if passed. Pass 0 for
+	'compressLevel' to skip compression.
+	"""
+	out = []
+	_writeDataSet(out, data, typs, stru)
+	return _finish(out, compressLevel)
+
+
+def decodeDataSet(data):
+	"""
+	Decode data encoded with encodeDataSet(). Returns a tuple of the data set
+	as a dDataSet, the types dict and the DataStructure.
+	"""
+	if isDelta(data):
+		raise ValueError(_("The data is a delta, not a data set."))
+	rdr = _Reader(_payload(data))
+	ret = _decode(rdr.readDataSet)
+	rdr.checkEnd()
+	return ret
+
+
+def recordKeyFunc(keyField):
+	"""
+	Return a function that gets the key of a record, for a KeyField that can
+	be a comma-separated list of fields.
+	"""
+	if "," in keyField:
+		flds = tuple([fld.strip() for fld in keyField.split(",")])
+		return lambda rec: tuple([rec[fld] for fld in flds])
+	return lambda rec: rec[keyField]
+
+
+def getDataSignatures(data, keyField, typs=None, stru=None):
+	"""
+	Return the version of a data set, and a list of (key, signature) tuples
+	for its records, in order. The version changes whenever a record, the
+	order of the records or the structure changes; the signature of a
+	record only changes when the record does.
+	"""
+	getKey = recordKeyFunc(keyField)
+	version = sha1(repr((sorted((typs or {}).items()), stru)))
+	sigs = []
+	if data:
+		flds = sorted(data[0])
+		for rec in data:
+			sig = sha1(repr([rec.get(fld) for fld in flds])).digest()[:10]
+			version.update(sig)
+			sigs.append((getKey(rec), sig))
+	return version.hexdigest(), sigs
+
+
+def encodeDataDelta(data, keyField, version, sigs, baseVersion, baseSigs,
+		typs=None, stru=None, compressLevel=6):
+	"""
+	Encode the changes from a data set with 'baseVersion' and 'baseSigs' to
+	'data', whose version and signatures are 'version' and 'sigs' (see
+	getDataSignatures()). The delta holds the inserted and updated records,
+	the keys of the deleted ones, and the order of the keys if it can't be
+	inferred. Returns None if the delta would not be much smaller than the
+	data set, or if the keys aren't unique.
+	"""
+	baseDict = dict(baseSigs)
+	keys = [key for key, sig in sigs]
+	if len(baseDict) != len(baseSigs) or len(set(keys)) != len(keys):
+		return None
+	changed = [pos for pos, (key, sig) in enumerate(sigs) if baseDict.get(key) != sig]
+	if len(changed) > len(sigs) // 2:
+		return None
+	keySet = set(keys)
+	deleted = [key for key, sig in baseSigs if key not in keySet]
+	# The order that applyDataDelta() produces without being told: the
+	# remaining records in their old order, followed by the new ones.
+	expected = [key for key, sig in baseSigs if key in keySet]
+	expected.extend(key for key in keys if key not in baseDict)
+	order = None if expected == keys else keys
+	out = []
+	_writeValue(out, (version, baseVersion, deleted, order))
+	_writeDataSet(out, [data[pos] for pos in changed], typs, stru)
+	return _finish(out, compressLevel, FLAG_DELTA)
+
+
+def isDelta(data):
+	"""Return True if 'data' was encoded with encodeDataDelta()."""
+	return isEncoded(data) and len(data) >= _header.size \
+			and bool(_header.unpack_from(data)[2] & FLAG_DELTA)
+
+
+def applyDataDelta(data, delta, keyField, baseVersion):
+	"""
+	Apply a delta from encodeDataDelta() to 'data', the data set with
+	'baseVersion', and return a tuple of the new data set, its version, and
+	the types dict and DataStructure. 'data' isn't changed. Raises ValueError
+	if the delta wasn't made for 'baseVersion'.
+	"""
+	rdr = _Reader(_payload(delta))
+	try:
+		version, base, deleted, order = _decode(rdr.readValue)
+	except (TypeError, ValueError):
+		raise ValueError(_("Invalid data delta header."))
+	if base != baseVersion:
+		raise ValueError(_("The delta is for version %(base)s, not %(baseVersion)s.")
+				% locals())
+	rows, typs, stru = _decode(rdr.readDataSet)
+	rdr.checkEnd()
+	getKey = recordKeyFunc(keyField)
+	try:
+		deleted = set(deleted)
+		changed = dict((getKey(rec), rec) for rec in rows)
+		recs = [changed.pop(getKey(rec), rec) for rec in data
+				if getKey(rec) not in deleted]
+	except (KeyError, TypeError):
+		raise ValueError(_("The delta doesn't match the key field '%s'.") % keyField)
+	# What is left are the inserted records, in order.
+	recs.extend(rec for rec in rows if getKey(rec) in changed)
+	if order is not None:
+		byKey = dict((getKey(rec), rec) for rec in recs)
+		try:
+			recs = [byKey[key] for key in order]
+		except (KeyError, TypeError):
+			raise ValueError(_("Invalid record order in the delta."))
+	return dDataSet(recs), version, typs, stru
+
+
+def _writeDataSet(out, data, typs, stru):
+	if data:
+		fields = list(data[0])
+		if len(data) > 1:
+			seen = set(fields)
+			for rec in data:
+				if len(rec) != len(fields) or not seen.issuperset(rec):
+					fields.extend(fld for fld in rec if fld not in seen)
+					seen.update(rec)
+		if not fields:
+			raise TypeError(_("Records without fields can't be encoded."))
+	else:
+		fields = []
+	_writeValue(out, (typs, stru, fields, len(data)))
+	for fld in fields:
+		try:
+			col = [rec[fld] for rec in data]
+		except KeyError:
+			col = [rec.get(fld, _missing) for rec in data]
+		_writeColumn(out, col)
+
+
+def _finish(out, compressLevel, flags=0):
+	payload = "".join(out)
+	if compressLevel:
+		payload = zlib.compress(payload, compressLevel)
+		flags |= FLAG_COMPRESSED
+	return _header.pack(MAGIC, VERSION, flags) + payload
+
+
+def _payload(data):
+	"""Check the header, and return the uncompressed payload."""
+	if not isEncoded(data) or len(data) < _header.size:
+		raise ValueError(_("The data is not in the Dabo data format."))
+	magic, version, flags = _header.unpack_from(data)
+	if version > VERSION:
+		raise ValueError(_("Unsupported Dabo data format version: %s") % version)
+	payload = data[_header.size:]
+	if flags & FLAG_COMPRESSED:
+		dec = zlib.decompressobj()
+		try:
+			payload = dec.decompress(payload, MAX_DECODED_SIZE)
+		except zlib.error, e:
+			raise ValueError(_("Invalid compressed data: %s") % e)
+		if dec.unconsumed_tail:
+			raise ValueError(_("The decoded data is larger than %s bytes.") % MAX_DECODED_SIZE)
+	return payload
+
+
+def _decode(func):
+	"""Call a _Reader method, and raise ValueError for any malformed data."""
+	try:
+		return func()
+	except (struct.error, RuntimeError), e:
+		# Counts that are out of range, or values nested too deeply.
+		raise ValueError(_("Invalid encoded data: %s") % e)
+
+
+def _writeBytes(out, tag, val):
+	out.append(tag)
+	out.append(_uint.pack(len(val)))
+	out.append(val)
+
+
+def _writeDateTime(out, val):
+	if val.tzinfo is not None:
+		raise TypeError(_("Datetimes with a time zone can't be encoded: %r") % val)
+	out.append("D")
+	out.append(_int64.pack(_dateTimeToInt(val)))
+
+
+def _dateTimeToInt(val):
+	return (val.toordinal() * _usPerDay + (val.hour * 3600 + val.minute * 60
+			+ val.second) * _usPerSecond + val.microsecond)
+
+
+def _timeToInt(val):
+	if val.tzinfo is not None:
+		raise TypeError(_("Times with a time zone can't be encoded: %r") % val)
+	return (val.hour * 3600 + val.minute * 60 + val.second) * _usPerSecond + val.microsecond
+
+
+def _intToDateTime(val):
+	days, us = divmod(val, _usPerDay)
+	secs, us = divmod(us, _usPerSecond)
+	mins, secs = divmod(secs, 60)
+	hrs, mins = divmod(mins, 60)
+	dt = datetime.date.fromordinal(days)
+	return datetime.datetime(dt.year, dt.month, dt.day, hrs, mins, secs, us)
+
+
+def _intToTime(val):
+	secs, us = divmod(val, _usPerSecond)
+	mins, secs = divmod(secs, 60)
+	hrs, mins = divmod(mins, 60)
+	return datetime.time(hrs, mins, secs, us)
+
+
+def _writeValue(out, val):
+	typ = type(val)
+	if val is None:
+		out.append("N")
+	elif typ is bool:
+		out.append(val and "T" or "F")
+	elif typ is unicode:
+		_writeBytes(out, "u", val.encode("utf-8"))
+	elif typ in (int, long):
+		if _minInt64 <= val <= _maxInt64:
+			out.append("i")
+			out.append(_int64.pack(val))
+		else:
+			_writeBytes(out, "I", str(val))
+	elif typ is float:
+		out.append("f")
+		out.append(_float.pack(val))
+	elif typ is str:
+		_writeBytes(out, "s", val)
+	elif typ is Decimal:
+		_writeBytes(out, "n", str(val))
+	elif typ is datetime.datetime:
+		_writeDateTime(out, val)
+	elif typ is datetime.date:
+		out.append("d")
+		out.append(_int32.pack(val.toordinal()))
+	elif typ is datetime.time:
+		out.append("h")
+		out.append(_int64.pack(_timeToInt(val)))
+	elif typ is buffer:
+		_writeBytes(out, "b", str(val))
+	elif isinstance(val, dict):
+		out.append("m")
+		out.append(_uint.pack(len(val)))
+		for key, itm in val.iteritems():
+			_writeValue(out, key)
+			_writeValue(out, itm)
+	elif isinstance(val, list):
+		out.append("l")
+		out.append(_uint.pack(len(val)))
+		for itm in val:
+			_writeValue(out, itm)
+	elif isinstance(val, tuple):
+		out.append("p")
+		out.append(_uint.pack(len(val)))
+		for itm in val:
+			_writeValue(out, itm)
+	elif val is _missing:
+		out.append("x")
+	elif typ is type and val in _namesOfTypes:
+		_writeBytes(out, "y", _namesOfTypes[val])
+	elif isinstance(val, basestring):
+		# Subclasses of the string types
+		_writeValue(out, typ.__base__(val))
+	else:
+		raise TypeError(_("Values of type %s can't be encoded.") % typ.__name__)
+
+
+def _columnKind(col):
+	"""Return the code for the packed representation of the column's values."""
+	typs = set(type(val) for val in col)
+	typs.discard(type(None))
+	if len(typs) == 2 and typs == set((int, long)):
+		typs = set((long, ))
+	if len(typs) != 1:
+		return "v"
+	typ = typs.pop()
+	if typ in (int, long):
+		vals = [val for val in col if val is not None]
+		if min(vals) < _minInt64 or max(vals) > _maxInt64:
+			return "v"
+		return "i"
+	return _columnKinds.get(typ, "v")
+
+_columnKinds = {unicode: "u", str: "s", float: "f", bool: "B", Decimal: "n",
+		datetime.date: "d", datetime.datetime: "D", datetime.time: "h", buffer: "b"}
+
+
+def _writeNulls(out, col):
+	"""Write the positions of the None values in the column."""
+	nulls = [pos for pos, val in enumerate(col) if val is None]
+	out.append(_uint.pack(len(nulls)))
+	if nulls:
+		out.append(struct.pack("<%sI" % len(nulls), *nulls))
+	return nulls
+
+
+def _writeStrings(out, col):
+	"""Write the lengths of the strings, with -1 for None, and then the strings."""
+	lens = [-1 if val is None else len(val) for val in col]
+	out.append(struct.pack("<%si" % len(lens), *lens))
+	joined = "".join(val for val in col if val is not None)
+	out.append(_uint.pack(len(joined)))
+	out.append(joined)
+
+
+def _writeColumn(out, col):
+	# Columns with missing fields are always stored as separate values.
+	kind = _columnKind(col) if col else "v"
+	if kind == "v":
+		out.append("v")
+		for val in col:
+			_writeValue(out, val)
+		return
+	out.append(kind)
+	num = len(col)
+	if kind == "u":
+		_writeStrings(out, [None if val is None else val.encode("utf-8") for val in col])
+	elif kind in "snb":
+		_writeStrings(out, [None if val is None else str(val) for val in col])
+	elif kind == "i":
+		if _writeNulls(out, col):
+			col = [0 if val is None else val for val in col]
+		out.append(struct.pack("<%sq" % num, *col))
+	elif kind == "f":
+		if _writeNulls(out, col):
+			col = [0.0 if val is None else val for val in col]
+		out.append(struct.pack("<%sd" % num, *col))
+	elif kind == "B":
+		out.append("".join("\xff" if val is None else (val and "\x01" or "\x00")
+				for val in col))
+	elif kind == "d":
+		# Ordinals start at 1, so 0 stands for None.
+		out.append(struct.pack("<%si" % num, *[0 if val is None else val.toordinal()
+				for val in col]))
+	elif kind == "D":
+		for val in col:
+			if val is not None and val.tzinfo is not None:
+				raise TypeError(_("Datetimes with a time zone can't be encoded: %r") % val)
+		out.append(struct.pack("<%sq" % num, *[-1 if val is None else _dateTimeToInt(val)
+				for val in col]))
+	elif kind == "h":
+		out.append(struct.pack("<%sq" % num, *[-1 if val is None else _timeToInt(val)
+				for val in col]))
+
+
+
+class _Reader(object):
+	"""Reads values from an uncompressed payload."""
+	def __init__(self, data):
+		self.data = data
+		self.pos = 0
+		# Set when a column holds rows that lack the field.
+		self.hasMissing = False
+
+
+	def read(self, size):
+		pos = self.pos
+		end = self.pos = pos + size
+		if end > len(self.data):
+			raise ValueError(_("The encoded data is truncated."))
+		return self.data[pos:end]
+
+
+	def unpack(self, st):
+		return st.unpack(self.read(st.size))[0]
+
+
+	def unpackArray(self, code, num):
+		return struct.unpack("<%s%s" % (num, code), self.read(struct.calcsize(code) * num))
+
+
+	def checkEnd(self):
+		if self.pos != len(self.data):
+			raise ValueError(_("Unexpected data after the encoded value."))
+
+
+	def readValue(self):
+		tag = self.read(1)
+		if tag == "N":
+			return None
+		elif tag == "T":
+			return True
+		elif tag == "F":
+			return False
+		elif tag == "u":
+			return self.read(self.unpack(_uint)).decode("utf-8")
+		elif tag == "i":
+			return self.unpack(_int64)
+		elif tag == "I":
+			try:
+				return long(self.read(self.unpack(_uint)))
+			except ValueError:
+				raise ValueError(_("Invalid integer in the encoded data."))
+		elif tag == "f":
+			return self.unpack(_float)
+		elif tag == "s":
+			return self.read(self.unpack(_uint))
+		elif tag == "n":
+			return self._decimal(self.read(self.unpack(_uint)))
+		elif tag == "D":
+			return self._dateTime(_intToDateTime, self.unpack(_int64))
+		elif tag == "d":
+			return self._dateTime(datetime.date.fromordinal, self.unpack(_int32))
+		elif tag == "h":
+			return self._dateTime(_intToTime, self.unpack(_int64))
+		elif tag == "b":
+			return buffer(self.read(self.unpack(_uint)))
+		elif tag == "m":
+			ret = {}
+			for num in xrange(self.unpack(_uint)):
+				key = self.readValue()
+				try:
+					ret[key] = self.readValue()
+				except TypeError:
+					raise ValueError(_("Invalid dict key in the encoded data."))
+			return ret
+		elif tag == "l":
+			return [self.readValue() for num in xrange(self.unpack(_uint))]
+		elif tag == "p":
+			return tuple([self.readValue() for num in xrange(self.unpack(_uint))])
+		elif tag == "x":
+			self.hasMissing = True
+			return _missing
+		elif tag == "y":
+			try:
+				return _typeNames[self.read(self.unpack(_uint))]
+			except KeyError:
+				raise ValueError(_("Unknown type in the encoded data."))
+		raise ValueError(_("Invalid tag in the encoded data: %r") % tag)
+
+
+	def _decimal(self, val):
+		try:
+			return Decimal(val)
+		except StandardError:
+			raise ValueError(_("Invalid decimal in the encoded data: %r") % val)
+
+
+	def _dateTime(self, func, val):
+		try:
+			return func(val)
+		except (ValueError, OverflowError):
+			raise ValueError(_("Invalid date or time in the encoded data."))
+
+
+	def readDataSet(self):
+		try:
+			typs, stru, fields, rowCount = self.readValue()
+			fields = list(fields)
+			rowCount = int(rowCount)
+		except (TypeError, ValueError):
+			raise ValueError(_("Invalid data set header."))
+		# Each row takes at least a byte in every column, and records without
+		# fields can't be encoded.
+		if rowCount < 0 or (rowCount and not fields) \
+				or rowCount > len(self.data) - self.pos:
+			raise ValueError(_("Invalid row count in the encoded data: %s") % rowCount)
+		cols = [self.readColumn(rowCount) for fld in fields]
+		if not fields:
+			return dDataSet(), typs, stru
+		recs = [dict(izip(fields, vals)) for vals in izip(*cols)]
+		if self.hasMissing:
+			for rec in recs:
+				for fld, val in rec.items():
+					if val is _missing:
+						del rec[fld]
+		return dDataSet(recs), typs, stru
+
+
+	def readNulls(self):
+		return self.unpackArray("I", self.unpack(_uint))
+
+
+	def readStrings(self, num):
+		lens = self.unpackArray("i", num)
+		joined = self.read(self.unpack(_uint))
+		ret = []
+		append = ret.append
+		pos = 0
+		for size in lens:
+			if size < 0:
+				append(None)
+			else:
+				end = pos + size
+				append(joined[pos:end])
+				pos = end
+		if pos != len(joined):
+			raise ValueError(_("Invalid string column in the encoded data."))
+		return ret
+
+
+	def readColumn(self, num):
+		kind = self.read(1)
+		if kind == "v":
+			return [self.readValue() for row in xrange(num)]
+		if kind in "usnb":
+			col = self.readStrings(num)
+			if kind == "u":
+				try:
+					return [None if val is None else val.decode("utf-8") for val in col]
+				except UnicodeDecodeError:
+					raise ValueError(_("Invalid text in the encoded data."))
+			elif kind == "n":
+				return [None if val is None else self._decimal(val) for val in col]
+			elif kind == "b":
+				return [None if val is None else buffer(val) for val in col]
+			return col
+		elif kind in "if":
+			nulls = self.readNulls()
+			col = self.unpackArray(kind == "i" and "q" or "d", num)
+			if nulls:
+				col = list(col)
+				for pos in nulls:
+					if pos >= num:
+						raise ValueError(_("Invalid null position in the encoded data."))
+					col[pos] = None
+			return col
+		elif kind == "B":
+			vals = {"\x00": False, "\x01": True, "\xff": None}
+			try:
+				return [vals[val] for val in self.read(num)]
+			except KeyError:
+				raise ValueError(_("Invalid boolean in the encoded data."))
+		elif kind == "d":
+			return [self._dateTime(datetime.date.fromordinal, val) if val else None
+					for val in self.unpackArray("i", num)]
+		elif kind == "D":
+			return [None if val < 0 else self._dateTime(_intToDateTime, val)
+					for val in self.unpackArray("q", num)]
+		elif kind == "h":
+			return [None if val < 0 else self._dateTime(_intToTime, val)
+					for val in self.unpackArray("q", num)]
+		raise ValueError(_("Invalid column kind in the encoded data: %r") % kind)
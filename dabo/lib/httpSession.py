@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+import base64
+import errno
+import httplib
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+import zlib
+from cStringIO import StringIO
+
+from dabo.dLocalize import _
+
+
+
+def _isClosedByServer(err):
+	"""
+	Return True if the error means that the server closed the connection
+	without answering: the connection was reset, or closed before any of
+	the response was received.
+	"""
+	if isinstance(err, httplib.BadStatusLine):
+		# Depending on the Python version, an empty status line is reported
+		# as '' or with a message.
+		return err.line in ("", repr("")) or err.line.startswith("No status line received")
+	return isinstance(err, socket.error) and err.errno in (errno.ECONNRESET, errno.EPIPE)
+
+
+
+class HttpResponse(object):
+	"""The response to a request made with HttpSession.open().
+
+	It provides the same methods as the responses of urllib2, but the body
+	has already been read, so the connection could be reused.
+	"""
+	def __init__(self, url, code, msg, headers, body):
+		self.url = url
+		self.code = code
+		self.msg = msg
+		self.headers = headers
+		self._body = StringIO(body)
+
+
+	def read(self, size=-1):
+		return self._body.read(size)
+
+
+	def info(self):
+		return self.headers
+
+
+	def getcode(self):
+		return self.code
+
+
+	def geturl(self):
+		return self.url
+
+
+
+class HttpSession(object):
+	"""Make HTTP requests over persistent connections.
+
+	urllib2 opens a new connection for every request, and with digest
+	authentication each request costs a second round trip to get the
+	challenge. A session keeps the connections to each host open between
+	requests, and once it has been challenged, it sends the authorization with
+	the next requests. Responses are requested gzip-compressed, and
+	requests that fail because of a network error are retried.
+
+	open() accepts the same arguments as urllib2's OpenerDirector.open(), and
+	raises urllib2.HTTPError and URLError in the same cases, so a session can
+	be used in its place. Sessions are thread-safe: each connection is only
+	used by one thread at a time, and at most MaxConnections are opened to a
+	host. openMany() sends several requests in parallel.
+	"""
+	def __init__(self, userName=None, password=None):
+		self._userName = userName
+		self._password = password
+		self._lock = threading.Lock()
+		# Idle connections, keyed on (scheme, host).
+		self._idle = {}
+		# Semaphores that limit the connections to each host.
+		self._slots = {}
+		# The last authentication challenge from each host.
+		self._challenges = {}
+		self._connectionsOpened = 0
+		self._requestCount = 0
+		self._compression = True
+		self._maxConnections = 4
+		self._retries = 2
+		self._retryDelay = 0.5
+		self._timeout = 30
+		pwMgr = urllib2.HTTPPasswordMgrWithDefaultRealm()
+		self._digestHandler = urllib2.HTTPDigestAuthHandler(pwMgr)
+
+
+	def open(self, url, data=None, timeout=None, idempotent=True):
+		"""
+		Send a request, and return an HttpResponse. 'url' can be a string or
+		a urllib2.Request; the request is a POST if there is data to send.
+		Requests that fail with a network error are retried up to Retries
+		times, unless 'idempotent' is False, in which case they are only
+		retried if they failed on an idle connection that the server had
+		already closed: before the request was sent, or with the connection
+		reset or closed before any of the response arrived. Requests that
+		time out are never sent again on that account.
+		"""
+		if isinstance(url, urllib2.Request):
+			req = url
+		else:
+			req = urllib2.Request(url, data)
+		if timeout is None:
+			timeout = self.Timeout
+		for redirect in xrange(5):
+			resp = self._openWithAuth(req, timeout, idempotent)
+			if resp.code in (301, 302, 303, 307) and resp.headers.getheader("location"):
+				newUrl = urlparse.urljoin(req.get_full_url(),
+						resp.headers.getheader("location"))
+				if resp.code == 307:
+					req = urllib2.Request(newUrl, req.get_data(), dict(req.header_items()))
+				else:
+					req = urllib2.Request(newUrl)
+				continue
+			break
+		if not 200 <= resp.code < 300:
+			raise urllib2.HTTPError(resp.url, resp.code, resp.msg, resp.headers, resp._body)
+		return resp
+
+
+	def openMany(self, urls, timeout=None):
+		"""
+		Send several independent requests in parallel, over up to
+		MaxConnections connections per host. Returns a list with, for each
+		request in order, the HttpResponse, or the exception that open()
+		raised for it.
+		"""
+		urls = list(urls)
+		results = [None] * len(urls)
+		pending = range(len(urls))
+		pending.reverse()
+
+		def work():
+			while True:
+				try:
+					pos = pending.pop()
+				except IndexError:
+					return
+				try:
+					results[pos] = self.open(urls[pos], timeout=timeout)
+				except (urllib2.URLError, httplib.HTTPException, socket.error), e:
+					results[pos] = e
+
+		numThreads = min(len(urls), self.MaxConnections)
+		threads = [threading.Thread(target=work) for num in xrange(numThreads - 1)]
+		for thrd in threads:
+			thrd.start()
+		# The current thread does its share of the work, too.
+		work()
+		for thrd in threads:
+			thrd.join()
+		return results
+
+
+	def close(self):
+		"""Close all the idle connections."""
+		self._lock.acquire()
+		try:
+			idle = self._idle
+			self._idle = {}
+		finally:
+			self._lock.release()
+		for conns in idle.values():
+			for conn in conns:
+				conn.close()
+
+
+	def _openWithAuth(self, req, timeout, idempotent):
+		"""Send the request, and answer an authentication challenge if needed."""
+		scheme, host = urlparse.urlsplit(req.get_full_url())[:2]
+		key = (scheme, host)
+		challenge = self._challenges.get(key)
+		resp = self._send(req, key, timeout, idempotent, self._authorization(req, challenge))
+		if resp.code != 401 or self._userName is None:
+			return resp
+		newChallenge = self._parseChallenge(resp.headers.getheader("www-authenticate", ""))
+		if newChallenge is None:
+			return resp
+		if challenge is not None:
+			# We already sent an authorization. Only try again if it was for
+			# a digest nonce that is no longer valid.
+			params = newChallenge[1]
+			if newChallenge[0] != "digest" or (params.get("nonce") == challenge[1].get("nonce")
+					and params.get("stale", "").lower() != "true"):
+				return resp
+		else:
+			self._digestHandler.passwd.add_password(None, host, self._userName, self._password)
+		self._challenges[key] = newChallenge
+		return self._send(req, key, timeout, idempotent, self._authorization(req, newChallenge))
+
+
+	def _parseChallenge(self, header):
+		"""Return the scheme and parameters of a WWW-Authenticate header."""
+		scheme, sep, rest = header.strip().partition(" ")
+		scheme = scheme.lower()
+		if scheme not in ("basic", "digest"):
+			return None
+		return scheme, urllib2.parse_keqv_list(urllib2.parse_http_list(rest))
+
+
+	def _authorization(self, req, challenge):
+		if challenge is None:
+			return None
+		scheme, params = challenge
+		if scheme == "basic":
+			return "Basic %s" % base64.b64encode("%s:%s" % (self._userName, self._password))
+		handler = self._digestHandler
+		self._lock.acquire()
+		try:
+			# The nonce count must increase with each request.
+			auth = handler.get_authorization(req, params)
+		finally:
+			self._lock.release()
+		if auth:
+			return "Digest %s" % auth
+		return None
+
+
+	def _send(self, req, key, timeout, idempotent, authorization):
+		"""Send the request over a pooled connection, retrying after network errors."""
+		data = req.get_data()
+		method = req.get_method()
+		headers = dict(req.header_items())
+		if data is not None and "Content-type" not in headers:
+			headers["Content-type"] = "application/x-www-form-urlencoded"
+		if self.Compression:
+			headers["Accept-encoding"] = "gzip"
+		if authorization:
+			headers["Authorization"] = authorization
+		selector = req.get_selector()
+		slot = self._getSlot(key)
+		slot.acquire()
+		try:
+			attempt = 0
+			while True:
+				conn, reused = self._getConnection(key, timeout)
+				sent = False
+				try:
+					conn.request(method, selector, data, headers)
+					sent = True
+					resp = conn.getresponse()
+					body = resp.read()
+				except (socket.error, httplib.HTTPException), e:
+					conn.close()
+					if reused and not isinstance(e, socket.timeout) \
+							and (idempotent or not sent or _isClosedByServer(e)):
+						# The server probably closed the idle connection. A
+						# request that may have been processed is only sent
+						# again if it is idempotent.
+						continue
+					attempt += 1
+					if not idempotent or attempt > self.Retries:
+						raise urllib2.URLError(e)
+					time.sleep(self.RetryDelay * attempt)
+					continue
+				break
+			if resp.will_close:
+				conn.close()
+			else:
+				self._putConnection(key, conn)
+		finally:
+			slot.release()
+		self._lock.acquire()
+		self._requestCount += 1
+		self._lock.release()
+		if resp.getheader("content-encoding", "").lower() == "gzip":
+			try:
+				body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+			except zlib.error, e:
+				raise urllib2.URLError(_("Invalid gzip data: %s") % e)
+		return HttpResponse(req.get_full_url(), resp.status, resp.reason, resp.msg, body)
+
+
+	def _getSlot(self, key):
+		self._lock.acquire()
+		try:
+			try:
+				return self._slots[key]
+			except KeyError:
+				ret = self._slots[key] = threading.BoundedSemaphore(self.MaxConnections)
+				return ret
+		finally:
+			self._lock.release()
+
+
+	def _getConnection(self, key, timeout):
+		"""Return an idle connection to the host, or a new one, and whether it was reused."""
+		self._lock.acquire()
+		try:
+			try:
+				conn = self._idle[key].pop()
+				conn.sock.settimeout(timeout)
+				return conn, True
+			except (KeyError, IndexError, AttributeError):
+				self._connectionsOpened += 1
+		finally:
+			self._lock.release()
+		scheme, host = key
+		if scheme == "https":
+			cls = httplib.HTTPSConnection
+		elif scheme == "http":
+			cls = httplib.HTTPConnection
+		else:
+			raise urllib2.URLError(_("Unsupported URL scheme: %s") % scheme)
+		return cls(host, timeout=timeout), False
+
+
+	def _putConnection(self, key, conn):
+		self._lock.acquire()
+		try:
+			self._idle.setdefault(key, []).append(conn)
+		finally:
+			self._lock.release()
+
+
+	def _getCompression(self):
+		return self._compression
+
+	def _setCompression(self, val):
+		self._compression = bool(val)
+
+
+	def _getConnectionsOpened(self):
+		return self._connectionsOpened
+
+
+	def _getMaxConnections(self):
+		return self._maxConnections
+
+	def _setMaxConnections(self, val):
+		self._maxConnections = max(1, int(val))
+		self._slots = {}
+
+
+	def _getRequestCount(self):
+		return self._requestCount
+
+
+	def _getRetries(self):
+		return self._retries
+
+	def _setRetries(self, val):
+		self._retries = val
+
+
+	def _getRetryDelay(self):
+		return self._retryDelay
+
+	def _setRetryDelay(self, val):
+		self._retryDelay = val
+
+
+	def _getTimeout(self):
+		return self._timeout
+
+	def _setTimeout(self, val):
+		self._timeout = val
+
+
+	Compression = property(_getCompression, _setCompression, None,
+			_("Ask the server for gzip-compressed responses. Default=True  (bool)"))
+
+	ConnectionsOpened = property(_getConnectionsOpened, None, None,
+			_("Number of connections that the session has opened.  (read-only) (int)"))
+
+	MaxConnections = property(_getMaxConnections, _setMaxConnections, None,
+			_("Maximum number of connections to each host. Default=4  (int)"))
+
+	RequestCount = property(_getRequestCount, None, None,
+			_("Number of requests that the session has sent.  (read-only) (int)"))
+
+	Retries = property(_getRetries, _setRetries, None,
+			_("Number of times a request is retried after a network error. Default=2  (int)"))
+
+	RetryDelay = property(_getRetryDelay, _setRetryDelay, None,
+			_("""Seconds to wait before retrying a request; the wait grows with
+			each retry. Default=0.5  (float)"""))
+
+	Timeout = property(_getTimeout, _setTimeout, None,
+			_("Seconds to wait for the server to respond. Default=30  (float)"))
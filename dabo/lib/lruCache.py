@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from dabo.dLocalize import _
+
+
+
+class LRUCache(object):
+	"""Dictionary-like cache that holds at most MaxSize items.
+
+	When the cache is full, adding an item discards the least recently used
+	one. Lookups with get() are counted in Hits and Misses, so that callers
+	can tell whether caching pays off for their data.
+	"""
+	def __init__(self, maxSize=500):
+		self._items = OrderedDict()
+		self._maxSize = max(0, int(maxSize))
+		self._hits = 0
+		self._misses = 0
+
+
+	def get(self, key, default=None, valid=None):
+		"""Return the cached value for key, or default if it isn't cached.
+
+		If 'valid' is passed, it is called with the cached value, and a False
+		return is treated as a miss. Hits make the item the most recently used.
+		"""
+		items = self._items
+		try:
+			val = items.pop(key)
+		except KeyError:
+			self._misses += 1
+			return default
+		items[key] = val
+		if valid is not None and not valid(val):
+			self._misses += 1
+			return default
+		self._hits += 1
+		return val
+
+
+	def __setitem__(self, key, val):
+		if not self._maxSize:
+			return
+		items = self._items
+		items.pop(key, None)
+		items[key] = val
+		if len(items) > self._maxSize:
+			items.popitem(last=False)
+
+
+	def __getitem__(self, key):
+		ret = self.get(key, self)
+		if ret is self:
+			raise KeyError(key)
+		return ret
+
+
+	def __delitem__(self, key):
+		del self._items[key]
+
+
+	def __contains__(self, key):
+		return key in self._items
+
+
+	def __len__(self):
+		return len(self._items)
+
+
+	def clear(self, resetCounts=True):
+		"""Remove all the items, and reset the hit and miss counters unless 'resetCounts' is False."""
+		self._items.clear()
+		if resetCounts:
+			self._hits = self._misses = 0
+
+
+	def _getHits(self):
+		return self._hits
+
+
+	def _getMaxSize(self):
+		return self._maxSize
+
+	def _setMaxSize(self, val):
+		self._maxSize = max(0, int(val))
+		items = self._items
+		while len(items) > self._maxSize:
+			items.popitem(last=False)
+
+
+	def _getMisses(self):
+		return self._misses
+
+
+	Hits = property(_getHits, None, None,
+			_("Number of get() calls that found a valid item.  (int)"))
+
+	MaxSize = property(_getMaxSize, _setMaxSize, None,
+			_("Maximum number of items kept; 0 disables caching.  (int)"))
+
+	Misses = property(_getMisses, None, None,
+			_("Number of get() calls that didn't find a valid item.  (int)"))
@@ -8,6 +8,8 @@ Decimal = decimal.Decimal
 import locale
 import sys
 import os
+import tempfile
+import multiprocessing
 from dabo.dLocalize import _
 from dabo.lib.dates import getStringFromDate
 
@@ -56,6 +58,7 @@ from dabo import getEncoding
 from dabo.lib.xmltodict import xmltodict
 from dabo.lib.xmltodict import dicttoxml
 from dabo.lib.caselessDict import CaselessDict
+from dabo.lib.lruCache import LRUCache
 from reportlab.lib.utils import ImageReader
 from dabo.lib.utils import ustr, resolvePathAndUpdate
 from reportlab.pdfbase.pdfmetrics import registerFont, getRegisteredFontNames
@@ -63,6 +66,14 @@ from reportlab.pdfbase.ttfonts import TTFont, TTFError
 from reportlab.rl_config import TTFSearchPath
 import Image as PILImage
 import reportUtils
+try:
+	from PyPDF2 import PdfFileReader, PdfFileWriter
+except ImportError:
+	try:
+		from pyPdf import PdfFileReader, PdfFileWriter
+	except ImportError:
+		## Reports can't be rendered in parallel without one of these.
+		PdfFileReader = PdfFileWriter = None
 
 # The below block tried to use the experimental para.Paragraph which
 # handles more html tags, including hyperlinks. However, I couldn't
@@ -116,6 +127,15 @@ PROPS_TO_SKIP_DEF = ("designerlock", "totalheight", "comment")
 
 substitutedFontNames = []   ## keep track of which fonts we've already substituted, to limit logging
 
+## Report expressions compiled by compileExpression(), keyed on their text:
+_compiledExpressions = {}
+_CONSTANT, _CODE, _ERROR = range(3)
+## Names that constant expressions may use:
+_constantNames = frozenset(("True", "False", "None"))
+## Values of these types can be shared by every evaluation of an expression:
+_immutableTypes = (basestring, int, long, float, bool, type(None), Decimal,
+		datetime.date, datetime.time)
+
 
 def toPropDict(dataType, default, doc):
 	return {"dataType": dataType, "default": default, "doc": doc}
@@ -140,6 +160,52 @@ def getSubFont(fontName, subFontName="Helvetica"):
 	return subFontName
 
 
+def _isImmutable(val):
+	if isinstance(val, tuple):
+		return all([_isImmutable(v) for v in val])
+	return isinstance(val, _immutableTypes)
+
+
+def compileExpression(expr):
+	"""Return a (kind, value) tuple for the passed report expression.
+
+	The expression is compiled only once. If it doesn't reference any names
+	(such as '"Helvetica"', '(0.5, 0.5, 0.5)' or '1.5 * 72'), it is also
+	evaluated once and the kind is _CONSTANT; otherwise the value is the code
+	object and the kind is _CODE. If it can't be compiled, the kind is _ERROR
+	and the value is the exception.
+	"""
+	try:
+		return _compiledExpressions[expr]
+	except KeyError:
+		pass
+	try:
+		src = expr
+		if isinstance(src, basestring):
+			## eval() ignores leading blanks, but compile() doesn't:
+			src = src.lstrip(" \t")
+		code = compile(src, "<report expression>", "eval")
+		ret = (_CODE, code)
+		if _constantNames.issuperset(code.co_names):
+			val = eval(code, {})
+			if _isImmutable(val):
+				ret = (_CONSTANT, val)
+	except Exception, e:
+		ret = (_ERROR, e)
+	_compiledExpressions[expr] = ret
+	return ret
+
+
+def evalExpression(expr, obj):
+	"""Evaluate the report expression, with 'self' referring to obj."""
+	kind, val = compileExpression(expr)
+	if kind == _CONSTANT:
+		return val
+	if kind == _CODE:
+		return eval(val, globals(), {"self": obj})
+	raise val
+
+
 def getFloatLeading(obj):
 	leading = obj.getProp("leading")
 	size = float(obj.getProp("fontsize"))
@@ -168,6 +234,23 @@ def getFloatLeading(obj):
 		return size
 
 
+def _writeReportChunk(args):
+	"""Render some of the records of a report to a separate PDF file.
+
+	This runs in the worker processes started by ReportWriter.write() when
+	its Processes property is greater than 1.
+	"""
+	settings, records, outputFile = args
+	rw = ReportWriter()
+	rw.ReportFormXML = settings.pop("ReportFormXML")
+	for att, val in settings.items():
+		setattr(rw, att, val)
+	rw.Cursor = records
+	rw.OutputFile = outputFile
+	rw.write()
+	return outputFile
+
+
 class PageCountCanvas(canvas.Canvas):
 	"""Solves the 'page x of y' problem without needing to run the report twice.
 
@@ -329,7 +412,8 @@ class ReportObject(CaselessDict):
 
 		If defined, it will be eval()'d. Otherwise,	the default will be returned.
 		If there isn't a default, an exception will be raised as the object isn't
-		set up to have the passed prop.
+		set up to have the passed prop. Each expression is only compiled once,
+		and expressions that don't reference any names are only evaluated once.
 		"""
 		def getDefault(prop):
 			if prop[-4:] != "_def":
@@ -337,7 +421,7 @@ class ReportObject(CaselessDict):
 				try:
 					ret = self["%s_def" % prop]
 					if evaluate:
-						ret = eval(ret)
+						ret = evalExpression(ret, self)
 					return ret
 				except StandardError:
 					pass
@@ -348,13 +432,13 @@ class ReportObject(CaselessDict):
 				try:
 					ret = self.ReportForm["Defaults"][prop]
 					if evaluate:
-						ret = eval(ret)
+						ret = evalExpression(ret, self)
 					return ret
 				except StandardError:
 					try:
 						ret = self.ReportForm["Defaults"][prop[:-4]]
 						if evaluate:
-							ret = eval(ret)
+							ret = evalExpression(ret, self)
 						return ret
 					except StandardError:
 						pass
@@ -376,7 +460,7 @@ class ReportObject(CaselessDict):
 			if not evaluate or prop == "type":
 				return self[prop]
 			try:
-				return eval(self[prop])
+				return evalExpression(self[prop], self)
 			except Exception, e:
 				# eval() failed. Return the default or the exception string.
 				if returnException:
@@ -1260,6 +1344,11 @@ class ReportWriter(object):
 	_clearMemento = True
 	being_deferred = False
 	undoLog = None
+	## Set when rendering a part of the report in a separate process:
+	_pageNumberOffset = 0
+	_totalPageCount = None
+	_printReportBegin = True
+	_printReportEnd = True
 
 	def storeUndo(self, *args):
 		if self.undoLog is None:
@@ -1289,12 +1378,18 @@ class ReportWriter(object):
 
 	def _onReportIteration(self):
 		if self.PrintStatus:
-			print "Processing row %s of %s..." % (self.RecordNumber + 1, len(self.Cursor))
+			recordCount = self.RecordCount
+			if recordCount is None:
+				print "Processing row %s..." % (self.RecordNumber + 1)
+			else:
+				print "Processing row %s of %s..." % (self.RecordNumber + 1, recordCount)
 			sys.stdout.flush()
 
 	def _onReportEnd(self):
 		if self.PrintStatus:
 			print "Report End."
+			cache = self.StoryCache
+			print "Story cache: %s hits, %s misses." % (cache.Hits, cache.Misses)
 
 
 	def getFramesetCount(self):
@@ -1754,8 +1849,9 @@ class ReportWriter(object):
 				pass
 			elif isinstance(img, basestring) and "\0" not in img:
 				trial_paths = [".", self.HomeDirectory]
-				if self.Application:
-					trial_paths.append(self.Application.HomeDirectory)
+				app = getattr(self, "Application", None)
+				if app:
+					trial_paths.append(app.HomeDirectory)
 				for trial_path in trial_paths:
 					img = os.path.join(trial_path, img)
 					if "\\" in img and "/" in img:
@@ -1907,27 +2003,83 @@ class ReportWriter(object):
 		else:
 			# Frameset/Paragraph is deprecated
 			objects = obj["Objects"]
-		s = styles.getSampleStyleSheet()["Normal"]
-		story = []
 
+		# Evaluate everything that the story depends on up front; along with the
+		# frame geometry, these values are the key for the StoryCache.
+		specs = []
 		for fobject in objects:
-			objNeededHeight = 0
 			if overrideExpr:
 				expr = overrideExpr
 			else:
 				expr = fobject.getProp("expr")
-
-			if isinstance(s, basestring):
-				expr = expr.encode(self.Encoding)
+			if overrideFontSize:
+				fontSize = overrideFontSize
 			else:
-				expr = ustr(expr)
-			s = copy.deepcopy(s)
+				fontSize = fobject.getProp("fontSize")
+			spec = (fobject.__class__.__name__, ustr(expr), fontSize,
+					fobject.getProp("fontName"))
+			if isinstance(fobject, (Memo, Paragraph)):
+				spec += (getFloatLeading(fobject), fobject.getProp("firstLineIndent"))
+				if isinstance(fobject, Paragraph):
+					# I ditched these props in Memo:
+					spec += (fobject.getProp("spaceAfter"), fobject.getProp("spaceBefore"),
+							fobject.getProp("leftIndent"))
+			specs.append(spec)
 
-			if overrideFontSize:
-				s.fontSize = overrideFontSize
+		cache = self.StoryCache
+		key = (tuple(specs), columnWidth, height, padLeft, padRight, padTop, padBottom,
+				columnCount, bool(overrideExpr))
+		try:
+			hash(key)
+		except TypeError:
+			key = None
+		if key is not None and cache.MaxSize:
+			def isValid(entry):
+				# A story where no paragraph had to be split is good for any
+				# available height at least as large as the one it was made for.
+				story, neededHeight, madeForHeight, fits = entry
+				if availableHeight == madeForHeight:
+					return True
+				return fits and availableHeight is not None and madeForHeight is not None \
+						and availableHeight >= madeForHeight
+			entry = cache.get(key, valid=isValid)
+			if entry is not None:
+				return entry[0], entry[1]
+
+		story, objNeededHeight, fits = self._makeStory(specs, columnWidth-padLeft-padRight,
+				height, overrideExpr, availableHeight)
+
+		neededHeight = objNeededHeight + padTop + padBottom
+		if height is not None and neededHeight > height and not overrideExpr:
+			if not story:
+				story, neededHeight = self.getStory(obj, overrideExpr="<<< string too long >>>",
+						overrideFontSize=7)
 			else:
-				s.fontSize = fobject.getProp("fontSize")
-			s.fontName = fobject.getProp("fontName")
+				# return the story as-is, but will be truncated:
+				neededHeight = height
+		if key is not None:
+			cache[key] = (story, neededHeight, availableHeight, fits)
+		return story, neededHeight
+
+
+	def _makeStory(self, specs, availWidth, height, overrideExpr, availableHeight):
+		"""Create the paragraph flowables for getStory(), from the evaluated specs.
+
+		Returns the list of (flowable, height) tuples, the height needed by the
+		last object, and whether everything fit without splitting or truncating
+		any paragraph.
+		"""
+		s = styles.getSampleStyleSheet()["Normal"]
+		story = []
+		fits = True
+		objNeededHeight = 0
+
+		for spec in specs:
+			objNeededHeight = 0
+			objType, expr, fontSize, fontName = spec[:4]
+			s = copy.deepcopy(s)
+			s.fontSize = fontSize
+			s.fontName = fontName
 
 			# If the specified font name isn't available, we need to substitute
 			# the built-in type 1 Helvetica:
@@ -1936,14 +2088,10 @@ class ReportWriter(object):
 			except StandardError:
 				s.fontName = getSubFont(s.fontName)
 
-			if isinstance(fobject, (Memo, Paragraph)):
-				s.leading = getFloatLeading(fobject)
-				s.firstLineIndent = fobject.getProp("firstLineIndent")
-				if isinstance(fobject, Paragraph):
-					# I ditched these props in Memo:
-					s.spaceAfter = fobject.getProp("spaceAfter")
-					s.spaceBefore = fobject.getProp("spaceBefore")
-					s.leftIndent = fobject.getProp("leftIndent")
+			if objType in ("Memo", "Paragraph"):
+				s.leading, s.firstLineIndent = spec[4:6]
+				if objType == "Paragraph":
+					s.spaceAfter, s.spaceBefore, s.leftIndent = spec[6:9]
 				paras = expr.splitlines()
 				rl_paras = []
 				prior_para = ""
@@ -1962,18 +2110,21 @@ class ReportWriter(object):
 								words[idx] = word
 							return " ".join(words)
 						para = escapePara(para)
-						splits = ParaClass(para, s).split(columnWidth-padLeft-padRight, availableHeight)
+						splits = ParaClass(para, s).split(availWidth, availableHeight)
+						if len(splits) != 1:
+							fits = False
 						for split in splits:
 							rl_paras.append(split)
 
 				for p in rl_paras:
-					p_height = p.wrap(columnWidth-padLeft-padRight, height)[1]
+					p_height = p.wrap(availWidth, height)[1]
 					if height is not None and objNeededHeight + p_height > height and not overrideExpr:
 						# We are going to need to truncate the output; find the amount of data we can print
 						# and print that, followed by "..."
 						availableHeight = height - objNeededHeight
+						fits = False
 						p = ParaClass("...", s)
-						p_height = p.wrap(columnWidth-padLeft-padRight, None)[1]
+						p_height = p.wrap(availWidth, None)[1]
 						if p_height > availableHeight:
 							# don't even have space for the "..."
 							# go to prior paragraph and append it:
@@ -1981,11 +2132,11 @@ class ReportWriter(object):
 							objNeededHeight -= prior_height
 							availableHeight = height - objNeededHeight
 							trial_p = ParaClass("%s..." % prior_para, s)
-							trial_height = trial_p.wrap(columnWidth-padLeft-padRight, None)[1]
+							trial_height = trial_p.wrap(availWidth, None)[1]
 							if trial_height > availableHeight:
 								# It worked before, so just remove the final 3 chars and be done with it:
 								p = ParaClass("%s..." % prior_para[:-3], s)
-								p_height = p.wrap(columnWidth-padLeft-padRight, None)[1]
+								p_height = p.wrap(availWidth, None)[1]
 								objNeededHeight += p_height
 								story.append((p, p_height))
 								break
@@ -2011,10 +2162,10 @@ class ReportWriter(object):
 									continue
 								this_balanced_para = para1
 								p = ParaClass("%s..." % this_balanced_para, s)
-								p_height = p.wrap(columnWidth-padLeft-padRight, None)[1]
+								p_height = p.wrap(availWidth, None)[1]
 								if p_height > availableHeight:
 									p = ParaClass("%s..." % last_balanced_para, s)
-									p_height = p.wrap(columnWidth-padLeft-padRight, None)[1]
+									p_height = p.wrap(availWidth, None)[1]
 									break
 
 							objNeededHeight += p_height
@@ -2030,19 +2181,12 @@ class ReportWriter(object):
 					append_p = ParaClass("Hack: see hackDeferredPara() in reportWriter.py", s)
 					p_height = p.wrap(99999, None)[1]
 					story.append((append_p, p_height))
-				if False and obj.getProp("Height") is None and paras:
+				if False and height is None and paras:
 					## pkm 2012-09-12: I'm finding I don't need the hackDeferredPara() as I'm seeing the
 					##                 append_p string at the end of my memo.
 					hackDeferredPara()
 
-		neededHeight = objNeededHeight + padTop + padBottom
-		if height is not None and neededHeight > height and not overrideExpr:
-			if not story:
-				return self.getStory(obj, overrideExpr="<<< string too long >>>", overrideFontSize=7)
-			else:
-				# return the story as-is, but will be truncated:
-				return story, height
-		return story, neededHeight
+		return story, objNeededHeight, fits
 
 
 	def getColorTupleFromReportLab(self, val):
@@ -2106,7 +2250,7 @@ class ReportWriter(object):
 
 
 	def drawPageCounts(self, pageNum, pageCount):
-		self._pageCount = pageCount
+		self._pageCount = self._totalPageCount or pageCount
 		page_count_objects = self.page_count_objects.get(pageNum, [])
 		for x, y, obj, expr in page_count_objects:
 			obj["expr_pagecount"] = expr.replace("^^^PageCount^^^", ustr(self.PageCount))
@@ -2122,19 +2266,23 @@ class ReportWriter(object):
 		with another call, perhaps after creating a different report form.
 		"""
 		self._cancel = False
-		self._calcObjectHeights = {}
+		self.StoryCache.clear()
 		_form = self.ReportForm
 		if _form is None:
 			raise ValueError("ReportForm must be set first.")
 
 		_form.reportWriter = self
 
+		if self.Processes > 1 and save and self.Canvas is None:
+			if self._writeParallel():
+				return
+
 		_outputFile = self.OutputFile
 
 		pageSize = self.getPageSize()
 		pageWidth, pageHeight = pageSize
 		self._pageWidth = pageWidth
-		self._pageNumber = 0
+		self._pageNumber = self._pageNumberOffset
 		self._pageCount = 0
 		self.page_count_objects = {}
 
@@ -2188,9 +2336,17 @@ class ReportWriter(object):
 		self._recordNumber = 0
 		self._currentColumn = 0
 
+		# The records are read one ahead of the one being printed, so that only
+		# two of them are needed at a time, and streams can be printed as they
+		# are fetched.
+		records = iter(self._getRecordSource())
+		self._nextRecord = next(records, None)
+		self._recordsRead = 0
+
 		## Let the page header have access to the first record:
-		if len(self.Cursor) > 0:
-			self.Record = self.Cursor[0]
+		if self._nextRecord is not None:
+			self._recordsRead = 1
+			self.Record = self._nextRecord
 
 		def processVariables(forceReset=False):
 			"""Apply the user's expressions to the current value of all the report vars.
@@ -2340,7 +2496,7 @@ class ReportWriter(object):
 				if y < check or maxBandHeight is None:
 					# Move to the next page or column
 					headers_reprinted = False
-					if self.RecordNumber <= len(self.Cursor):
+					if self.RecordNumber <= self._recordsRead:
 						headers_reprinted = False
 						if self._currentColumn >= columnCount-1:
 							# Move to next page
@@ -2431,7 +2587,8 @@ class ReportWriter(object):
 					# on whatever the current record or page number is.
 					expr = obj["expr"].replace("self.PageCount", "'^^^PageCount^^^'")
 					expr = "'''%s'''" % eval(expr)
-					page_count_objects = self.page_count_objects.setdefault(self.PageNumber-1, [])
+					page_count_objects = self.page_count_objects.setdefault(
+							self.PageNumber - self._pageNumberOffset - 1, [])
 					page_count_objects.append((x1, y1, obj, expr))
 					continue
 
@@ -2570,11 +2727,17 @@ class ReportWriter(object):
 		beginPage()
 		self._onReportBegin()
 		y = None
-		y = printBand("ReportBegin")
+		if self._printReportBegin:
+			y = printBand("ReportBegin")
 
 		# Print the dynamic bands (Detail, GroupHeader, GroupFooter):
 		y = None
-		for cursor_idx, record in enumerate(self.Cursor):
+		while self._nextRecord is not None:
+			cursor_idx = self._recordNumber
+			record = self._nextRecord
+			self._nextRecord = next(records, None)
+			if self._nextRecord is not None:
+				self._recordsRead += 1
 			if self._cancel:
 				self._onReportCancel()
 				return
@@ -2667,13 +2830,166 @@ class ReportWriter(object):
 			y = printBand("groupFooter", y, group)
 
 		self._onReportEnd()
-		y = printBand("ReportEnd", y)
+		if self._printReportEnd:
+			y = printBand("ReportEnd", y)
 
 		endPage()
 		self.Canvas.showPages()
 		if save:
 			self.save()
 
+	def _getParallelChunks(self, records):
+		"""Split the records into chunks that can be rendered separately.
+
+		The chunks are split where the value of the outermost group changes,
+		which must start on a new page, and where the resetAt value of every
+		report variable changes too, so that no variable carries its value
+		over into the next chunk. Each chunk then renders exactly as it would
+		have in the full report. Returns None if the report can't be split
+		safely.
+		"""
+		_form = self.ReportForm
+		groups = _form.get("groups", ())
+		if not groups or len(records) < 2:
+			return None
+		group = groups[0]
+		if not group.getProp("StartOnNewPage") or group.getProp("StartOnNewColumn"):
+			return None
+		if [g for g in groups[1:] if g.getProp("ResetPageNumber")]:
+			# Page numbering restarts that could span the chunks.
+			return None
+		variables = [v for v in _form.get("variables", ()) if v.get("Name")]
+		# The expressions are evaluated before write() has set up the report
+		# variables, and must not depend on them.
+		self.Variables = CaselessDict()
+
+		chunkSize = max(1, len(records) // (self.Processes * 4))
+		chunks = []
+		start = 0
+		lastKeys = None
+		for idx, record in enumerate(records):
+			self.Record = record
+			keys = [group.getProp("expr")] + [v.getProp("resetAt") for v in variables]
+			if idx - start >= chunkSize and \
+					not [k for k, last in zip(keys, lastKeys) if k == last]:
+				chunks.append(records[start:idx])
+				start = idx
+			lastKeys = keys
+		chunks.append(records[start:])
+		if len(chunks) < 2:
+			return None
+		return chunks
+
+
+	def _writeParallel(self):
+		"""Render the report with a pool of Processes worker processes.
+
+		Returns False, without writing anything, if the report can't be
+		rendered in parallel.
+		"""
+		if PdfFileReader is None:
+			dabo.log.info(_("Install PyPDF2 or pyPdf to render reports in parallel."))
+			return False
+		if self.RecordCount is None:
+			# Splitting a stream would mean reading all of it into memory first.
+			dabo.log.info(_("Streamed cursors are rendered in a single process."))
+			return False
+		records = list(self._getRecordSource())
+		chunks = self._getParallelChunks(records)
+		if chunks is None:
+			dabo.log.info(_("This report can't be split into chunks; rendering it "
+					"in a single process."))
+			return False
+		_form = self.ReportForm
+		formXML = self._getXMLFromForm(_form)
+		settings = {"ReportFormXML": formXML, "HomeDirectory": self.HomeDirectory,
+				"Encoding": self.Encoding, "NoneDisplay": self.NoneDisplay,
+				"ShowBandOutlines": self.ShowBandOutlines}
+		# Without page number resets, each chunk needs to know the page numbers
+		# of the chunks before it, which are only known after rendering them.
+		numberPages = not _form["groups"][0].getProp("ResetPageNumber") and \
+				("PageNumber" in formXML or "PageCount" in formXML)
+		self._cancel = False
+		self._onReportBegin()
+		pool = multiprocessing.Pool(self.Processes)
+		paths = []
+		try:
+			pageCounts = None
+			for renderPass in range(2 if numberPages else 1):
+				tasks = []
+				pageOffset = 0
+				for idx, chunk in enumerate(chunks):
+					chunkSettings = settings.copy()
+					chunkSettings["_printReportBegin"] = (idx == 0)
+					chunkSettings["_printReportEnd"] = (idx == len(chunks) - 1)
+					if pageCounts:
+						chunkSettings["_pageNumberOffset"] = pageOffset
+						chunkSettings["_totalPageCount"] = sum(pageCounts)
+						pageOffset += pageCounts[idx]
+					fd, path = tempfile.mkstemp(suffix=".pdf")
+					os.close(fd)
+					paths.append(path)
+					tasks.append((chunkSettings, chunk, path))
+				self._recordNumber = 0
+				for idx, path in enumerate(pool.imap(_writeReportChunk, tasks)):
+					if self._cancel:
+						pool.terminate()
+						self._onReportCancel()
+						return True
+					self._recordNumber += len(chunks[idx])
+					self._onReportIteration()
+				if numberPages and not pageCounts:
+					pageCounts = []
+					for path in paths:
+						stream = open(path, "rb")
+						pageCounts.append(PdfFileReader(stream).getNumPages())
+						stream.close()
+						os.remove(path)
+					paths = []
+			pool.close()
+			self._mergeFiles(paths)
+		finally:
+			pool.terminate()
+			for path in paths:
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+		self._onReportEnd()
+		return True
+
+
+	def _mergeFiles(self, paths):
+		"""Write the pages of the passed PDF files, in order, to OutputFile."""
+		_form = self.ReportForm
+		writer = PdfFileWriter()
+		streams = []
+		try:
+			for path in paths:
+				stream = open(path, "rb")
+				streams.append(stream)
+				reader = PdfFileReader(stream)
+				for pageNum in range(reader.getNumPages()):
+					writer.addPage(reader.getPage(pageNum))
+			if hasattr(writer, "addMetadata"):
+				writer.addMetadata({"/Author": ustr(_form.getProp("Author")),
+						"/Keywords": ustr(_form.getProp("Keywords")),
+						"/Subject": ustr(_form.getProp("Subject")),
+						"/Title": ustr(_form.getProp("Title"))})
+			outputFile = self.OutputFile
+			if isinstance(outputFile, basestring):
+				out = open(outputFile, "wb")
+				try:
+					writer.write(out)
+				finally:
+					out.close()
+			else:
+				writer.write(outputFile)
+		finally:
+			for stream in streams:
+				stream.close()
+
+
 	def save(self):
 		if self.OutputFile is not None and self._canvas is not None:
 			self._canvas.save()
@@ -2999,6 +3315,23 @@ class ReportWriter(object):
 		self.UseTestCursor = False
 
 
+	def _getRecordSource(self):
+		"""Return an iterable of the records to print from Cursor."""
+		cursor = self.Cursor
+		if hasattr(cursor, "requeryStream"):
+			# A bizobj or dabo cursor: print the records it holds now, with any
+			# filter, sort or unsaved changes, without running its query again.
+			return self._iterDataSet(cursor)
+		return cursor
+
+
+	def _iterDataSet(self, cursor, batchSize=1000):
+		"""Yield the current records of a bizobj or dabo cursor, a batch at a time."""
+		for rowStart in xrange(0, cursor.RowCount, batchSize):
+			for record in cursor.getDataSet(rowStart=rowStart, rows=batchSize):
+				yield record
+
+
 	def _getEncoding(self):
 		try:
 			v = self._encoding
@@ -3069,6 +3402,17 @@ class ReportWriter(object):
 	def _getPageNumber(self):
 		return self._pageNumber
 
+	def _getProcesses(self):
+		try:
+			v = self._processes
+		except AttributeError:
+			v = self._processes = 1
+		return v
+
+	def _setProcesses(self, val):
+		self._processes = max(1, int(val))
+
+
 	def _getRecord(self):
 		try:
 			v = self._record
@@ -3083,6 +3427,24 @@ class ReportWriter(object):
 			self.ReportForm._liveRecord = val
 
 
+	def _getNextRecord(self):
+		try:
+			v = self._nextRecord
+		except AttributeError:
+			v = self._nextRecord = None
+		return v
+
+
+	def _getRecordCount(self):
+		cursor = self.Cursor
+		if hasattr(cursor, "requeryStream"):
+			return cursor.RowCount
+		try:
+			return len(cursor)
+		except TypeError:
+			return None
+
+
 	def _getRecordNumber(self):
 		try:
 			v = self._recordNumber
@@ -3174,6 +3536,14 @@ class ReportWriter(object):
 		self._showBandOutlines = bool(val)
 
 
+	def _getStoryCache(self):
+		try:
+			v = self._storyCache
+		except AttributeError:
+			v = self._storyCache = LRUCache(500)
+		return v
+
+
 	def _getUseTestCursor(self):
 		try:
 			v = self._useTestCursor
@@ -3193,7 +3563,16 @@ class ReportWriter(object):
 		_("Returns a reference to the reportlab canvas object."))
 
 	Cursor = property(_getCursor, _setCursor, None,
-		_("Specifies the data cursor that the report runs against."))
+		_("""Specifies the data cursor that the report runs against.
+
+		This can be a sequence of records, such as a list or a dDataSet, or any
+		iterator or generator that yields them, such as the one returned by
+		dBizobj.requeryStream(), which prints the records as they are fetched
+		so that they are never all in memory at once. A bizobj or dabo cursor
+		can also be set directly, in which case the records it currently holds
+		are printed, as with its getDataSet(), and its query isn't run again.
+		Iterators can only be read once, so set a new one before each call to
+		write()."""))
 
 	CurrentBandName = property(_getCurrentBandName, None, None,
 		_("During a report run, returns the name of the currently printing band."))
@@ -3212,6 +3591,16 @@ class ReportWriter(object):
 		be the directory that contains the report form file. If you set
 		self.ReportFormFile, HomeDirectory will be set for you automatically."""))
 
+	NextRecord = property(_getNextRecord, None, None,
+		_("""Returns the record that follows the current one, or None. (dict)
+
+		During a report run this allows expressions to look ahead one record,
+		for example to tell whether the current record is the last one of its
+		group:
+
+			self.NextRecord is None or self.NextRecord["cArtist"] != self.Record["cArtist"]
+		"""))
+
 	NoneDisplay = property(_getNoneDisplay, _setNoneDisplay, None,
 		_("""Specifies the string displayed if Value is None  (str or None)
 
@@ -3230,6 +3619,20 @@ class ReportWriter(object):
 	PageNumber = property(_getPageNumber, None, None,
 			_("""Returns the current page number at runtime."""))
 
+	Processes = property(_getProcesses, _setProcesses, None,
+		_("""Specifies the number of processes used to render the report. (int)
+
+		When greater than 1 (the default is 1), the records are split into chunks
+		where the value of the first group changes, and the chunks are rendered
+		to separate PDF files by a pool of processes, which are then merged into
+		OutputFile. This requires the PyPDF2 or pyPdf module, a first group that
+		starts on a new page, and variables that are all reset at that group;
+		otherwise, the report is rendered in a single process. Since the report
+		form is copied to the worker processes, its expressions can only refer
+		to the records, the variables and the report writer's properties. On
+		Windows, the calling script needs an 'if __name__ == "__main__":' guard.
+		"""))
+
 	Record = property(_getRecord, _setRecord, None,
 		_("""Specifies the dictionary that represents the current record.
 
@@ -3239,6 +3642,12 @@ class ReportWriter(object):
 			self.Record["cFirst"]
 		"""))
 
+	RecordCount = property(_getRecordCount, None, None,
+		_("""Returns the number of records in Cursor, or None if it isn't known.
+
+		The count isn't known in advance for iterators and generators.
+		(int or None)"""))
+
 	RecordNumber = property(_getRecordNumber, None, None,
 		_("Returns the current record number of Cursor."))
 
@@ -3256,6 +3665,16 @@ class ReportWriter(object):
 		debugging and informational purposes. In addition to the band, there is also
 		a caption with the band name at the x,y origin point for the band."""))
 
+	StoryCache = property(_getStoryCache, None, None,
+		_("""Cache of the paragraph stories made for Memo and Frameset objects. (LRUCache)
+
+		Bands that repeat the same text with the same font, style and frame size
+		reuse the wrapped paragraphs and their heights instead of measuring them
+		again. The cache is cleared at the start of each write(), and its Hits
+		and Misses show how well it works for the report form. It holds up to
+		500 stories by default; set StoryCache.MaxSize to change that, or to 0
+		to disable it."""))
+
 	UseTestCursor = property(_getUseTestCursor, _setUseTestCursor, None,
 		_("Specifies whether the TestCursor in the spec file is used."))
 
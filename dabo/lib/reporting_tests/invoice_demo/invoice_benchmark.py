@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This times the invoice report over a large cursor made from copies of its
+test cursor, and the property reads that the report writer does for each
+record. Pass the number of copies of the test cursor on the command line
+(default 500). The PDF is written to a temporary file.
+"""
+import sys
+import time
+import tempfile
+from dabo.lib.reportWriter import ReportWriter, ReportObject
+
+
+def reportObjects(obj):
+	"""Yield all the report objects in the report form."""
+	if isinstance(obj, ReportObject):
+		yield obj
+	if isinstance(obj, dict):
+		children = obj.values()
+	elif isinstance(obj, list):
+		children = obj
+	else:
+		children = ()
+	for child in children:
+		for desc in reportObjects(child):
+			yield desc
+
+
+copies = 500
+if len(sys.argv) > 1:
+	copies = int(sys.argv[1])
+
+rw = ReportWriter()
+rw.ReportFormFile = "invoice.rfxml"
+rw.UseTestCursor = True
+testCursor = rw.Cursor
+rw.Cursor = testCursor * copies
+rw.OutputFile = tempfile.TemporaryFile()
+
+start = time.time()
+rw.write()
+print "write(): %.2f s for %s records" % (time.time() - start, len(rw.Cursor))
+print "story cache: %s hits, %s misses" % (rw.StoryCache.Hits, rw.StoryCache.Misses)
+
+# Read every expression property of every object once per record, with
+# getProp() and with a plain eval() of the expression, which is what getProp()
+# used to do. Only the props in AvailableProps are expressions; others, such
+# as 'name', are plain values that getProp() doesn't know about.
+rw._liveRecord = rw.Cursor[0]
+props = [(obj, prop) for obj in reportObjects(rw.ReportForm)
+		for prop, val in obj.items() if isinstance(val, basestring)
+		and prop in obj.AvailableProps]
+numRecords = min(len(rw.Cursor), 2000)
+
+start = time.time()
+for rec in xrange(numRecords):
+	for obj, prop in props:
+		obj.getProp(prop)
+print "getProp(): %.2f s for %s props x %s records" % (time.time() - start,
+		len(props), numRecords)
+
+start = time.time()
+for rec in xrange(numRecords):
+	for obj, prop in props:
+		self = obj
+		try:
+			eval(obj[prop])
+		except Exception:
+			pass
+print "eval():    %.2f s for %s props x %s records" % (time.time() - start,
+		len(props), numRecords)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+from decimal import Decimal
+from dabo.lib import dataCodec
+
+
+class Test_DataCodec(unittest.TestCase):
+	def setUp(self):
+		self.data = [{"pk": 1, "name": u"Jos\xe9", "amount": Decimal("10.50"), "rate": 1.5,
+				"born": datetime.date(1970, 5, 4), "stamp": datetime.datetime(2010, 1, 2, 3, 4, 5, 6),
+				"at": datetime.time(13, 30), "active": True, "image": buffer("\x00\x01"),
+				"code": "abc", "big": 2 ** 70},
+				{"pk": 2, "name": None, "amount": None, "rate": None, "born": None,
+				"stamp": None, "at": None, "active": None, "image": None, "code": None,
+				"big": 1}]
+		self.typs = {"pk": int, "name": unicode, "amount": Decimal, "born": datetime.date}
+		self.stru = (("pk", "I", True, "people", "pk", None),)
+
+
+	def testDataSetRoundTrip(self):
+		for level in (0, 6):
+			enc = dataCodec.encodeDataSet(self.data, self.typs, self.stru, compressLevel=level)
+			self.assertTrue(dataCodec.isEncoded(enc))
+			data, typs, stru = dataCodec.decodeDataSet(enc)
+			self.assertEqual(list(data), self.data)
+			self.assertEqual(typs, self.typs)
+			self.assertEqual(stru, self.stru)
+			self.assertTrue(isinstance(data[0]["image"], buffer))
+
+
+	def testMixedAndMissing(self):
+		data = [{"a": 1, "b": u"x"}, {"a": u"one"}, {"a": 2, "b": u"y", "c": 3}, {}]
+		dec = dataCodec.decodeDataSet(dataCodec.encodeDataSet(data))[0]
+		self.assertEqual(list(dec), data)
+		self.assertEqual(len(dataCodec.decodeDataSet(dataCodec.encodeDataSet([]))[0]), 0)
+
+
+	def testValues(self):
+		diff = {123456: ("people", "pk", [{"pk": 1, "amount": (Decimal("1"), Decimal("2.5")),
+				"_tmp": False}], {})}
+		self.assertEqual(dataCodec.decodeValue(dataCodec.encodeValue(diff)), diff)
+		self.assertRaises(TypeError, dataCodec.encodeValue, object())
+
+
+	def testDelta(self):
+		base = [{"id": num, "grp": u"a", "val": num * 10} for num in range(10)]
+		baseVersion, baseSigs = dataCodec.getDataSignatures(base, "id, grp")
+		data = [rec.copy() for rec in base if rec["id"] != 3]
+		data[0]["val"] = -1
+		data.append({"id": 10, "grp": u"b", "val": 100})
+		version, sigs = dataCodec.getDataSignatures(data, "id, grp")
+		self.assertNotEqual(version, baseVersion)
+		self.assertEqual(dataCodec.getDataSignatures(list(data), "id, grp")[0], version)
+		delta = dataCodec.encodeDataDelta(data, "id, grp", version, sigs, baseVersion, baseSigs)
+		self.assertTrue(dataCodec.isDelta(delta))
+		self.assertRaises(ValueError, dataCodec.decodeDataSet, delta)
+		self.assertRaises(ValueError, dataCodec.applyDataDelta, base, delta, "id, grp", version)
+		newData, newVersion = dataCodec.applyDataDelta(base, delta, "id, grp", baseVersion)[:2]
+		self.assertEqual((list(newData), newVersion), (data, version))
+		# The base data set isn't changed.
+		self.assertEqual(base[0]["val"], 0)
+		# A new order is sent with the delta.
+		data.reverse()
+		version, sigs = dataCodec.getDataSignatures(data, "id, grp")
+		delta = dataCodec.encodeDataDelta(data, "id, grp", version, sigs, baseVersion, baseSigs)
+		newData = dataCodec.applyDataDelta(base, delta, "id, grp", baseVersion)[0]
+		self.assertEqual(list(newData), data)
+		# Too many changes for a delta
+		data = [dict(rec, val=0) for rec in base]
+		version, sigs = dataCodec.getDataSignatures(data, "id, grp")
+		self.assertEqual(dataCodec.encodeDataDelta(data, "id, grp", version, sigs,
+				baseVersion, baseSigs), None)
+
+
+	def testInvalidData(self):
+		enc = dataCodec.encodeDataSet(self.data, compressLevel=0)
+		self.assertRaises(ValueError, dataCodec.decodeDataSet, "not encoded")
+		self.assertRaises(ValueError, dataCodec.decodeDataSet, enc[:-3])
+		self.assertRaises(ValueError, dataCodec.decodeDataSet, enc + "x")
+		# A newer version of the format
+		newer = enc[:4] + chr(dataCodec.VERSION + 1) + enc[5:]
+		self.assertRaises(ValueError, dataCodec.decodeDataSet, newer)
+
+
+	def testHostileData(self):
+		def encode(*vals):
+			out = []
+			for val in vals:
+				dataCodec._writeValue(out, val)
+			return dataCodec._finish(out, 6)
+		decodeDataSet = dataCodec.decodeDataSet
+		# Row counts that are negative, or larger than the data could hold.
+		self.assertRaises(ValueError, decodeDataSet, encode(({}, None, [], 10 ** 8)))
+		self.assertRaises(ValueError, decodeDataSet, encode(({}, None, ["a"], -1)))
+		self.assertRaises(ValueError, decodeDataSet, encode(({}, None, ["a"], 10 ** 8), None))
+		# Counts inside the columns that are out of range.
+		badCount = dataCodec._finish(["l", dataCodec._int32.pack(-1)], 0)
+		self.assertRaises(ValueError, dataCodec.decodeValue, badCount)
+		# Values nested too deeply to decode.
+		self.assertRaises(ValueError, dataCodec.decodeValue,
+				dataCodec._finish(["l\x01\x00\x00\x00" * 100000 + "N"], 6))
+		# Compressed data that expands past MAX_DECODED_SIZE.
+		bomb = dataCodec.encodeValue("x" * 100000)
+		maxSize = dataCodec.MAX_DECODED_SIZE
+		dataCodec.MAX_DECODED_SIZE = 1000
+		try:
+			self.assertRaises(ValueError, dataCodec.decodeValue, bomb)
+		finally:
+			dataCodec.MAX_DECODED_SIZE = maxSize
+		self.assertEqual(dataCodec.decodeValue(bomb), "x" * 100000)
+		self.assertRaises(TypeError, dataCodec.encodeDataSet, [{}, {}])
+		self.assertEqual(list(decodeDataSet(dataCodec.encodeDataSet([]))[0]), [])
+
+
+if __name__ == "__main__":
+	suite = unittest.TestLoader().loadTestsFromTestCase(Test_DataCodec)
+	unittest.TextTestRunner(verbosity=2).run(suite)
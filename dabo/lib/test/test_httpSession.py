@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import threading
+import time
+import unittest
+import urllib2
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from cStringIO import StringIO
+from dabo.lib.httpSession import HttpSession
+
+
+def md5(val):
+	return hashlib.md5(val).hexdigest()
+
+
+class Server(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self.respond("")
+
+	def do_POST(self):
+		self.respond(self.rfile.read(int(self.headers["Content-Length"])))
+
+	def respond(self, body):
+		server = self.server
+		server.requests.append(self.path)
+		if self.path == "/missing":
+			return self.send(404, "Not here")
+		if self.path == "/slow":
+			time.sleep(1.5)
+		if self.path == "/drop":
+			# Close the connection without telling the client.
+			self.close_connection = 1
+		if self.path == "/digest" and not self.checkDigest():
+			return self.send(401, "", {"WWW-Authenticate":
+					'Digest realm="dabo", nonce="%s", qop="auth"' % server.nonce})
+		ret = "%s %s" % (self.path, body)
+		headers = {}
+		if "gzip" in self.headers.get("Accept-Encoding", ""):
+			buf = StringIO()
+			zf = gzip.GzipFile(fileobj=buf, mode="wb")
+			zf.write(ret)
+			zf.close()
+			ret = buf.getvalue()
+			headers["Content-Encoding"] = "gzip"
+		self.send(200, ret, headers)
+
+	def checkDigest(self):
+		auth = self.headers.get("Authorization", "")
+		if not auth.startswith("Digest "):
+			return False
+		params = urllib2.parse_keqv_list(urllib2.parse_http_list(auth[7:]))
+		ha1 = md5("user:dabo:secret")
+		ha2 = md5("%s:%s" % (self.command, params["uri"]))
+		expected = md5(":".join((ha1, params["nonce"], params["nc"], params["cnonce"],
+				params["qop"], ha2)))
+		return params["nonce"] == self.server.nonce and params["response"] == expected
+
+	def send(self, code, body, headers={}):
+		self.send_response(code)
+		self.send_header("Content-Length", str(len(body)))
+		for key, val in headers.items():
+			self.send_header(key, val)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+
+class Test_HttpSession(unittest.TestCase):
+	def setUp(self):
+		self.server = Server(("127.0.0.1", 0), Handler)
+		self.server.requests = []
+		self.server.nonce = "abc"
+		thrd = threading.Thread(target=self.server.serve_forever)
+		thrd.setDaemon(True)
+		thrd.start()
+		self.base = "http://127.0.0.1:%s" % self.server.server_port
+		self.session = HttpSession("user", "secret")
+
+
+	def tearDown(self):
+		self.session.close()
+		self.server.shutdown()
+		self.server.server_close()
+
+
+	def testReuse(self):
+		session = self.session
+		self.assertEqual(session.open(self.base + "/a").read(), "/a ")
+		self.assertEqual(session.open(self.base + "/b", "x=1").read(), "/b x=1")
+		req = urllib2.Request(self.base + "/c", "data", {"Content-Type": "text/plain"})
+		resp = session.open(req)
+		self.assertEqual((resp.getcode(), resp.read()), (200, "/c data"))
+		self.assertEqual(resp.info().getheader("Content-Encoding"), "gzip")
+		self.assertEqual((session.ConnectionsOpened, session.RequestCount), (1, 3))
+
+
+	def testRetryNonIdempotent(self):
+		session = self.session
+		session.RetryDelay = 0
+		requests = self.server.requests
+		# The server closed the idle connection without answering: the request
+		# wasn't processed, and is sent again.
+		self.assertEqual(session.open(self.base + "/drop").read(), "/drop ")
+		self.assertEqual(session.open(self.base + "/save", "x=1", idempotent=False).read(),
+				"/save x=1")
+		self.assertEqual(requests.count("/save"), 1)
+		# A request that timed out on a reused connection may have been
+		# processed, and isn't sent again.
+		self.assertRaises(urllib2.URLError, session.open, self.base + "/slow", "x=1",
+				timeout=0.5, idempotent=False)
+		time.sleep(1.5)
+		self.assertEqual(requests.count("/slow"), 1)
+
+
+	def testHttpError(self):
+		try:
+			self.session.open(self.base + "/missing")
+		except urllib2.HTTPError, e:
+			self.assertEqual((e.code, e.read()), (404, "Not here"))
+		else:
+			self.fail("No HTTPError raised")
+		self.session.RetryDelay = 0
+		self.assertRaises(urllib2.URLError, self.session.open, "http://127.0.0.1:1/")
+
+
+	def testDigestAuth(self):
+		session = self.session
+		self.assertEqual(session.open(self.base + "/digest").read(), "/digest ")
+		self.assertEqual(session.open(self.base + "/digest").read(), "/digest ")
+		# Only the first request needed to be challenged.
+		self.assertEqual(len(self.server.requests), 3)
+		self.server.nonce = "def"
+		self.assertEqual(session.open(self.base + "/digest").read(), "/digest ")
+		self.assertRaises(urllib2.HTTPError, HttpSession("user", "wrong").open,
+				self.base + "/digest")
+
+
+	def testOpenMany(self):
+		session = self.session
+		session.MaxConnections = 3
+		urls = [self.base + "/%s" % num for num in range(10)] + [self.base + "/missing"]
+		results = session.openMany(urls)
+		self.assertEqual([resp.read() for resp in results[:-1]],
+				["/%s " % num for num in range(10)])
+		self.assertTrue(isinstance(results[-1], urllib2.HTTPError))
+		self.assertTrue(session.ConnectionsOpened <= 3)
+
+
+if __name__ == "__main__":
+	suite = unittest.TestLoader().loadTestsFromTestCase(Test_HttpSession)
+	unittest.TextTestRunner(verbosity=2).run(suite)
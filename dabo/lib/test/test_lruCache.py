@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import unittest
+from dabo.lib.lruCache import LRUCache
+
+
+class Test_LRUCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = LRUCache(3)
+		for key in "abc":
+			self.cache[key] = key.upper()
+
+
+	def testEviction(self):
+		cache = self.cache
+		# Using "a" makes "b" the least recently used item.
+		self.assertEqual(cache.get("a"), "A")
+		cache["d"] = "D"
+		self.assertEqual(len(cache), 3)
+		self.assertTrue("b" not in cache)
+		self.assertTrue("a" in cache)
+		self.assertRaises(KeyError, cache.__getitem__, "b")
+		cache.MaxSize = 1
+		self.assertEqual(len(cache), 1)
+		self.assertEqual(cache["d"], "D")
+
+
+	def testCounters(self):
+		cache = self.cache
+		cache.get("a")
+		cache.get("x")
+		self.assertEqual(cache.get("b", valid=lambda val: val == "Z"), None)
+		self.assertEqual((cache.Hits, cache.Misses), (1, 2))
+		cache.clear(resetCounts=False)
+		self.assertEqual((len(cache), cache.Hits, cache.Misses), (0, 1, 2))
+		cache.clear()
+		self.assertEqual((len(cache), cache.Hits, cache.Misses), (0, 0, 0))
+
+
+	def testDisabled(self):
+		cache = LRUCache(0)
+		cache["a"] = "A"
+		self.assertEqual(len(cache), 0)
+		self.assertEqual(cache.get("a", "none"), "none")
+
+
+if __name__ == "__main__":
+	suite = unittest.TestLoader().loadTestsFromTestCase(Test_LRUCache)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import json
+import pickle
+import unittest
+import urllib
+import urllib2
+from cStringIO import StringIO
+from mimetools import Message
+from dabo.lib import dataCodec
+from dabo.lib.RemoteConnector import RemoteConnector
+
+
+class Opener(object):
+	"""Stands in for the HttpSession, and answers every request with 'body'."""
+	def __init__(self, body, contentType="text/plain"):
+		self.body = body
+		self.contentType = contentType
+		self.requests = []
+
+	def open(self, req, data=None, idempotent=True):
+		if isinstance(req, basestring):
+			req = urllib2.Request(req, data=data)
+		self.requests.append(req)
+		headers = Message(StringIO("Content-Type: %s\r\n\r\n" % self.contentType))
+		return urllib.addinfourl(StringIO(self.body), headers, req.get_full_url())
+
+
+
+class BizStandIn(object):
+	DataSource = "customer"
+	KeyField = "pk"
+	def setChildLinkFilter(self): pass
+	def getSQL(self): return "select * from customer"
+	def getParams(self): return ()
+	def getPK(self): return 1
+	def _storeData(self, data, typs, stru):
+		self.data = data
+	def getDataDiff(self, allRows=False):
+		return {hash(self): (self.DataSource, self.KeyField, [{"pk": 1, "name": ("a", "b")}], {})}
+
+
+
+class Test_RemoteConnector(unittest.TestCase):
+	def setUp(self):
+		self.biz = BizStandIn()
+		self.conn = RemoteConnector(self.biz)
+		self.conn._baseURL = "http://127.0.0.1"
+
+
+	def sentBinary(self, opener):
+		return opener.requests[-1].headers.get("Content-type") == dataCodec.CONTENT_TYPE
+
+
+	def testJsonServer(self):
+		# A server that doesn't know the binary format is sent JSON.
+		data = [{"pk": 1, "name": "a"}]
+		opener = self.conn._urlOpener = Opener(json.dumps([pickle.dumps(val)
+				for val in (data, {}, ())]))
+		self.assertEqual(self.conn.BinaryProtocol, None)
+		self.conn.save()
+		self.assertFalse(self.sentBinary(opener))
+		self.conn.requery()
+		self.assertEqual(list(self.biz.data), data)
+		self.conn.save()
+		self.assertFalse(self.sentBinary(opener))
+		# Unless the format is forced.
+		self.conn.BinaryProtocol = True
+		self.conn.save()
+		self.assertTrue(self.sentBinary(opener))
+
+
+	def testBinaryServer(self):
+		data = [{"pk": 1, "name": u"a"}]
+		opener = self.conn._urlOpener = Opener(dataCodec.encodeDataSet(data, {}, ()),
+				dataCodec.CONTENT_TYPE)
+		self.conn.requery()
+		self.assertEqual(list(self.biz.data), data)
+		self.conn.save()
+		self.assertTrue(self.sentBinary(opener))
+		self.conn.BinaryProtocol = False
+		self.conn.save()
+		self.assertFalse(self.sentBinary(opener))
+
+
+
+if __name__ == "__main__":
+	suite = unittest.TestLoader().loadTestsFromTestCase(Test_RemoteConnector)
+	unittest.TextTestRunner(verbosity=2).run(suite)
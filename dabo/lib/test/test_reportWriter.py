@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+import dabo
+import dabo.db
+import dabo.biz
+try:
+	from dabo.lib.reportWriter import ReportWriter, PdfFileReader
+except ImportError:
+	# reportlab or PIL isn't installed.
+	ReportWriter = PdfFileReader = None
+
+invoiceDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+		"reporting_tests", "invoice_demo")
+
+
+@unittest.skipIf(PdfFileReader is None, "The report writer needs reportlab, PIL and PyPDF2")
+class Test_ReportWriter(unittest.TestCase):
+	def setUp(self):
+		self.paths = []
+
+
+	def tearDown(self):
+		for path in self.paths:
+			os.remove(path)
+
+
+	def writeInvoice(self, processes, copies=3):
+		"""Render the invoice demo, and return the text of each of its pages."""
+		fd, path = tempfile.mkstemp(suffix=".pdf")
+		os.close(fd)
+		self.paths.append(path)
+		rw = ReportWriter()
+		rw.ReportFormFile = os.path.join(invoiceDir, "invoice.rfxml")
+		rw.HomeDirectory = invoiceDir
+		rw.UseTestCursor = True
+		rw.Cursor = rw.Cursor * copies
+		rw.OutputFile = path
+		rw.Processes = processes
+		parallel = []
+		writeParallel = rw._writeParallel
+		def _writeParallel():
+			parallel.append(writeParallel())
+			return parallel[-1]
+		rw._writeParallel = _writeParallel
+		rw.write()
+		# The report was split, instead of rendered in a single process.
+		self.assertEqual(parallel, [True] if processes > 1 else [])
+		stream = open(path, "rb")
+		try:
+			reader = PdfFileReader(stream)
+			return [reader.getPage(num).extractText() for num in range(reader.getNumPages())]
+		finally:
+			stream.close()
+
+
+	def testParallelWrite(self):
+		pages = self.writeInvoice(1)
+		parallelPages = self.writeInvoice(2)
+		self.assertTrue(len(pages) > 1)
+		self.assertEqual(len(parallelPages), len(pages))
+		self.assertEqual(parallelPages, pages)
+
+
+	def testBizobjCursor(self):
+		con = dabo.db.dConnection(DbType="SQLite", Database=":memory:")
+		biz = dabo.biz.dBizobj(con)
+		biz._CurrentCursor.executescript("""
+create table test (pk INTEGER PRIMARY KEY AUTOINCREMENT, cField CHAR);
+insert into test (cField) values ("Paul");
+insert into test (cField) values ("Ed");
+insert into test (cField) values ("Carl");
+""")
+		biz.KeyField = "pk"
+		biz.DataSource = "test"
+		biz.requery()
+		biz.sort("cField")
+		biz.first()
+		biz.Record.cField = "Carl (unsaved)"
+		rw = ReportWriter()
+		rw.Cursor = biz
+		# The bizobj's current records are printed, without requerying it.
+		self.assertEqual(rw.RecordCount, 3)
+		self.assertEqual([rec["cField"] for rec in rw._getRecordSource()],
+				["Carl (unsaved)", "Ed", "Paul"])
+		self.assertTrue(biz.isChanged())
+
+
+if __name__ == "__main__":
+	suite = unittest.TestLoader().loadTestsFromTestCase(Test_ReportWriter)
+	unittest.TextTestRunner(verbosity=2).run(suite)
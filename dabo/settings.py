@@ -249,6 +249,18 @@ localizeDabo = True
 # values to Decimal automatically?
 convertFloatToDecimal = True
 
+# Directory where the classes generated from .cdxml files are cached, so that
+# they don't have to be parsed and compiled again until the files change. Set
+# to True to use a 'classcache' directory in the user's Dabo data directory.
+# The cache is off when False. Entries for old versions of the files are not
+# removed, so the directory should be cleared from time to time.
+cdxmlCacheDirectory = False
+
+# Seconds to wait for a response from a remote application server, and the
+# number of times a request is retried after a network error.
+remoteTimeout = 30
+remoteRetries = 2
+
 ### Settings - end
 
 
@@ -13,6 +13,7 @@ import dabo
 from dabo.dLocalize import _
 from dabo.lib.utils import ustr
 from dabo.lib import utils
+from dabo.lib.lruCache import LRUCache
 import dabo.dEvents as dEvents
 import dKeys
 
@@ -1686,14 +1687,25 @@ def setPositionInSizer(obj, pos):
 	sz.setPositionInSizer(obj, pos)
 
 
+# Text extents measured by fontMetricFromFont(), keyed on (font, text).
+_fontMetricCache = LRUCache(10000)
+_fontMetricDC = None
+
 def fontMetricFromFont(txt, font):
+	"""
+	Return the width and height of the text in the font. The results are
+	cached, so measuring the same text in the same font again is cheap.
+	"""
+	global _fontMetricDC
 	if isinstance(font, dabo.ui.dFont):
 		font = font._nativeFont
-	wind = wx.Frame(None)
-	dc = wx.ClientDC(wind)
-	dc.SetFont(font)
-	ret = dc.GetTextExtent(txt)
-	wind.Destroy()
+	key = (font.GetNativeFontInfoDesc(), txt)
+	ret = _fontMetricCache.get(key)
+	if ret is None:
+		if _fontMetricDC is None:
+			_fontMetricDC = wx.MemoryDC(wx.EmptyBitmap(1, 1))
+		_fontMetricDC.SetFont(font)
+		ret = _fontMetricCache[key] = tuple(_fontMetricDC.GetTextExtent(txt))
 	return ret
 
 
@@ -26,6 +26,8 @@ class BaseForm(fm.dFormMixin):
 		self._primaryBizobj = None
 		self._dataUpdateDelay = 100
 		self._rowNavigationDelay = 0
+		self._requeryInBackground = False
+		self._lastRequeryResult = False
 
 		# Use this for timing queries and other long-
 		# running events
@@ -56,10 +58,17 @@ class BaseForm(fm.dFormMixin):
 		self.Sizer = dabo.ui.dSizer("vertical")
 		self.Sizer.layout()
 		super(BaseForm, self)._afterInit()
+		self.bindEvent(dEvents.Destroy, self.__onDestroy)
 		if self.RequeryOnLoad:
 			dabo.ui.callAfter(self.requery)
 
 
+	def __onDestroy(self, evt):
+		# Don't leave the background requery connections open once the form is gone.
+		for bizobj in self.bizobjs.values():
+			bizobj.closeRequeryConnection()
+
+
 	def _beforeClose(self, evt=None):
 		"""
 		See if there are any pending changes in the form, if the
@@ -487,9 +496,16 @@ class BaseForm(fm.dFormMixin):
 
 
 	def requery(self, dataSource=None):
-		"""Ask the bizobj to requery."""
+		"""
+		Ask the bizobj to requery. If RequeryInBackground is True, this returns
+		as soon as the query has been started, and the form is updated when the
+		rows have been fetched.
+
+		If the bizobj's rows are shown by grids whose VirtualRows is True, the
+		grids re-read the rows they show instead, and the bizobj isn't
+		requeried, so that a large table isn't fetched in full.
+		"""
 		self.dataSourceParameter = dataSource
-		ret = False
 		bizobj = self.getBizobj(dataSource)
 		if bizobj is None:
 			# Running in preview or some other non-live mode
@@ -501,6 +517,9 @@ class BaseForm(fm.dFormMixin):
 		if err:
 			self.notifyUser(err)
 			return
+		grids = self._getVirtualGrids(bizobj)
+		if grids:
+			return self._refreshDataWindows(grids)
 		if not self.confirmChanges(bizobjs=bizobj):
 			# A False from confirmChanges means "don't proceed"
 			return
@@ -508,15 +527,91 @@ class BaseForm(fm.dFormMixin):
 		## A user-initiated requery should expire the cache on child bizobjs too:
 		bizobj.expireCache()
 
+		self.StatusText = _("Please wait... requerying dataset...")
+		self.stopWatch.Start()
+		if self.RequeryInBackground:
+			bizobj.bindEvent(dEvents.RequeryProgress, self._onRequeryProgress)
+			callback = lambda err: self._afterBizobjRequery(bizobj, oldRowNumber, err)
+			if bizobj.requeryAsync(callback, dabo.ui.callAfter):
+				return True
+			# The bizobj had to requery synchronously, and has already called back.
+			return self._lastRequeryResult
+		try:
+			bizobj.requery()
+		except dException.dException, e:
+			return self._afterBizobjRequery(bizobj, oldRowNumber, e)
+		return self._afterBizobjRequery(bizobj, oldRowNumber)
+
+
+	def _getVirtualGrids(self, bizobj):
+		"""Return the grids of the form that show the bizobj's rows through a data window."""
+		ret = []
+		def collect(obj):
+			for child in obj.Children:
+				if isinstance(child, dabo.ui.dGrid):
+					if child.VirtualRows and child.getBizobj() is bizobj:
+						ret.append(child)
+				elif isinstance(child, dabo.ui.dPemMixin):
+					collect(child)
+		collect(self)
+		return ret
+
+
+	def _refreshDataWindows(self, grids):
+		"""Re-read the rows of the virtual grids, in place of requerying their bizobj."""
+		self.StatusText = _("Please wait... requerying dataset...")
+		self.stopWatch.Start()
+		ret = False
 		try:
-			self.StatusText = _("Please wait... requerying dataset...")
-#			busy = dabo.ui.busyInfo(_("Please wait... requerying dataset..."))
-			self.stopWatch.Start()
-#			response = dProgressDialog.displayAfterWait(self, 2, bizobj.requery)
-			response = bizobj.requery()
+			for grid in grids:
+				grid.refreshDataWindow()
+			rc = grids[0].getDataWindow().RowCount
+			self.stopWatch.Pause()
+			elapsed = round(self.stopWatch.Time() / 1000.0, 3)
+			ret = True
+			plcnt = rc == 1 and " " or "s "
+			plelap = elapsed == 1 and "." or "s."
+			self.StatusText = (
+					_("%(rc)s record%(plcnt)sselected in %(elapsed)s second%(plelap)s") % locals())
+		except dException.DBQueryException, e:
+			dabo.log.error(_("Database Execution failed with response: %s") % e)
+			self.notifyUser(ustr(e), title=_("Database Action Failed"), severe=True, exception=e)
+			self.StatusText = ""
+		self.afterRequery()
+		self._lastRequeryResult = ret
+		return ret
+
+
+	def cancelRequery(self, dataSource=None):
+		"""
+		Cancel the background requery of the bizobj, if one is running. Returns
+		True if there was a requery to cancel.
+		"""
+		bizobj = self.getBizobj(dataSource)
+		if bizobj is None:
+			return False
+		return bizobj.cancelRequery()
+
+
+	def _onRequeryProgress(self, evt):
+		self.StatusText = _("Please wait... %s records fetched...") % evt.EventData["rowCount"]
+
+
+	def _afterBizobjRequery(self, bizobj, oldRowNumber, err=None):
+		"""Update the form after the bizobj's requery has finished or failed."""
+		if not self:
+			# The form was closed while the requery was running.
+			return False
+		if isinstance(err, dException.DBQueryCancelledException) and bizobj.IsRequerying:
+			# A newer requery has taken its place.
+			return False
+		bizobj.unbindEvent(dEvents.RequeryProgress, self._onRequeryProgress)
+		ret = False
+		try:
+			if err is not None:
+				raise err
 			self.stopWatch.Pause()
 			elapsed = round(self.stopWatch.Time() / 1000.0, 3)
-#			del busy
 			self.update()
 
 			newRowNumber = bizobj.RowNumber
@@ -534,6 +629,9 @@ class BaseForm(fm.dFormMixin):
 			self.StatusText = (
 					_("%(rc)s record%(plcnt)sselected in %(elapsed)s second%(plelap)s") % locals())
 
+		except dException.DBQueryCancelledException, e:
+			self.StatusText = _("Requery cancelled.")
+
 		except dException.MissingPKException, e:
 			self.notifyUser(ustr(e), title=_("Requery Failed"), severe=True, exception=e)
 			self.StatusText = ""
@@ -556,6 +654,7 @@ class BaseForm(fm.dFormMixin):
 
 		self.afterRequery()
 		self.refresh()
+		self._lastRequeryResult = ret
 		return ret
 
 
@@ -934,6 +1033,13 @@ Database error message: %s""") % 	err
 		self._requeryOnLoad = bool(value)
 
 
+	def _getRequeryInBackground(self):
+		return self._requeryInBackground
+
+	def _setRequeryInBackground(self, val):
+		self._requeryInBackground = bool(val)
+
+
 	def _getRowNavigationDelay(self):
 		return self._rowNavigationDelay
 
@@ -986,6 +1092,15 @@ Database error message: %s""") % 	err
 			_("""Specifies whether an automatic requery happens when the
 			form is loaded.  (bool)"""))
 
+	RequeryInBackground = property(_getRequeryInBackground, _setRequeryInBackground, None,
+			_("""Specifies whether requery() runs the query on a worker thread, so that
+			the form stays responsive while the rows are fetched. (bool; default:False)
+
+			The status bar shows the number of rows fetched so far, and
+			cancelRequery() stops the requery, leaving the data unchanged. The
+			form is updated, and afterRequery() is called, once the rows have
+			been loaded."""))
+
 	RowNavigationDelay = property(_getRowNavigationDelay, _setRowNavigationDelay, None,
 			_("""Specifies optional delay to wait for updating the entire form when the user
 			is navigating the records. (int; default=0 [ms])
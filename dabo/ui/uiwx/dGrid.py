@@ -2,9 +2,11 @@
 import copy
 import sys
 import datetime
+import heapq
 import locale
 import time
 import operator
+import random
 import re
 import warnings
 from decimal import Decimal
@@ -27,6 +29,7 @@ import dabo.biz
 import dabo.dColors as dColors
 from dabo.dObject import dObject
 import dabo.lib.dates
+from dabo.lib.lruCache import LRUCache
 from dabo.lib.utils import noneSortKey, caseInsensitiveSortKey
 from dabo.dBug import loggit
 
@@ -39,16 +42,72 @@ decimalPoint = None
 
 
 class dGridDataTable(wx.grid.PyGridTableBase):
+	# The cell caches hold the visible rows, plus this many screenfuls of rows
+	# above and below them.
+	cacheMargin = 1
 
 	def __init__(self, parent):
 		super(dGridDataTable, self).__init__()
-		self._clearCache()
+		self.__cachedVals = LRUCache(1000)
+		self.__cachedAttrs = LRUCache(1000)
+		self._cacheBizobj = None
 		self.grid = parent
 		self._initTable()
 
 	def _clearCache(self):
-		self.__cachedVals = {}
-		self.__cachedAttrs = {}
+		self.__cachedVals.clear(resetCounts=False)
+		self.__cachedAttrs.clear(resetCounts=False)
+
+
+	def _clearCachedRow(self, row):
+		for cache in (self.__cachedVals, self.__cachedAttrs):
+			for col in xrange(len(self.colDefs)):
+				if (row, col) in cache:
+					del cache[(row, col)]
+
+
+	def _sizeCache(self):
+		"""Size the cell caches to fit the grid's viewport, plus the margin."""
+		grid = self.grid
+		visibleRows = grid.GetClientSize()[1] // max(grid.RowHeight, 1) + 1
+		size = visibleRows * (1 + 2 * self.cacheMargin) * max(len(self.colDefs), 1)
+		self.__cachedVals.MaxSize = self.__cachedAttrs.MaxSize = size
+
+
+	def _setCacheBizobj(self, bizobj):
+		"""
+		Listen to the DataSetChanged events of the bizobj, so that the cells
+		it changes are dropped from the caches.
+		"""
+		old = self._cacheBizobj
+		if bizobj is old:
+			return
+		if old is not None:
+			old.unbindEvent(dEvents.DataSetChanged, self._onDataSetChanged)
+		if bizobj is not None:
+			bizobj.bindEvent(dEvents.DataSetChanged, self._onDataSetChanged)
+		self._cacheBizobj = bizobj
+		self._clearCache()
+
+
+	def _onDataSetChanged(self, evt):
+		row = evt.EventData["row"]
+		if row is None:
+			self._clearCache()
+			# The bizobj's query or cursor may have changed.
+			self.grid._dataWindow = None
+		else:
+			# Dynamic properties and virtual fields can depend on any field
+			# of the row, so all of its cells are dropped.
+			self._clearCachedRow(row)
+
+
+	def _getCacheStats(self):
+		vals = self.__cachedVals
+		attrs = self.__cachedAttrs
+		return {"maxSize": vals.MaxSize, "values": len(vals), "valueHits": vals.Hits,
+				"valueMisses": vals.Misses, "attrs": len(attrs), "attrHits": attrs.Hits,
+				"attrMisses": attrs.Misses}
 
 	def _initTable(self):
 		self.colDefs = []
@@ -63,10 +122,8 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 			return self.grid._defaultGridColAttr.Clone()
 
 		cv = self.__cachedAttrs.get((row, col))
-		if cv:
-			diff = time.time() - cv[1]
-			if diff < 10:  ## if it's been less than this # of seconds.
-				return cv[0].Clone()
+		if cv is not None:
+			return cv.Clone()
 
 		dcol = self.grid.Columns[col]
 		dcol._updateCellDynamicProps(row)
@@ -92,7 +149,7 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 
 		# Prevents overwriting when a long cell has None in the one next to it.
 		attr.SetOverflow(False)
-		self.__cachedAttrs[(row, col)] = (attr.Clone(), time.time())
+		self.__cachedAttrs[(row, col)] = attr.Clone()
 		return attr
 
 
@@ -219,8 +276,11 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 		# Get the data from the grid.
 		bizobj = self.grid.getBizobj()
 
+		self._setCacheBizobj(bizobj)
 		if bizobj:
-			dataSet = bizobj
+			dataSet = self.grid.getDataWindow()
+			if dataSet is None:
+				dataSet = bizobj
 			_newRowCount = dataSet.RowCount
 			self._bizobj = bizobj
 		else:
@@ -239,6 +299,7 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 		if _oldRowCount == _newRowCount and not force:
 			return _newRowCount
 
+		self._sizeCache()
 		self.grid._syncRowCount()
 		# Column widths come from multiple places. In decreasing precedence:
 		#	1) dApp user settings,
@@ -257,8 +318,9 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 
 			if width is None or (width < 0):
 				# 3) Have the grid autosize:
-				self.grid.autoSizeCol(gridCol)
+				self.grid._autoSizeAfterPaint(gridCol)
 			else:
+				self.grid._pendingAutoSize.discard(gridCol)
 				col.Width = width
 
 		# Show the row labels, if any
@@ -299,11 +361,9 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 			dynamicUpdate=True, _fromGridEditor=False):
 		col = self._convertWxColNumToDaboColNum(col)
 		if useCache and not _fromGridEditor:
-			cv = self.__cachedVals.get((row, col))
-			if cv:
-				diff = time.time() - cv[1]
-				if diff < 10:  ## if it's been less than this # of seconds.
-					return cv[0]
+			cv = self.__cachedVals.get((row, col), self)
+			if cv is not self:
+				return cv
 
 		if col is None:
 			# No corresponding Dabo column for this column; must be not visible.
@@ -317,10 +377,13 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 			col_obj._updateCellDynamicProps(row)
 		ret = ""
 		if bizobj:
-			if field and (row < bizobj.RowCount):
+			dataSet = self.grid.getDataWindow()
+			if dataSet is None:
+				dataSet = bizobj
+			if field and (row < dataSet.RowCount):
 				try:
-					ret = bizobj.getFieldVal(field, row)
-				except dException.FieldNotFoundException:
+					ret = dataSet.getFieldVal(field, row)
+				except (dException.FieldNotFoundException, dException.RowNotFoundException):
 					pass
 				if not _fromGridEditor:
 					ret = self.getStringValue(ret)
@@ -332,7 +395,7 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 		if ret is None and convertNoneToString:
 			ret = self.grid.NoneDisplay
 		if not _fromGridEditor:
-			self.__cachedVals[(row, col)] = (ret, time.time())
+			self.__cachedVals[(row, col)] = ret
 		return ret
 
 
@@ -350,7 +413,7 @@ class dGridDataTable(wx.grid.PyGridTableBase):
 		self.grid._setCellValue(row, col, value)
 		if not _fromGridEditor:
 			# Update the cache
-			self.__cachedVals[(row, col)] = (value, time.time())
+			self.__cachedVals[(row, col)] = value
 		self.grid.afterCellEdit(row, col)
 
 
@@ -1440,6 +1503,11 @@ class dColumn(dabo.ui.dPemMixinBase.dPemMixinBase):
 			return None
 		biz = grid.getBizobj()
 		if self.DataField:
+			win = grid.getDataWindow()
+			if win is not None:
+				if grid.CurrentRow < win.RowCount:
+					return win.getFieldVal(self.DataField, grid.CurrentRow)
+				return None
 			if biz and (grid.CurrentRow < biz.RowCount):
 				return biz.getFieldVal(self.DataField)
 			if grid.DataSet:
@@ -1824,6 +1892,12 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		self._refreshAfterSort = True
 		# Local count of rows in the data table
 		self._tableRows = 0
+		# When VirtualRows is True, the rows come from a dDataWindow of the bizobj.
+		self._virtualRows = False
+		self._virtualPageSize = 200
+		self._dataWindow = None
+		self._dataWindowBizobj = None
+		self._editableBeforeVirtual = False
 		# List of visible columns
 		self._daboVisibleColumns = []
 
@@ -1848,6 +1922,10 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 
 		# Flag to indicate we are auto-sizing all columns
 		self._inAutoSizeLoop = False
+		# Columns to auto-size once the grid has been painted
+		self._pendingAutoSize = set()
+		self._painted = False
+		self._autoSizeSampleSize = 500
 		# Flag to indicate we are in a range selection event
 		self._inRangeSelect = False
 		# Flag to indicate we are in a selection update event
@@ -2036,6 +2114,7 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		header.Bind(wx.EVT_RIGHT_UP, self.__onWxHeaderMouseRightUp)
 		header.Bind(wx.EVT_MOTION, self.__onWxHeaderMouseMotion)
 		header.Bind(wx.EVT_PAINT, self.__onWxHeaderPaint)
+		self.GetGridWindow().Bind(wx.EVT_PAINT, self.__onWxGridWindowPaint)
 		header.Bind(wx.EVT_CONTEXT_MENU, self.__onWxHeaderContextMenu)
 		header.Bind(wx.EVT_ENTER_WINDOW, self.__onWxHeaderMouseEnter)
 		header.Bind(wx.EVT_LEAVE_WINDOW, self.__onWxHeaderMouseLeave)
@@ -2480,6 +2559,8 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 
 	def _onDestroy(self, evt):
 		self.saveDataSet()
+		# Stop listening to the bizobj.
+		self._Table._setCacheBizobj(None)
 
 	def _onGridResize(self, evt):
 		# Prevent unnecessary event processing.
@@ -2490,6 +2571,7 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		if updCol:
 			self._lastSize = evt._uiEvent.Size
 			dabo.ui.callAfter(self._updateColumnWidths)
+			self._Table._sizeCache()
 
 
 	def _totalContentWidth(self, addScrollBar=False):
@@ -2619,8 +2701,10 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			if not colObj.Visible:
 				## wx knows nothing about Dabo's invisible columns
 				return
-			idx = self._convertDaboColNumToWxColNum(idx)
-			autoWidth = self.GetColSize(idx)
+			if sampleSize:
+				autoWidth = self._getSampleWidth(idx)
+			else:
+				autoWidth = self.GetColSize(self._convertDaboColNumToWxColNum(idx))
 
 			# Account for the width of the header caption:
 			cw = dabo.ui.fontMetricFromFont(colObj.Caption,
@@ -2631,10 +2715,13 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			if persist:
 				colObj._persist("Width")
 
-		try:
-			self.AutoSizeColumn(self._convertDaboColNumToWxColNum(colNum), setAsMin=False)
-		except (TypeError, wx.PyAssertionError):
-			pass
+		sampleSize = self.AutoSizeSampleSize
+		if not sampleSize:
+			try:
+				self.AutoSizeColumn(self._convertDaboColNumToWxColNum(colNum), setAsMin=False)
+			except (TypeError, wx.PyAssertionError):
+				pass
+		self._pendingAutoSize.discard(colNum)
 		if colNum > -1:
 			_setColSize(colNum)
 
@@ -2644,6 +2731,96 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			self._updateColumnWidths()
 
 
+	def _autoSizeAfterPaint(self, colNum):
+		"""
+		Auto-size the column once the grid has been painted, so that the
+		data shows up before the column widths are worked out.
+		"""
+		if not self.AutoSizeSampleSize:
+			self.autoSizeCol(colNum)
+			return
+		self._pendingAutoSize.add(colNum)
+		if self._painted:
+			dabo.ui.callAfter(self._autoSizePending)
+
+
+	def _autoSizePending(self):
+		"""Auto-size the columns that are waiting for it."""
+		cols = sorted(self._pendingAutoSize)
+		self._pendingAutoSize.clear()
+		cols = [colNum for colNum in cols if colNum < len(self.Columns)]
+		if not cols:
+			return
+		self.BeginBatch()
+		self._inAutoSizeLoop = True
+		for colNum in cols:
+			self.autoSizeCol(colNum)
+		self._updateColumnWidths()
+		self.EndBatch()
+		self._inAutoSizeLoop = False
+		self.refresh()
+
+
+	def _getSampleWidth(self, colNum):
+		"""Return the width needed to show the sampled values of the column."""
+		## breathing room around the cell text:
+		cellBuffer = 10
+		font = self.Columns[colNum].Font
+		widths = [dabo.ui.fontMetricFromFont(txt, font)[0]
+				for txt in self._getAutoSizeSample(colNum)]
+		return max(widths or [0]) + cellBuffer
+
+
+	def _getAutoSizeSample(self, colNum):
+		"""
+		Return the display text of a sample of at most AutoSizeSampleSize of
+		the column's values: those of the visible rows, the longest ones, and
+		a random selection of the rest. Virtual rows are only sampled from the
+		visible rows, since other rows would have to be fetched.
+		"""
+		sampleSize = self.AutoSizeSampleSize
+		rowCount = self.RowCount
+		if rowCount <= sampleSize and not self.VirtualRows:
+			rows = xrange(rowCount)
+		else:
+			top = max(0, self.YToRow(self.CalcUnscrolledPosition(0, 0)[1]))
+			visible = self.GetGridWindow().GetClientSize()[1] // max(self.RowHeight, 1) + 1
+			rows = set(xrange(top, min(top + visible, rowCount)))
+			if not self.VirtualRows:
+				longest = (sampleSize - len(rows)) // 2
+				if longest > 0:
+					rows.update(self._getLongestRows(self.Columns[colNum].DataField, longest))
+				rest = sampleSize - len(rows)
+				if rest > 0:
+					rows.update(random.sample(xrange(rowCount), rest))
+		getValue = self._Table.GetValue
+		wxCol = self._convertDaboColNumToWxColNum(colNum)
+		return [ustr(getValue(row, wxCol, dynamicUpdate=False)) for row in rows]
+
+
+	def _getLongestRows(self, fld, count):
+		"""Return the rows that have the longest values in the field."""
+		biz = self.getBizobj()
+		if biz:
+			if fld in biz.VirtualFields:
+				# Too expensive to calculate for every row.
+				return []
+			vals = biz.iterFieldVals(fld)
+		elif self.DataSet:
+			vals = (rec.get(fld) for rec in self.DataSet)
+		else:
+			return []
+		def valLen(val):
+			if val is None:
+				return 0
+			if isinstance(val, basestring):
+				return len(val)
+			return len(ustr(val))
+		# Measure the values as they are read, instead of copying them first.
+		longest = heapq.nlargest(count, enumerate(vals), key=lambda item: valLen(item[1]))
+		return [row for row, val in longest]
+
+
 	def _paintHeader(self, updateBox=None):
 		"""
 		This method handles all of the display for the header, including writing
@@ -2964,7 +3141,11 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 				eventData=eventData)
 
 		biz = self.getBizobj()
-		if columnToSort is not None:
+		win = self.getDataWindow()
+		if win is not None and not self.customSort:
+			# Let the database sort the rows.
+			win.sort(columnToSort, sortOrder, self.caseSensitiveSorting)
+		elif columnToSort is not None:
 			if self.customSort:
 				# Grids tied to bizobj cursors may want to use their own sorting.
 				self.sort()
@@ -3045,7 +3226,9 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 				self.DataSet = newRows
 				self._settingDataSetFromSort = False
 
-		if biz:
+		if win is not None:
+			dabo.ui.setAfter(self, "CurrentRow", 0)
+		elif biz:
 			dabo.ui.setAfter(self, "CurrentRow", biz.RowNumber)
 
 		if self._refreshAfterSort:
@@ -3091,87 +3274,94 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		self.currSearchStr = ""
 		near = self.searchNearest
 		caseSensitive = self.searchCaseSensitive
-		# Copy the specified field vals and their row numbers to a list, and
-		# add those lists to the sort list
-		sortList = []
-		for i in range(0, self.RowCount):
-			if biz:
-				val = biz.getFieldVal(fld, i, _forceNoCallback=True)
-			else:
-				val = self.DataSet[i][fld]
-			sortList.append( [val, i] )
-
-		# Determine if we are seeking string values
-		compString = False
-		for row in sortList:
-			if row[0] is not None:
-				compString = isinstance(row[0], basestring)
-				break
-
-		if not compString:
-			# coerce srchVal to be the same type as the field type
-			listval = sortList[0][0]
-			if isinstance(listval, int):
-				try:
-					srchVal = int(srchVal)
-				except ValueError:
-					srchVal = int(0)
-			elif isinstance(listval, long):
-				try:
-					srchVal = long(srchVal)
-				except ValueError:
-					srchVal = long(0)
-			elif isinstance(listval, float):
-				try:
-					srchVal = float(srchVal)
-				except ValueError:
-					srchVal = float(0)
-			elif isinstance(listval, (datetime.datetime, datetime.date, datetime.time)):
-				# We need to convert the sort vals into strings
-				sortList = [(ustr(vv), i) for vv, i in sortList]
-				compString = True
-
-		# Now iterate through the list to find the matching value. I know that
-		# there are more efficient search algorithms, but for this purpose, we'll
-		# just use brute force
-		if compString:
-			if caseSensitive:
-				mtchs = [vv for vv in sortList
-						if isinstance(vv[0], basestring) and vv[0].startswith(srchVal)]
-			else:
-				srchVal = srchVal.lower()
-				mtchs = [vv for vv in sortList
-						if isinstance(vv[0], basestring) and vv[0].lower().startswith(srchVal)]
-		else:
-			mtchs = [vv for vv in sortList
-					if vv[0] == srchVal]
-		if mtchs:
-			# The row num is the second element. We want the first row in
-			# the list, since it will still be sorted.
-			newRow = mtchs[0][1]
+		win = self.getDataWindow()
+		if win is not None:
+			# Let the database find the row.
+			row = self._seekDataWindow(win, gridCol, fld, srchVal)
+			if row is not None:
+				newRow = row
 		else:
-			for fldval, row in sortList:
-				if not compString or caseSensitive:
-					match = (fldval == srchVal)
+			# Copy the specified field vals and their row numbers to a list, and
+			# add those lists to the sort list
+			sortList = []
+			for i in range(0, self.RowCount):
+				if biz:
+					val = biz.getFieldVal(fld, i, _forceNoCallback=True)
 				else:
-					# Case-insensitive string search.
-					match = (isinstance(fldval, basestring) and fldval.lower() == srchVal)
-				if match:
-					newRow = row
+					val = self.DataSet[i][fld]
+				sortList.append( [val, i] )
+
+			# Determine if we are seeking string values
+			compString = False
+			for row in sortList:
+				if row[0] is not None:
+					compString = isinstance(row[0], basestring)
 					break
+
+			if not compString:
+				# coerce srchVal to be the same type as the field type
+				listval = sortList[0][0]
+				if isinstance(listval, int):
+					try:
+						srchVal = int(srchVal)
+					except ValueError:
+						srchVal = int(0)
+				elif isinstance(listval, long):
+					try:
+						srchVal = long(srchVal)
+					except ValueError:
+						srchVal = long(0)
+				elif isinstance(listval, float):
+					try:
+						srchVal = float(srchVal)
+					except ValueError:
+						srchVal = float(0)
+				elif isinstance(listval, (datetime.datetime, datetime.date, datetime.time)):
+					# We need to convert the sort vals into strings
+					sortList = [(ustr(vv), i) for vv, i in sortList]
+					compString = True
+
+			# Now iterate through the list to find the matching value. I know that
+			# there are more efficient search algorithms, but for this purpose, we'll
+			# just use brute force
+			if compString:
+				if caseSensitive:
+					mtchs = [vv for vv in sortList
+							if isinstance(vv[0], basestring) and vv[0].startswith(srchVal)]
 				else:
-					if near:
-						newRow = row
-					# If we are doing a near search, see if the row is less than the
-					# requested matching value. If so, update the value of 'ret'. If not,
-					# we have passed the matching value, so there's no point in
-					# continuing the search, but we mu
-					if compString and not caseSensitive and isinstance(fldval, basestring):
-						toofar = fldval.lower() > srchVal
+					srchVal = srchVal.lower()
+					mtchs = [vv for vv in sortList
+							if isinstance(vv[0], basestring) and vv[0].lower().startswith(srchVal)]
+			else:
+				mtchs = [vv for vv in sortList
+						if vv[0] == srchVal]
+			if mtchs:
+				# The row num is the second element. We want the first row in
+				# the list, since it will still be sorted.
+				newRow = mtchs[0][1]
+			else:
+				for fldval, row in sortList:
+					if not compString or caseSensitive:
+						match = (fldval == srchVal)
 					else:
-						toofar = fldval > srchVal
-					if toofar:
+						# Case-insensitive string search.
+						match = (isinstance(fldval, basestring) and fldval.lower() == srchVal)
+					if match:
+						newRow = row
 						break
+					else:
+						if near:
+							newRow = row
+						# If we are doing a near search, see if the row is less than the
+						# requested matching value. If so, update the value of 'ret'. If not,
+						# we have passed the matching value, so there's no point in
+						# continuing the search, but we mu
+						if compString and not caseSensitive and isinstance(fldval, basestring):
+							toofar = fldval.lower() > srchVal
+						else:
+							toofar = fldval > srchVal
+						if toofar:
+							break
 		self.CurrentRow = newRow
 
 		if self.Form is not None:
@@ -3185,6 +3375,41 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		self.currSearchStr = ""
 
 
+	def _seekDataWindow(self, win, gridCol, fld, srchVal):
+		"""
+		Return the row of the data window that the incremental search finds,
+		or None if there is no match. The rows are sorted on the column first,
+		so that the database can find the value.
+		"""
+		if not win.RowCount:
+			return None
+		if win.SortColumn != fld:
+			self.processSort(gridCol, toggleSort=False)
+			if win.SortColumn != fld:
+				return None
+		# The first rows may be NULL, so the type comes from the cursor, or from
+		# the DataStructure if the bizobj hasn't been requeried.
+		typ = win.Cursor.getDataTypes().get(fld) or self.typeFromDataField(fld)
+		if isinstance(typ, type) and not issubclass(typ, basestring):
+			# Coerce the search value to the type of the field
+			try:
+				srchVal = typ(srchVal)
+			except (ValueError, TypeError, ArithmeticError):
+				return None
+		row = win.seek(srchVal, fld)
+		if not self.searchNearest:
+			found = win.getFieldVal(fld, row)
+			if isinstance(found, basestring) and isinstance(srchVal, basestring):
+				if not self.searchCaseSensitive:
+					found = found.lower()
+					srchVal = srchVal.lower()
+				if not found.startswith(srchVal):
+					return None
+			elif found != srchVal:
+				return None
+		return row
+
+
 	def addToSearchStr(self, key):
 		"""
 		Add a character to the current incremental search.
@@ -3552,6 +3777,39 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		return None
 
 
+	def getDataWindow(self):
+		"""
+		Return the dDataWindow that the rows of the grid come from when
+		VirtualRows is True, or None if the grid isn't showing virtual rows.
+		"""
+		if not self._virtualRows:
+			return None
+		biz = self.getBizobj()
+		if biz is None:
+			return None
+		win = self._dataWindow
+		if win is None or self._dataWindowBizobj is not biz:
+			win = self._dataWindow = biz.getDataWindow(pageSize=self._virtualPageSize)
+			self._dataWindowBizobj = biz
+			if self.sortedColumn:
+				win.sort(self.sortedColumn, self.sortOrder, self.caseSensitiveSorting)
+		return win
+
+
+	def refreshDataWindow(self):
+		"""
+		Re-read the rows of the grid from the database when VirtualRows is
+		True, without requerying the bizobj. Call this, instead of the bizobj's
+		requery(), after the bizobj's query or parameters have changed.
+		"""
+		if not self._virtualRows:
+			return
+		# The bizobj's query or parameters may have changed.
+		self._dataWindow = None
+		self._Table._clearCache()
+		self.fillGrid(True)
+
+
 	def setRowHeight(self, row, ht):
 		"""Explicitly set the height of a specific row in the grid. If
 		SameSizeRows is True, all rows will be affected.
@@ -3576,8 +3834,11 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		"""
 		Sync the CurrentRow of the grid to the RowNumber of the bizobj.
 
-		Has no effect if the grid's DataSource isn't a link to a bizobj.
+		Has no effect if the grid's DataSource isn't a link to a bizobj, or if
+		the grid shows VirtualRows.
 		"""
+		if self._virtualRows:
+			return
 		try:
 			self.CurrentRow = self.getBizobj().RowNumber
 		except AttributeError:
@@ -3973,7 +4234,10 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			dabo.ui.callAfter(self.EnableCellEditControl)
 		if oldRow != newRow:
 			bizobj = self.getBizobj()
-			if bizobj and not self._dataSourceBeingSet:
+			if self._virtualRows:
+				# The rows of the grid aren't the rows of the bizobj.
+				pass
+			elif bizobj and not self._dataSourceBeingSet:
 				# Don't run any of this code if this is the initial setting of the DataSource
 				if bizobj.RowCount > newRow and bizobj.RowNumber != newRow:
 					if self._mediateRowNumberThroughForm and isinstance(self.Form, dabo.ui.dForm):
@@ -4407,6 +4671,14 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 		self._paintHeader(updateBox)
 
 
+	def __onWxGridWindowPaint(self, evt):
+		evt.Skip()
+		if not self._painted:
+			self._painted = True
+			if self._pendingAutoSize:
+				dabo.ui.callAfter(self._autoSizePending)
+
+
 	def _getColRowForPosition(self, pos):
 		"""Used in the mouse event handlers to stuff the col, row into EventData."""
 		col = self.getColNumByX(pos[0])
@@ -4510,6 +4782,20 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			self._properties["AutoAdjustHeaderHeight"] = val
 
 
+	def _getAutoSizeSampleSize(self):
+		return self._autoSizeSampleSize
+
+	def _setAutoSizeSampleSize(self, val):
+		if self._constructed():
+			self._autoSizeSampleSize = val
+		else:
+			self._properties["AutoSizeSampleSize"] = val
+
+
+	def _getCellCacheStats(self):
+		return self._Table._getCacheStats()
+
+
 	def _getCellHighlightWidth(self):
 		return self.GetCellHighlightPenWidth()
 
@@ -4679,7 +4965,11 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 
 	def _setEditable(self, val):
 		if self._constructed():
-			self.EnableEditing(val)
+			if self._virtualRows:
+				# Virtual rows can't be edited; this applies when VirtualRows is reset.
+				self._editableBeforeVirtual = val
+			else:
+				self.EnableEditing(val)
 		else:
 			self._properties["Editable"] = val
 
@@ -4837,6 +5127,10 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 
 
 	def _getRowCount(self):
+		win = self.getDataWindow()
+		if win is not None:
+			self._tableRows = win.RowCount
+			return self._tableRows
 		try:
 			self._tableRows = self.getBizobj().RowCount
 		except AttributeError:
@@ -5156,6 +5450,38 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			self._properties["VerticalScrolling"] = val
 
 
+	def _getVirtualPageSize(self):
+		return self._virtualPageSize
+
+	def _setVirtualPageSize(self, val):
+		if self._constructed():
+			self._virtualPageSize = val
+			if self._dataWindow is not None:
+				self._dataWindow.PageSize = val
+		else:
+			self._properties["VirtualPageSize"] = val
+
+
+	def _getVirtualRows(self):
+		return self._virtualRows
+
+	def _setVirtualRows(self, val):
+		if self._constructed():
+			val = bool(val)
+			if val != self._virtualRows:
+				if val:
+					self._editableBeforeVirtual = self.IsEditable()
+					self.EnableEditing(False)
+				else:
+					self.EnableEditing(self._editableBeforeVirtual)
+				self._virtualRows = val
+				self._dataWindow = None
+				self.fillGrid(True)
+				self._syncCurrentRow()
+		else:
+			self._properties["VirtualRows"] = val
+
+
 	def _getTable(self):
 		## pkm: we can't call this until after the grid is fully constructed. Need to fix.
 		try:
@@ -5190,6 +5516,17 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 			_("""When True, changing the VerticalHeaders property will adjust the HeaderHeight
 			to accommodate the rotated labels. Default=False.  (bool)"""))
 
+	AutoSizeSampleSize = property(_getAutoSizeSampleSize, _setAutoSizeSampleSize, None,
+			_("""Maximum number of values of a column that are measured to auto-size
+			it: those of the visible rows, the longest ones and a random selection of
+			the rest. Columns without a width are auto-sized after the grid is first
+			painted. Set to 0 to measure every cell when the grid is filled, which can
+			be slow for large data sets. Default=500  (int)"""))
+
+	CellCacheStats = property(_getCellCacheStats, None, None,
+			_("""Statistics of the caches of cell values and attributes: their maximum
+			size, current sizes, and hit and miss counts.  (read-only) (dict)"""))
+
 	CellHighlightWidth = property(_getCellHighlightWidth, _setCellHighlightWidth, None,
 			_("Specifies the width of the cell highlight box."))
 
@@ -5420,6 +5757,20 @@ class dGrid(cm.dControlMixin, wx.grid.Grid):
 	VerticalScrolling = property(_getVerticalScrolling, _setVerticalScrolling, None,
 			_("Is scrolling enabled in the vertical direction?	(bool)"))
 
+	VirtualPageSize = property(_getVirtualPageSize, _setVirtualPageSize, None,
+			_("""Number of rows that are fetched at a time when VirtualRows is True.
+			Default=200  (int)"""))
+
+	VirtualRows = property(_getVirtualRows, _setVirtualRows, None,
+			_("""When True, the grid shows all of the rows of its bizobj's query,
+			instead of the rows that the bizobj has fetched. The rows are counted
+			by the database, and fetched a page at a time as they are scrolled into
+			view; sorting and incremental searches are done by the database. The
+			rows can't be edited, and selecting a row doesn't move the bizobj's
+			record pointer. The bizobj doesn't need to be requeried: dForm.requery()
+			calls refreshDataWindow() instead, so that changes show up once they are
+			saved. Use getDataWindow() to get the records. Default=False  (bool)"""))
+
 	_Table = property(_getTable, _setTable, None,
 			_("Reference to the internal table class  (dGridDataTable)") )
 
@@ -52,8 +52,12 @@ class dReportProgress(dPanel):
 
 
 	def updateProgress(self, val, range_):
-		self.gauge.Range = range_
-		self.gauge.Value = val
+		if range_ is None:
+			# The number of records isn't known for streamed cursors.
+			self.gauge.Pulse()
+		else:
+			self.gauge.Range = range_
+			self.gauge.Value = val
 		self.gauge.refresh()
 
 
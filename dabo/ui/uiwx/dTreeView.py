@@ -15,6 +15,17 @@ import dabo.dColors as dColors
 from dabo.dObject import dObject
 
 
+def _itemKey(itemID):
+	"""Return a hashable value that identifies the tree item, or None if it isn't valid."""
+	if not itemID or not itemID.IsOk():
+		return None
+	try:
+		return int(itemID.m_pItem)
+	except AttributeError:
+		return int(itemID.GetID())
+
+
+
 class dNode(dObject):
 	"""Wrapper class for the tree nodes."""
 	def __init__(self, tree, itemID, parent):
@@ -30,6 +41,8 @@ class dNode(dObject):
 		self._filePath = None
 		# Custom text to display as a tooltip
 		self._toolTipText = None
+		# Have the children been added by the tree's ChildLoader?
+		self._childrenLoaded = True
 		# Add minimal Dabo functionality
 		self.afterInit()
 
@@ -225,6 +238,13 @@ class dNode(dObject):
 		return ret
 
 
+	def _getHasChildren(self):
+		return self.tree.ItemHasChildren(self.itemID)
+
+	def _setHasChildren(self, val):
+		self.tree.SetItemHasChildren(self.itemID, val)
+
+
 	def _getImg(self):
 		return self.tree.getNodeImg(self)
 
@@ -246,6 +266,7 @@ class dNode(dObject):
 
 	def _setObject(self, val):
 		if self._constructed():
+			self.tree._indexObject(self, self._object, val)
 			self._object = val
 		else:
 			self._properties["Object"] = val
@@ -322,6 +343,11 @@ class dNode(dObject):
 	FullCaption = property(_getFullCaption, None, None,
 			_("Full dot-separated string of the captions of this node and its ancestors (read-only) (str)"))
 
+	HasChildren = property(_getHasChildren, _setHasChildren, None,
+			_("""Specifies whether the node shows the button to expand it. It is True
+			when the node has children, and for nodes whose children haven't
+			been added yet by the tree's ChildLoader.  (bool)"""))
+
 	Image = property(_getImg, _setImg, None,
 			_("""Sets the image that is displayed on the node. This is
 			determined by the key value passed, which must refer to an
@@ -370,7 +396,14 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		# Dictionary for tracking images by key value
 		self.__imageList = {}
 		self.nodes = []
+		# Indexes of the nodes, keyed on their item IDs and on the id() of
+		# their Objects, and the lists of the child nodes of each node.
+		self._itemNodes = {}
+		self._objectNodes = {}
+		self._childNodes = {}
 		self._rootNode = None
+		# Function that adds the children of a node on its first expansion
+		self._childLoader = None
 		# Class to use for creating nodes
 		self._nodeClass = dNode
 		# Default size for images added to the tree.
@@ -429,6 +462,7 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		self.Bind(wx.EVT_TREE_SEL_CHANGED, self.__onTreeSel)
 		self.Bind(wx.EVT_TREE_ITEM_COLLAPSED, self.__onTreeItemCollapse)
 		self.Bind(wx.EVT_TREE_ITEM_EXPANDED, self.__onTreeItemExpand)
+		self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.__onTreeItemExpanding)
 		self.Bind(wx.EVT_TREE_ITEM_MENU, self.__onTreeItemContextMenu)
 		self.Bind(wx.EVT_TREE_BEGIN_DRAG, self.__onTreeBeginDrag)
 		self.Bind(wx.EVT_TREE_END_DRAG, self.__onTreeEndDrag)
@@ -477,6 +511,9 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 	def clear(self, clearImageList=False):
 		self.DeleteAllItems()
 		self.nodes = []
+		self._itemNodes = {}
+		self._objectNodes = {}
+		self._childNodes = {}
 		if clearImageList:
 			il = self.GetImageList()
 			if il:
@@ -509,7 +546,7 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		ret = self._rootNode = self.NodeClass(self, itemID, None)
 		if self.ShowRootNode:
 			self.SetItemFont(ret.itemID, self.GetFont())
-		self.nodes.append(ret)
+		self._addNode(ret)
 		return ret
 
 
@@ -522,18 +559,63 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		itemID = self.AppendItem(ndid, txt)
 		ret = self.NodeClass(self, itemID, node)
 		self.SetItemFont(ret.itemID, self.GetFont())
-		self.nodes.append(ret)
+		self._addNode(ret)
 		return ret
 
 
+	def _addNode(self, node):
+		"""Add a new node to the node list and the indexes."""
+		self.nodes.append(node)
+		self._itemNodes[_itemKey(node.itemID)] = node
+		self._childNodes.setdefault(node.parent, []).append(node)
+		if self._childLoader is not None:
+			# The children will be added when the node is first expanded.
+			node._childrenLoaded = False
+			self.SetItemHasChildren(node.itemID, True)
+
+
+	def _indexObject(self, node, oldObj, newObj):
+		"""Update the index of nodes by Object when the node's Object changes."""
+		if oldObj is not None:
+			nds = self._objectNodes.get(id(oldObj))
+			if nds and node in nds:
+				nds.remove(node)
+				if not nds:
+					del self._objectNodes[id(oldObj)]
+		if newObj is not None:
+			self._objectNodes.setdefault(id(newObj), []).append(node)
+
+
 	def removeNode(self, node):
+		removed = [node] + self.getDescendents(node)
+		for nd in removed:
+			self._itemNodes.pop(_itemKey(nd.itemID), None)
+			self._childNodes.pop(nd, None)
+			self._indexObject(nd, nd._object, None)
+		sibs = self._childNodes.get(node.parent)
+		if sibs and node in sibs:
+			sibs.remove(node)
 		self.Delete(node.itemID)
-		for n in node.Descendents:
-			self.nodes.remove(n)
-		self.nodes.remove(node)
+		gone = set(removed)
+		self.nodes[:] = [nd for nd in self.nodes if nd not in gone]
+
+
+	def loadChildren(self, node):
+		"""
+		For nodes that were added while ChildLoader was set, call ChildLoader
+		to add the node's children, unless that has already been done. This
+		happens automatically when the node is first expanded.
+		"""
+		if node._childrenLoaded or self._childLoader is None:
+			return
+		node._childrenLoaded = True
+		self._childLoader(node)
+		if not self._childNodes.get(node):
+			self.SetItemHasChildren(node.itemID, False)
 
 
 	def expand(self, node):
+		self.loadChildren(node)
 		self.Expand(node.itemID)
 
 
@@ -648,10 +730,10 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 
 	def nodeForObject(self, obj):
 		"""Given an object, returns the corresponding node."""
-		try:
-			return [nd for nd in self.nodes	if nd._object is obj][0]
-		except IndexError:
-			return None
+		nds = self._objectNodes.get(id(obj))
+		if nds:
+			return nds[0]
+		return None
 
 
 	def getParentNode(self, node):
@@ -659,34 +741,26 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		Returns the node that is the parent of the given node, or
 		None if the node is the root.
 		"""
-		parentID = self.GetItemParent(node.itemID)
-		ret = self.find(parentID)
-		if ret:
-			if isinstance(ret, list):
-				ret = ret[0]
-		else:
-			ret = None
-		return ret
+		return self.getNodeForID(self.GetItemParent(node.itemID))
 
 
 	def getChildren(self, node):
 		"""Returns a list of all nodes that are child nodes of this node."""
-		ret = [n for n in self.nodes
-				if n.parent == node]
-		return ret
+		return list(self._childNodes.get(node, []))
 
 
 	def getDescendents(self, node):
-		"""Returns a list of all nodes that are direct descendents of this node."""
+		"""
+		Returns a list of all nodes that are direct descendents of this node,
+		in tree order.
+		"""
 		ret = []
-		for n in self.nodes:
-			par = n.parent
-			while par:
-				if par == node:
-					ret.append(n)
-					break
-				else:
-					par = par.parent
+		childNodes = self._childNodes
+		stack = childNodes.get(node, [])[::-1]
+		while stack:
+			nd = stack.pop()
+			ret.append(nd)
+			stack.extend(childNodes.get(nd, [])[::-1])
 		return ret
 
 
@@ -695,9 +769,7 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		Returns a list of all nodes at the same level as the specified
 		node. The specified node is included in the list.
 		"""
-		ret = [n for n in self.nodes
-				if n.parent == node.parent]
-		return ret
+		return list(self._childNodes.get(node.parent, []))
 
 
 	def find(self, srch, top=None):
@@ -711,6 +783,18 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		Returns a list of matching nodes.
 		"""
 		ret = []
+		if isinstance(srch, wx.TreeItemId):
+			nd = self.getNodeForID(srch)
+			if nd is not None and top is not None:
+				# Make sure that it descends from 'top'
+				par = nd.parent
+				while par is not None and par is not top:
+					par = par.parent
+				if par is None:
+					nd = None
+			if nd is not None:
+				ret = [nd]
+			return ret
 		if top is None:
 			nodes = self.nodes
 		else:
@@ -718,9 +802,6 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		if isinstance(srch, basestring):
 			ret = [n for n in nodes
 				if n.Caption == srch ]
-		elif isinstance(srch, wx.TreeItemId):
-			ret = [n for n in nodes
-				if n.itemID == srch ]
 		return ret
 
 
@@ -838,18 +919,12 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 			else:
 				# Empty list
 				return None
-		try:
-			itemID = func(nd.itemID)
-			ret = [nod for nod in self.nodes
-					if nod.itemID == itemID][0]
-		except IndexError:
-			ret = None
-		return ret
+		return self.getNodeForID(func(nd.itemID))
 	# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
 	def makeDirTree(self, dirPath, wildcard=None, ignored=None,
-			showHidden=False, expand=False):
+			showHidden=False, expand=False, lazy=False):
 		"""
 		Make this dTreeView show a filesystem directory hierarchy. You
 		can specify a wildcard pattern: e.g., "\*py" will only include files
@@ -868,10 +943,13 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		The tree defaults to fully collapsed; you can change it to fully
 		expanded by passing True in the 'expand' parameter.
 
-		Warning: Don't use this for huge hierarchies, as it blocks while
-		filling the complete tree, instead of only filling the nodes as
-		they are opened.
+		Filling the complete tree blocks until the whole hierarchy has been
+		read. For huge hierarchies, pass True in the 'lazy' parameter: the
+		contents of each directory are then read when its node is first
+		expanded, using the ChildLoader property, and 'expand' only expands
+		the top directory.
 		"""
+		self.ChildLoader = None
 		self.clear(clearImageList=True)
 		# Add the standard images for a directory tree
 		self.addImage("folder", "folder")
@@ -879,6 +957,23 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		self.addImage("normalfile", "file")
 		self.addImage("executablefile", "executablefile")
 
+		if wildcard and not isinstance(wildcard, (list, tuple)):
+			# single string passed
+			wildcard = [wildcard]
+		if ignored and not isinstance(ignored, (list, tuple)):
+			# single string passed
+			ignored = [ignored]
+		arg = (wildcard, ignored, showHidden)
+		if lazy:
+			self._dirTreeArgs = arg
+			dirPath = os.path.normpath(dirPath)
+			if showHidden or not os.path.basename(dirPath).startswith("."):
+				self.ChildLoader = self._loadDirNode
+				root = self._addDirNode(None, dirPath)
+				if expand:
+					self.expand(root)
+			return
+
 		# Add any trailing slash character
 		self._pathNode = {}
 		# Define the function to be passed to os.path.walk
@@ -887,64 +982,94 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 			prnt, nm = os.path.split(currDir)
 			if not showHid and nm.startswith("."):
 				return
-			try:
-				nd = self._pathNode[currDir] = self._pathNode[prnt].appendChild(nm)
-			except (KeyError, AttributeError):
-				# If this is the first entry, we need to set the root
-				if not self._pathNode:
-					nd = self._pathNode[currDir] = self.setRootNode(nm)
-				else:
+			if self._pathNode:
+				prntNode = self._pathNode.get(prnt)
+				if prntNode is None:
 					# parent wasn't added, because it was hidden
 					return
-			self.setNodeImg(nd, "folder", "normal")
-			self.setNodeImg(nd, "folderopen", "expanded")
-			nd.ToolTipText = nd._filePath = currDir
-			acceptedNames = ignoredNames = None
-			if wildcards is not None:
-				acceptedNames = []
-				for wc in wildcards:
-					acceptedNames += glob.glob(os.path.join(currDir, wc.lower()))
-					acceptedNames += glob.glob(os.path.join(currDir, wc.upper()))
-			if ignored is not None:
-				ignoredNames = []
-				for ig in ignored:
-					ignoredNames += glob.glob(os.path.join(currDir, ig.lower()))
-					ignoredNames += glob.glob(os.path.join(currDir, ig.upper()))
-			for f in fNames:
-				fullName = os.path.join(currDir, f)
-				if os.path.isdir(fullName):
-					# it will be added as a directory
-					continue
-				if not showHid and f.startswith("."):
-					continue
-				if acceptedNames is not None:
-					if fullName not in acceptedNames:
-						continue
-				if ignoredNames is not None:
-					if fullName in ignoredNames:
-						continue
-				kid = nd.appendChild(f)
-				kid._filePath = fullName
-				self.setNodeImg(kid, "file", "normal")
-				kid.ToolTipText = fullName
+			else:
+				# If this is the first entry, we need to set the root
+				prntNode = None
+			nd = self._pathNode[currDir] = self._addDirNode(prntNode, currDir)
+			self._addFileNodes(nd, currDir, fNames, arg)
 
 		def sortNode(arg, currDir, fNames):
 			if currDir in self._pathNode:
 				self.SortChildren(self._pathNode[currDir].itemID)
 
-		if wildcard and not isinstance(wildcard, (list, tuple)):
-			# single string passed
-			wildcard = [wildcard]
-		if ignored and not isinstance(ignored, (list, tuple)):
-			# single string passed
-			ignored = [ignored]
-		arg = (wildcard, ignored, showHidden)
 		os.path.walk(dirPath, addNode, arg)
 		os.path.walk(dirPath, sortNode, None)
 		if expand:
 			self.expandAll()
 
 
+	def _addDirNode(self, prntNode, currDir):
+		"""Add the node for a directory; it is the root node if prntNode is None."""
+		nm = os.path.basename(currDir) or currDir
+		if prntNode is None:
+			nd = self.setRootNode(nm)
+		else:
+			nd = prntNode.appendChild(nm)
+		self.setNodeImg(nd, "folder", "normal")
+		self.setNodeImg(nd, "folderopen", "expanded")
+		nd.ToolTipText = nd._filePath = currDir
+		return nd
+
+
+	def _addFileNodes(self, nd, currDir, fNames, arg):
+		"""Add the nodes for the files in the directory that pass the filters."""
+		wildcards, ignored, showHid = arg
+		acceptedNames = ignoredNames = None
+		if wildcards is not None:
+			acceptedNames = []
+			for wc in wildcards:
+				acceptedNames += glob.glob(os.path.join(currDir, wc.lower()))
+				acceptedNames += glob.glob(os.path.join(currDir, wc.upper()))
+			acceptedNames = set(acceptedNames)
+		if ignored is not None:
+			ignoredNames = []
+			for ig in ignored:
+				ignoredNames += glob.glob(os.path.join(currDir, ig.lower()))
+				ignoredNames += glob.glob(os.path.join(currDir, ig.upper()))
+			ignoredNames = set(ignoredNames)
+		for f in fNames:
+			fullName = os.path.join(currDir, f)
+			if os.path.isdir(fullName):
+				# it will be added as a directory
+				continue
+			if not showHid and f.startswith("."):
+				continue
+			if acceptedNames is not None:
+				if fullName not in acceptedNames:
+					continue
+			if ignoredNames is not None:
+				if fullName in ignoredNames:
+					continue
+			kid = nd.appendChild(f)
+			kid._filePath = fullName
+			kid.HasChildren = False
+			self.setNodeImg(kid, "file", "normal")
+			kid.ToolTipText = fullName
+
+
+	def _loadDirNode(self, nd):
+		"""ChildLoader for the directory trees made by makeDirTree(lazy=True)."""
+		currDir = nd._filePath
+		if currDir is None or not os.path.isdir(currDir):
+			return
+		try:
+			fNames = os.listdir(currDir)
+		except OSError:
+			return
+		showHid = self._dirTreeArgs[2]
+		for f in fNames:
+			fullName = os.path.join(currDir, f)
+			if os.path.isdir(fullName) and (showHid or not f.startswith(".")):
+				self._addDirNode(nd, fullName)
+		self._addFileNodes(nd, currDir, fNames, self._dirTreeArgs)
+		self.SortChildren(nd.itemID)
+
+
 	def _setAbsoluteFontZoom(self, newZoom):
 		self._currFontZoom = newZoom
 		for node in self.nodes:
@@ -974,7 +1099,7 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		"""
 		addRoot = (topNode is None)
 		if addRoot:
-			self.DeleteAllItems()
+			self.clear()
 		if isinstance(stru[0], basestring):
 			# We're at the end of the recursion. Just append the node
 			self.appendNode(topNode, stru[0])
@@ -1022,12 +1147,7 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 
 	def getNodeForID(self, idval):
 		"""Given a wx item ID, returns the corresponding node, or None."""
-		try:
-			ret = [nd for nd in self.nodes
-					if nd.itemID == idval][0]
-		except IndexError:
-			ret = None
-		return ret
+		return self._itemNodes.get(_itemKey(idval))
 
 
 	def getNodeUnderMouse(self, includeSpace=False, includeButton=True):
@@ -1080,6 +1200,11 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		self.raiseEvent(dEvents.TreeItemCollapse, evt)
 	def __onTreeItemExpand(self, evt):
 		self.raiseEvent(dEvents.TreeItemExpand, evt)
+	def __onTreeItemExpanding(self, evt):
+		evt.Skip()
+		nd = self.getNodeForID(evt.GetItem())
+		if nd is not None:
+			self.loadChildren(nd)
 
 
 	def __onTreeMouseMove(self, evt):
@@ -1101,9 +1226,17 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 		if self.ShowRootNode:
 			return [self._rootNode]
 		else:
-			return [nd for nd in self.nodes
-					if nd.parent is not None
-					and nd.parent.IsRootNode]
+			return self.getChildren(self._rootNode)
+
+
+	def _getChildLoader(self):
+		return self._childLoader
+
+	def _setChildLoader(self, val):
+		if self._constructed():
+			self._childLoader = val
+		else:
+			self._properties["ChildLoader"] = val
 
 
 	def _getEditable(self):
@@ -1159,19 +1292,10 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 
 	def _getSelection(self):
 		if self.MultipleSelect:
-			ids = self.GetSelections()
-			ret = [node for node in self.nodes
-					if node.itemID in ids]
+			ret = [self.getNodeForID(itemID) for itemID in self.GetSelections()]
+			ret = [node for node in ret if node is not None]
 		else:
-			itemID = self.GetSelection()
-			if itemID:
-				try:
-					ret = [n for n in self.nodes
-							if n.itemID == itemID][0]
-				except IndexError:
-					ret = None
-			else:
-				ret = None
+			ret = self.getNodeForID(self.GetSelection())
 		return ret
 
 	def _setSelection(self, node):
@@ -1276,6 +1400,14 @@ class dTreeView(dcm.dControlMixin, wx.TreeCtrl):
 			returns all the nodes who are not children of other nodes
 			(read-only) (list of nodes)"""))
 
+	ChildLoader = property(_getChildLoader, _setChildLoader, None,
+			_("""Function that adds the children of a node when it is first expanded,
+			so that large hierarchies are only loaded as they are browsed. It is
+			called with the node, and adds the children with node.appendChild().
+			Nodes that are added while ChildLoader is set are shown as expandable
+			until they are loaded; set their HasChildren to False if they are known
+			to have no children. Default=None  (function)"""))
+
 	Editable = property(_getEditable, _setEditable, None,
 		_("""Specifies whether the tree labels can be edited by the user."""))
 